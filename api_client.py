@@ -2,88 +2,576 @@ import asyncio
 import time
 import json
 import httpx # Using httpx for async HTTP requests
+from request_template import compile_request
+from token_manager import TokenManager
+from response_cache import cache_key
+from circuit_breaker import CircuitBreaker
 import logging # Import logging module
+import threading
+import collections
+import functools
+import random
+import email.utils
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Simple rate limiter (reusing the existing structure)
+SUPPORTED_METHODS = ("GET", "POST", "PUT", "DELETE", "PATCH")
+DEFAULT_RETRY_BUDGET_RATIO = 0.1 # retries may add at most 10% on top of first attempts
+DEFAULT_RETRY_BUDGET_RESERVE = 10 # retries always allowed at start, before any traffic
+DEFAULT_MAX_BACKOFF = 30 # seconds, cap for the exponential backoff
+DEFAULT_MAX_RETRY_AFTER = 60 # seconds; longer Retry-After values end the request instead
+DEFAULT_CONNECTION_POOL = {"max_connections": 100, "max_keepalive": 20, "keepalive_expiry": 30.0, "http2": False}
+
+try:
+    import h2 # noqa: F401 -- optional, enables HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header (delay in seconds or an HTTP date).
+
+    Returns:
+        Seconds to wait (>= 0), or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of first attempts.
+
+    Every request deposits `ratio` of a retry and every retry withdraws one,
+    so across an outage retries add at most `ratio` extra load instead of
+    multiplying it by the attempt count. `reserve` retries are available
+    up front (and the balance never grows beyond it) so a quiet API can
+    still retry its first few failures.
+    """
+
+    def __init__(self, ratio: float = DEFAULT_RETRY_BUDGET_RATIO, reserve: float = DEFAULT_RETRY_BUDGET_RESERVE):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = float(reserve)
+
+    @classmethod
+    def from_config(cls, api_config):
+        """Builds a budget from api_config['retry_budget'] ({ratio, reserve}), with defaults."""
+        settings = api_config.get("retry_budget") or {}
+        return cls(ratio=settings.get("ratio", DEFAULT_RETRY_BUDGET_RATIO),
+                   reserve=settings.get("reserve", DEFAULT_RETRY_BUDGET_RESERVE))
+
+    def record_request(self):
+        self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Takes one retry from the budget; False if none is left."""
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class TokenBucket:
+    """
+    Token bucket in its GCRA form: one "theoretical arrival time" per bucket.
+
+    A request conforms at time t if t >= tat - tolerance, where tolerance
+    allows `burst` back-to-back requests; each granted request pushes tat one
+    emission interval (period / rate) further. Reservations are plain
+    arithmetic, so the caller can hold a lock while reserving and sleep
+    without it, and the configured rate is delivered exactly.
+    """
+
+    def __init__(self, rate: float, period: float, burst: float = None):
+        if rate <= 0 or period <= 0:
+            raise ValueError("Rate limit rate and period must be positive")
+        self.rate = rate
+        self.period = period
+        self.burst = max(1.0, burst if burst else rate) # default burst: one full period, as before
+        self.interval = period / rate
+        self._tolerance = (self.burst - 1) * self.interval
+        self._tat = None
+
+    def earliest(self, t: float) -> float:
+        """Earliest time >= t at which a request would conform (does not reserve)."""
+        if self._tat is None:
+            return t
+        return max(t, self._tat - self._tolerance)
+
+    def commit(self, t: float):
+        """Records a request granted at time t (which must conform)."""
+        self._tat = max(self._tat if self._tat is not None else t, t) + self.interval
+
+
 class RateLimiter:
-    def __init__(self, rate: int, period: int):
+    """
+    Hierarchical rate limiter: a global budget plus optional per-API budgets.
+
+    wait_for_permission() first reserves the API's own next slot and sleeps
+    until it is due, then reserves the earliest conforming global slot and
+    sleeps until that one, never holding a lock while sleeping. A request
+    only takes global budget once its API budget lets it go, so requests
+    queued behind a slow per-API limit do not push the global schedule ahead
+    of other APIs. Reservations are handed out in call order, so waiters are
+    served FIFO and the configured rates are delivered exactly, however many
+    coroutines are waiting. `clock` and `sleep` can be replaced by a virtual
+    clock in tests.
+    """
+
+    def __init__(self, rate: float, period: float, burst: float = None, api_limits: dict = None,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        """
+        Args:
+            rate: Global requests per period
+            period: Global period in seconds
+            burst: Global burst size (defaults to `rate`)
+            api_limits: Optional {api_name: {"rate": ..., "period": ..., "burst": ...}}
+            clock: Monotonic clock function
+            sleep: Coroutine function used to wait
+        """
         self.rate = rate # requests per period
         self.period = period # seconds
-        self._allowance = rate
-        self._last_check = time.monotonic()
-        self._lock = asyncio.Lock()
-
-    async def wait_for_permission(self):
-        async with self._lock:
-            now = time.monotonic()
-            elapsed = now - self._last_check
-            self._last_check = now
-            self._allowance += elapsed * (self.rate / self.period)
-            if self._allowance > self.rate:
-                self._allowance = self.rate # cap allowance
-
-            if self._allowance < 1.0:
-                sleep_time = (1.0 - self._allowance) * (self.period / self.rate)
-                logging.info(f"Rate limit exceeded, sleeping for {sleep_time:.2f} seconds.")
-                await asyncio.sleep(sleep_time)
-                self._allowance = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock() # held only while reserving, never while sleeping
+        self._global = TokenBucket(rate, period, burst)
+        self._api_buckets = {}
+        for api_name, limits in (api_limits or {}).items():
+            self.set_api_limit(api_name, limits.get("rate"), limits.get("period", 1), limits.get("burst"))
+
+    def set_api_limit(self, api_name: str, rate: float, period: float = 1, burst: float = None):
+        """Adds or replaces the budget of one API (a falsy rate removes it)."""
+        with self._lock:
+            if rate:
+                self._api_buckets[api_name] = TokenBucket(rate, period, burst)
+            else:
+                self._api_buckets.pop(api_name, None)
+
+    def reserve_api(self, api_name: str = None) -> float:
+        """Reserves the next slot of api_name's own budget and returns how long to wait for it (0 without one)."""
+        with self._lock:
+            bucket = self._api_buckets.get(api_name)
+            if bucket is None:
+                return 0.0
+            now = self._clock()
+            start = bucket.earliest(now)
+            bucket.commit(start)
+        return start - now
+
+    def reserve_global(self) -> float:
+        """Reserves the next global slot and returns how long to wait for it (seconds)."""
+        with self._lock:
+            now = self._clock()
+            start = self._global.earliest(now)
+            self._global.commit(start)
+        return start - now
+
+    def time_until_available(self, api_name: str = None) -> float:
+        """Seconds until a request for api_name would be granted, without reserving."""
+        with self._lock:
+            now = self._clock()
+            start = self._global.earliest(now)
+            bucket = self._api_buckets.get(api_name)
+            if bucket:
+                start = max(start, bucket.earliest(now))
+        return start - now
+
+    async def wait_for_permission(self, api_name: str = None):
+        delay = self.reserve_api(api_name)
+        if delay > 0:
+            logging.debug(f"Rate limit for {api_name} reached, waiting {delay:.2f} seconds.")
+            await self._sleep(delay)
+        delay = self.reserve_global()
+        if delay > 0:
+            logging.debug(f"Global rate limit reached, waiting {delay:.2f} seconds.")
+            await self._sleep(delay)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Per-API concurrency limit tuned by AIMD (additive increase, multiplicative decrease).
+
+    Each finished request is a sample. While latency stays within
+    `latency_tolerance` times the best observed latency and the API does not
+    answer 429/5xx or time out, the limit grows by about one per round trip
+    of fully-used slots (+1/limit per sample). Overload signals cut it by
+    `backoff`, at most once per round trip, so the limit settles near the
+    highest concurrency the API sustains.
+    """
+
+    BASELINE_DRIFT = 0.001 # lets the latency baseline creep up if the API gets slower for good
+
+    def __init__(self, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 100,
+                 backoff: float = 0.7, latency_tolerance: float = 2.0, clock=time.monotonic):
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self._clock = clock
+        self._in_flight = 0
+        self._waiters = collections.deque()
+        self._baseline = None
+        self._last_decrease = float('-inf')
+
+    @classmethod
+    def from_config(cls, api_config):
+        """Builds a limiter from api_config['adaptive_concurrency'], or returns None if disabled."""
+        settings = api_config.get("adaptive_concurrency") or {}
+        if not settings.get("enabled"):
+            return None
+        return cls(initial_limit=settings.get("initial", 4), min_limit=settings.get("min", 1),
+                   max_limit=settings.get("max", 100))
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def acquire(self):
+        if self._in_flight < int(self.limit) and not self._waiters:
+            self._in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter # the slot is handed over by release()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._in_flight -= 1
+                self._wake()
             else:
-                self._allowance -= 1.0
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, latency: float, overloaded: bool):
+        """Frees a slot and feeds the outcome of the request into the limit."""
+        self._in_flight -= 1
+        self._on_sample(latency, overloaded)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def _on_sample(self, latency, overloaded):
+        now = self._clock()
+        if self._baseline is None:
+            self._baseline = latency
+        else:
+            self._baseline = min(latency, self._baseline * (1 + self.BASELINE_DRIFT))
+
+        congested = overloaded or latency > self._baseline * self.latency_tolerance
+        if congested:
+            # A burst of failures from one round trip only counts once
+            if now - self._last_decrease >= max(latency, self._baseline):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        elif self._in_flight + 1 >= int(self.limit):
+            # Only probe upward while the current limit is actually in use
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class ConnectionStats:
+    """
+    Connection reuse counters for one ApiClient, fed by httpx's trace extension.
+
+    Every request that did not open a TCP connection went over a kept-alive
+    (or, with HTTP/2, multiplexed) connection, so reuse_rate shows how well
+    the connect and TLS handshakes are amortized.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.http2_requests = 0
+
+    async def trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+        elif event_name == "http11.send_request_headers.started":
+            self.requests += 1
+        elif event_name == "http2.send_request_headers.started":
+            self.requests += 1
+            self.http2_requests += 1
+
+    @property
+    def reuse_rate(self):
+        """Fraction of requests sent over an already open connection."""
+        return max(0, self.requests - self.connections_opened) / self.requests if self.requests else 0
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "http2_requests": self.http2_requests,
+            "reuse_rate": self.reuse_rate
+        }
+
+
+def build_http_client(api_config, timeout):
+    """
+    Pooled httpx.AsyncClient for an API config.
+
+    Pool size, keep-alive and HTTP/2 come from api_config['connection_pool']
+    ({max_connections, max_keepalive, keepalive_expiry, http2}); TLS settings
+    from 'disable_ssl_verify' and auth_config['cert_path']. A max_keepalive of 0
+    closes every connection after its request; a missing value uses the
+    default. HTTP/2 needs the optional h2 package and falls back to HTTP/1.1
+    without it.
+    """
+    pool = dict(DEFAULT_CONNECTION_POOL)
+    pool.update({key: value for key, value in (api_config.get("connection_pool") or {}).items() if value is not None})
+    http2 = bool(pool.get("http2"))
+    if http2 and not HTTP2_AVAILABLE:
+        logging.warning(f"HTTP/2 requested for {api_config.get('name', 'Unnamed API')} but the h2 package "
+                        "is not installed (pip install httpx[http2]). Using HTTP/1.1.")
+        http2 = False
+    auth_config = api_config.get("auth_config", {}) or {}
+    return httpx.AsyncClient(
+        timeout=timeout,
+        verify=not api_config.get("disable_ssl_verify", False),
+        cert=auth_config.get("cert_path") or None,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=pool.get("max_connections") or None,
+            max_keepalive_connections=pool["max_keepalive"],
+            keepalive_expiry=pool.get("keepalive_expiry")
+        )
+    )
+
 
 class ApiClient:
-    def __init__(self, api_config, global_rate_limiter: RateLimiter, timeout: int = 30):
+    def __init__(self, api_config, global_rate_limiter: RateLimiter, timeout: int = 30, response_cache=None,
+                 coalescer=None):
+        """
+        Args:
+            api_config: API configuration from the Configuration page
+            global_rate_limiter: RateLimiter shared by all clients of a run
+            timeout: Request timeout in seconds
+            response_cache: Optional response_cache.ResponseCache answering repeated requests
+            coalescer: Optional request_coalescer.RequestCoalescer sharing identical in-flight requests
+        """
         self.api_config = api_config
+        self.response_cache = response_cache
+        self.coalescer = coalescer
+        self.circuit_breaker = CircuitBreaker.from_config(api_config)
+        self.waiting_for_rate_limit = 0 # requests currently waiting in wait_for_permission
         self.global_rate_limiter = global_rate_limiter
         self.timeout = timeout # Request timeout in seconds
-        self.client = httpx.AsyncClient(timeout=self.timeout) # Use a single client instance with timeout
+        self.connection_stats = ConnectionStats()
+        # One pooled client per API: connections are kept alive and reused across requests
+        self.client = build_http_client(api_config, self.timeout)
+        # Optional AIMD concurrency control driven by 429/5xx/timeouts and latency
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter.from_config(api_config)
+        self.retry_budget = RetryBudget.from_config(api_config)
+        self.template = None # RequestTemplate, compiled on first use
+        # Fetches and refreshes the bearer token when an auth endpoint is configured
+        self.token_manager = TokenManager.from_config(api_config, self.client)
+        self.retry_budget_exhausted = 0 # retries refused by the budget
+        self.max_backoff = DEFAULT_MAX_BACKOFF
+        self.max_retry_after = DEFAULT_MAX_RETRY_AFTER
+
+    def build_request(self, question: str, token: str = None):
+        """Builds (method, url, headers, payload_data) for a question from the compiled API config."""
+        if self.template is None:
+            self.template = compile_request(self.api_config) # parsed once, see request_template
+        if token is None:
+            # Add auth token if available (same convention as the Configuration page)
+            token = (self.api_config.get("auth_config", {}) or {}).get("current_token")
+        return self.template.render(question, token=token)
 
     async def call_api(self, question: str, retries: int = 3, backoff_factor: float = 0.5):
-        await self.global_rate_limiter.wait_for_permission() # Wait for global rate limit
+        """Calls the API and returns (response_data, latency, payload_size, status_code, success, completion_time)."""
+        result = await self.call_api_detailed(question, retries=retries, backoff_factor=backoff_factor)
+        return (result["response"], result["latency"], result["payload_size"],
+                result["status_code"], result["success"], result["completion_time"])
+
+    async def _send(self, method, url, headers, payload_data):
+        """Sends one attempt, holding an adaptive concurrency slot if enabled."""
+        kwargs = {"headers": headers, "extensions": {"trace": self.connection_stats.trace}}
+        if method == "GET":
+            kwargs["params"] = payload_data if isinstance(payload_data, dict) else None # Use params for GET
+        elif isinstance(payload_data, dict):
+            kwargs["json"] = payload_data
+        else:
+            kwargs["content"] = payload_data
 
-        url = self.api_config.get("url")
-        method = self.api_config.get("method", "POST").upper()
-        headers = json.loads(self.api_config.get("headers", "{}"))
-        payload_template = self.api_config.get("payload", "")
+        limiter = self.concurrency_limiter
+        if limiter is None:
+            return await self.client.request(method, url, **kwargs)
+
+        await limiter.acquire()
+        start_time = time.monotonic()
+        overloaded = True # timeouts and connection errors count as overload
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            overloaded = response.status_code == 429 or response.status_code >= 500
+            return response
+        finally:
+            limiter.release(time.monotonic() - start_time, overloaded)
+
+    def _retry_delay(self, attempt, retries, backoff_factor, retry_after=None):
+        """
+        Decides whether a failed attempt is retried.
+
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+            (attempts used up, retry budget spent, or Retry-After too long)
+        """
         api_name = self.api_config.get("name", "Unnamed API")
+        if attempt >= retries - 1:
+            logging.error(f"Max retries reached for {api_name}.")
+            return None
+        if retry_after is not None and retry_after > self.max_retry_after:
+            logging.error(f"{api_name} asked to retry after {retry_after:.0f}s (more than {self.max_retry_after}s). Not retrying.")
+            return None
+        if not self.retry_budget.try_spend():
+            self.retry_budget_exhausted += 1
+            logging.error(f"Retry budget for {api_name} exhausted. Not retrying.")
+            return None
+        # Full jitter keeps clients that failed together from retrying together
+        sleep_time = random.uniform(0, min(self.max_backoff, backoff_factor * (2 ** attempt)))
+        if retry_after is not None:
+            sleep_time = max(sleep_time, retry_after)
+        logging.info(f"Retrying in {sleep_time:.2f} seconds...")
+        return sleep_time
+
+    def _result(self, request, response_data, latency, payload_size, status_code, success, completion_time,
+                response_headers=None, retries=0, cached=False, shed=False):
+        return {
+            "request": request,
+            "response": response_data,
+            "response_headers": response_headers or {},
+            "latency": latency,
+            "payload_size": payload_size,
+            "status_code": status_code,
+            "success": success,
+            "completion_time": completion_time,
+            "concurrency_limit": self.concurrency_limiter.limit if self.concurrency_limiter else None,
+            "retries": retries,
+            "retry_budget_exhausted": self.retry_budget_exhausted,
+            "connection_stats": self.connection_stats.to_dict(),
+            "cached": cached,
+            "coalesced": False,
+            "shed": shed,
+            "breaker_state": self.circuit_breaker.state if self.circuit_breaker else None,
+        }
+
+    async def call_api_detailed(self, question: str, retries: int = 3, backoff_factor: float = 0.5):
+        """
+        Calls the API for a single question.
+
+        Returns:
+            Dict with the request that was sent, the parsed response (or {"error": ...}),
+            response headers, latency (of the last attempt only), payload_size, status_code,
+            success, completion_time, concurrency_limit (None unless adaptive concurrency
+            is enabled), retries made, the client's running retry_budget_exhausted count,
+            connection_stats, cached (True if answered from the response cache) and
+            coalesced (True if an identical in-flight request's answer was shared), shed
+            (True if the circuit breaker refused the call) and breaker_state; for cached,
+            coalesced and shed results latency is 0 and no request was sent.
+        """
+        api_name = self.api_config.get("name", "Unnamed API")
+        token = await self.token_manager.get_token() if self.token_manager else None
+        method, url, headers, payload_data = self.build_request(question, token)
+        request = {"method": method, "url": url, "headers": headers, "payload": payload_data}
+
+        if method not in SUPPORTED_METHODS:
+            error_message = f"Unsupported HTTP method: {method}"
+            logging.error(error_message)
+            return self._result(request, {"error": error_message}, 0, 0, None, False, time.monotonic())
+
+        key = None
+        if self.response_cache is not None or self.coalescer is not None:
+            key = cache_key(api_name, method, url, payload_data)
+        if self.response_cache is not None:
+            # Identical rendered requests are answered from the cache without spending rate budget
+            entry = self.response_cache.get(key)
+            if entry is not None:
+                return self._result(request, entry["response"], 0, entry["payload_size"], entry["status_code"], True,
+                                    time.monotonic(), entry["response_headers"], cached=True)
+
+        call = functools.partial(self._call_upstream, request, token, key, retries, backoff_factor)
+        if self.coalescer is None:
+            return await call()
+        result, coalesced = await self.coalescer.run(key, call)
+        if coalesced:
+            # Same answer as a concurrent identical request; no request of our own was sent
+            return {**result, "request": request, "latency": 0, "retries": 0, "coalesced": True}
+        return result
 
-        # Construct the payload from template and question
-        payload_data = None
+    async def _call_upstream(self, request, token, key, retries, backoff_factor):
+        """Sends a built request unless the API's circuit breaker is open; see call_api_detailed."""
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return await self._send_with_retries(request, token, key, retries, backoff_factor)
+        if not breaker.allow():
+            # Fail fast instead of spending rate budget and a timeout on an API that is down
+            return self._result(request, {"error": f"Circuit breaker open for {self.api_config.get('name', 'Unnamed API')}"},
+                                0, 0, None, False, time.monotonic(), shed=True)
         try:
-            # Assuming payload_template is a JSON string with a placeholder like "{question}"
-            payload = payload_template.replace("{question}", json.dumps(question))
-            # Attempt to parse as JSON if method is POST/PUT/PATCH
-            if method in ["POST", "PUT", "PATCH"]:
-                 payload_data = json.loads(payload)
-            else:
-                 payload_data = None # GET/DELETE methods typically don't have bodies
-        except json.JSONDecodeError:
-            # If payload template is not valid JSON after replacement, send as plain text for POST/PUT/PATCH
-            if method in ["POST", "PUT", "PATCH"]:
-                 payload_data = payload
-            else:
-                 payload_data = None
-            logging.warning(f"Could not parse payload as JSON for API {api_name}. Sending as is.")
+            result = await self._send_with_retries(request, token, key, retries, backoff_factor)
+        except BaseException:
+            breaker.release()
+            raise
+        status_code = result["status_code"]
+        breaker.record(status_code is None or status_code >= 500)
+        result["breaker_state"] = breaker.state
+        return result
+
+    async def _wait_for_rate_limit(self, api_name):
+        """Waits for a global and per-API rate limit slot for one attempt."""
+        self.waiting_for_rate_limit += 1 # lets a scheduler avoid parking more workers on this API
+        try:
+            await self.global_rate_limiter.wait_for_permission(api_name)
+        finally:
+            self.waiting_for_rate_limit -= 1
 
+    async def _send_with_retries(self, request, token, key, retries, backoff_factor):
+        """Sends a built request with rate limiting, retries and token refresh."""
+        api_name = self.api_config.get("name", "Unnamed API")
+        method, url, headers, payload_data = request["method"], request["url"], request["headers"], request["payload"]
+        self.retry_budget.record_request()
+        retry_count = 0
+        token_refreshed = False
         for attempt in range(retries):
+            # Every attempt, retries included, takes its own global and per-API rate limit slot
+            await self._wait_for_rate_limit(api_name)
             start_time = time.monotonic()
             try:
-                if method == "GET":
-                    response = await self.client.get(url, headers=headers, params=payload_data) # Use params for GET
-                elif method == "POST":
-                    response = await self.client.post(url, headers=headers, json=payload_data if isinstance(payload_data, dict) else None, content=payload_data if not isinstance(payload_data, dict) else None)
-                elif method == "PUT":
-                    response = await self.client.put(url, headers=headers, json=payload_data if isinstance(payload_data, dict) else None, content=payload_data if not isinstance(payload_data, dict) else None)
-                elif method == "DELETE":
-                    response = await self.client.delete(url, headers=headers, json=payload_data if isinstance(payload_data, dict) else None, content=payload_data if not isinstance(payload_data, dict) else None)
-                elif method == "PATCH":
-                     response = await self.client.patch(url, headers=headers, json=payload_data if isinstance(payload_data, dict) else None, content=payload_data if not isinstance(payload_data, dict) else None)
-                else:
-                    error_message = f"Unsupported HTTP method: {method}"
-                    logging.error(error_message)
-                    return {"error": error_message}, 0, 0, None, False, time.monotonic()
+                response = await self._send(method, url, headers, payload_data)
+                if response.status_code == 401 and self.token_manager and not token_refreshed:
+                    # Token expired mid-run: refresh once (shared with concurrent requests) and resend
+                    token_refreshed = True
+                    logging.info(f"{api_name} answered 401; refreshing token and retrying once.")
+                    token = await self.token_manager.refresh(stale_token=token)
+                    headers = self.template.render_headers(token)
+                    request["headers"] = headers
+                    retry_count += 1
+                    await self._wait_for_rate_limit(api_name)
+                    start_time = time.monotonic()
+                    response = await self._send(method, url, headers, payload_data)
 
                 response.raise_for_status() # Raise an exception for 4xx or 5xx status codes
 
@@ -93,35 +581,39 @@ class ApiClient:
                 status_code = response.status_code
                 response_data = response.json() if response.content else {} # Attempt to parse JSON if content exists
                 success = True
+                if self.response_cache is not None:
+                    self.response_cache.put(key, {"response": response_data, "response_headers": dict(response.headers),
+                                                  "status_code": status_code, "payload_size": payload_size})
 
                 # Return status_code along with other metrics and completion time
-                return response_data, latency, payload_size, status_code, success, completion_time
+                return self._result(request, response_data, latency, payload_size, status_code, success, completion_time,
+                                    dict(response.headers), retry_count)
 
             except httpx.TimeoutException as e:
                 latency = time.monotonic() - start_time
                 completion_time = time.monotonic()
                 error_message = f"Timeout error for {api_name} ({url}): {e}"
                 logging.warning(f"Attempt {attempt + 1} failed: {error_message}")
-                if attempt < retries - 1:
-                    sleep_time = backoff_factor * (2 ** attempt)
-                    logging.info(f"Retrying in {sleep_time:.2f} seconds...")
+                sleep_time = self._retry_delay(attempt, retries, backoff_factor)
+                if sleep_time is not None:
+                    retry_count += 1
                     await asyncio.sleep(sleep_time)
                 else:
-                    logging.error(f"Max retries reached for {api_name} ({url}).")
-                    return {"error": error_message}, latency, 0, None, False, completion_time
+                    return self._result(request, {"error": error_message}, latency, 0, None, False, completion_time,
+                                        retries=retry_count)
             except httpx.RequestError as e:
                 latency = time.monotonic() - start_time
                 completion_time = time.monotonic()
                 error_message = f"Request error for {api_name} ({url}): {e}"
                 logging.warning(f"Attempt {attempt + 1} failed: {error_message}")
-                if attempt < retries - 1:
-                    sleep_time = backoff_factor * (2 ** attempt)
-                    logging.info(f"Retrying in {sleep_time:.2f} seconds...")
+                sleep_time = self._retry_delay(attempt, retries, backoff_factor)
+                if sleep_time is not None:
+                    retry_count += 1
                     await asyncio.sleep(sleep_time)
                 else:
-                    logging.error(f"Max retries reached for {api_name} ({url}).")
                     # Return status_code as None or 0 in case of request error before getting a response
-                    return {"error": error_message}, latency, 0, None, False, completion_time
+                    return self._result(request, {"error": error_message}, latency, 0, None, False, completion_time,
+                                        retries=retry_count)
             except httpx.HTTPStatusError as e:
                 latency = time.monotonic() - start_time
                 completion_time = time.monotonic()
@@ -130,18 +622,20 @@ class ApiClient:
                 logging.warning(f"Attempt {attempt + 1} failed: {error_message}")
                 # Retry only on specific status codes (e.g., 5xx errors, 429 Too Many Requests)
                 if status_code >= 500 or status_code == 429:
-                     if attempt < retries - 1:
-                         sleep_time = backoff_factor * (2 ** attempt)
-                         logging.info(f"Retrying in {sleep_time:.2f} seconds...")
-                         await asyncio.sleep(sleep_time)
-                     else:
-                         logging.error(f"Max retries reached for {api_name} ({url}).")
-                         # Return the actual status code from the HTTPStatusError
-                         return {"error": error_message}, latency, len(e.response.content), status_code, False, completion_time
+                    sleep_time = self._retry_delay(attempt, retries, backoff_factor,
+                                                   parse_retry_after(e.response.headers.get("Retry-After")))
+                    if sleep_time is not None:
+                        retry_count += 1
+                        await asyncio.sleep(sleep_time)
+                    else:
+                        # Return the actual status code from the HTTPStatusError
+                        return self._result(request, {"error": error_message}, latency, len(e.response.content), status_code, False,
+                                            completion_time, dict(e.response.headers), retry_count)
                 else:
                     # Do not retry for other HTTP errors (e.g., 400, 404)
                     logging.error(f"Non-retryable HTTP error for {api_name} ({url}): {status_code}")
-                    return {"error": error_message}, latency, len(e.response.content), status_code, False, completion_time
+                    return self._result(request, {"error": error_message}, latency, len(e.response.content), status_code, False,
+                                        completion_time, dict(e.response.headers), retry_count)
             except json.JSONDecodeError:
                  latency = time.monotonic() - start_time
                  completion_time = time.monotonic()
@@ -153,31 +647,33 @@ class ApiClient:
                  # For now, we won't retry JSON decode errors.
                  logging.error(f"JSON decode error for {api_name} ({url}). Not retrying.")
                  # Return status_code if available
-                 return {"error": error_message}, latency, len(response.content) if 'response' in locals() and response.content else 0, status_code, False, completion_time
+                 return self._result(request, {"error": error_message}, latency, len(response.content) if 'response' in locals() and response.content else 0,
+                                     status_code, False, completion_time, retries=retry_count)
             except Exception as e:
                 latency = time.monotonic() - start_time
                 completion_time = time.monotonic()
                 error_message = f"An unexpected error occurred for {api_name} ({url}): {e}"
                 logging.warning(f"Attempt {attempt + 1} failed: {error_message}")
-                if attempt < retries - 1:
-                    sleep_time = backoff_factor * (2 ** attempt)
-                    logging.info(f"Retrying in {sleep_time:.2f} seconds...")
+                sleep_time = self._retry_delay(attempt, retries, backoff_factor)
+                if sleep_time is not None:
+                    retry_count += 1
                     await asyncio.sleep(sleep_time)
                 else:
-                    logging.error(f"Max retries reached for {api_name} ({url}).")
                     # Return status_code as None or 0 for unexpected errors
-                    return {"error": error_message}, latency, 0, None, False, completion_time
+                    return self._result(request, {"error": error_message}, latency, 0, None, False, completion_time,
+                                        retries=retry_count)
 
         # This part should ideally not be reached if retries are exhausted
         error_message = f"Processing failed for {api_name} ({url}) after {retries} attempts."
         logging.error(error_message)
-        return {"error": error_message}, 0, 0, None, False, time.monotonic()
+        return self._result(request, {"error": error_message}, 0, 0, None, False, time.monotonic(), retries=retry_count)
 
 
     async def __aenter__(self):
         return self
 
-    async def __aexit__(self, exc_type, exc, tb):
-        await self.client.close()
+    async def aclose(self):
+        await self.client.aclose()
 
-# TODO: Add certificate handling
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
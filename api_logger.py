@@ -1,14 +1,16 @@
-import json
-import os
 from datetime import datetime
 from pathlib import Path
 
+from log_sink import get_log_sink
+
 class APILogger:
     def __init__(self, api_name):
         self.api_name = api_name
         self.log_dir = Path("output/logs")
         self.log_dir.mkdir(parents=True, exist_ok=True)
         self.log_file = self.log_dir / f"{api_name}_requests.jsonl"
+        # Shared, persistent writer; entries are batched on a background thread
+        self._sink = get_log_sink(self.log_file)
         
     def log_request(self, request, response, duration):
         log_entry = {
@@ -27,5 +29,8 @@ class APILogger:
             "duration": duration
         }
         
-        with open(self.log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        self._sink.write(log_entry)
+
+    def flush(self):
+        """Blocks until all logged requests have been written."""
+        self._sink.flush()
@@ -5,6 +5,14 @@ import time
 import pandas as pd
 from pathlib import Path
 
+from streaming_histogram import StreamingHistogram, histogram_from
+from metrics_store import MetricsStore, METRICS_DB
+from downsample import MAX_CHART_POINTS, choose_resolution, rebucket, lttb_frame
+
+LIVE_REFRESH_INTERVAL = 5 # seconds between dashboard refreshes while live refresh is on
+# Counters that are not derived from samples, taken from the latest run's metrics files
+RUN_STATE_COLUMNS = ('rpm', 'rps', 'window_error_rate', 'retries', 'shed', 'breaker_state')
+
 st.set_page_config(
     page_title="API Processor App", 
     layout="wide"
@@ -17,8 +25,16 @@ st.divider()
 st.subheader("📊 API Performance Dashboard")
 
 # Load and process metrics data
+def metrics_files_version():
+    """(name, modification time) of every metrics file; changes whenever a run rewrites one."""
+    return tuple(sorted((f.name, f.stat().st_mtime_ns) for f in Path("output/metrics").glob("*.json")))
+
 @st.cache_data
-def load_enhanced_metrics():
+def load_enhanced_metrics(files_version):
+    """
+    Per-API metrics files as a DataFrame. `files_version` (metrics_files_version())
+    is the cache key, so the files are re-read as soon as a run updates them.
+    """
     metrics_dir = Path("output/metrics")
     all_data = []
 
@@ -38,9 +54,163 @@ def load_enhanced_metrics():
 
     return pd.DataFrame(all_data)
 
+@st.cache_resource
+def open_metrics_store(db_path):
+    """Shared read connection to an existing rollup database."""
+    return MetricsStore(db_path)
+
+def get_metrics_store():
+    """The rollup database, or None before the first run (checked on every call, so it is picked up once created)."""
+    return open_metrics_store(METRICS_DB) if os.path.exists(METRICS_DB) else None
+
+@st.cache_data
+def load_store_metrics(run_id, version):
+    """
+    Per-API aggregates of one run (None = all runs) from the metrics store.
+
+    Only the small rollup tables are read; `version` (MetricsStore.version())
+    is part of the cache key, so the result is reused until new data arrives.
+    """
+    store = get_metrics_store()
+    status_codes = store.status_codes(run_id)
+    rows = []
+    for summary in store.summary(run_id):
+        requests, responses, errors = summary['requests'], summary['responses'], summary['errors']
+        duration = summary['last_bucket'] - summary['first_bucket'] + store.bucket_seconds
+        rows.append({
+            'api_name': summary['api_name'],
+            'processed': responses,
+            'errors': errors,
+            'success_rate': (requests - errors) / max(1, requests),
+            'error_rate': errors / max(1, requests),
+            'avg_latency': summary['latency_sum'] / responses if responses else 0,
+            'avg_payload_size': summary['payload_sum'] / responses if responses else 0,
+            # Averages over the run; the latest run's sliding-window values replace them below
+            'rpm': requests / duration * 60,
+            'rps': requests / duration,
+            'latency_histogram': store.latency_histogram(summary['api_name'], run_id).to_dict(),
+            'status_codes': status_codes.get(summary['api_name'], {})
+        })
+    return pd.DataFrame(rows)
+
+def load_rollups_incrementally(store, run_id, version):
+    """
+    Time-bucket rows of a run for the trend charts.
+
+    Kept in session state; on refresh only buckets from the newest one
+    already loaded onwards are read back (that bucket may still be filling).
+    """
+    cache = st.session_state.setdefault('rollup_cache', {})
+    cached = cache.get(run_id)
+    if cached and cached['version'] == version:
+        return cached['df']
+    last_bucket = cached['last_bucket'] if cached else None
+    new_rows = pd.DataFrame(store.read_rollups(run_id, since_bucket=last_bucket))
+    if cached and not new_rows.empty:
+        df = pd.concat([cached['df'][cached['df']['bucket'] < last_bucket], new_rows], ignore_index=True)
+    elif cached:
+        df = cached['df']
+    else:
+        df = new_rows
+    cache[run_id] = {
+        'df': df,
+        'version': version,
+        'last_bucket': int(df['bucket'].max()) if not df.empty else None
+    }
+    return df
+
+def show_trends(rollups, base_resolution):
+    """
+    Throughput and latency over time from rollup rows, at most MAX_CHART_POINTS
+    points per API. Narrowing the time range gives a finer resolution.
+    """
+    first = int(rollups['bucket'].min())
+    last = int(rollups['bucket'].max()) + base_resolution
+    start, end = first, last
+    if last - first > 2 * base_resolution:
+        # Timestamps are shown in UTC, like the chart axes
+        zoom = st.slider("Time range (UTC)",
+                         min_value=pd.Timestamp(first, unit='s').to_pydatetime(),
+                         max_value=pd.Timestamp(last, unit='s').to_pydatetime(),
+                         value=(pd.Timestamp(first, unit='s').to_pydatetime(), pd.Timestamp(last, unit='s').to_pydatetime()),
+                         format="MM/DD HH:mm:ss", key="trend_range")
+        start, end = (pd.Timestamp(value).timestamp() for value in zoom)
+    method = st.radio("Downsampling", ["Min/max per bucket", "LTTB"], horizontal=True, key="trend_downsampling",
+                      help="Min/max per bucket keeps every latency spike; LTTB keeps the shape of the series at full resolution.")
+
+    visible = rollups[(rollups['bucket'] >= start - base_resolution) & (rollups['bucket'] < end)]
+    if visible.empty:
+        st.info("No data in the selected time range.")
+        return
+    resolution = choose_resolution(end - start, base_resolution)
+    if method == "LTTB":
+        # Pick representative base buckets instead of averaging them
+        points = visible.assign(rps=visible['requests'] / base_resolution,
+                                avg_latency=visible['latency_sum'] / visible['responses'].where(visible['responses'] > 0))
+        throughput = lttb_frame(points, 'bucket', 'rps', 'api_name', MAX_CHART_POINTS)
+        latency = lttb_frame(points, 'bucket', 'avg_latency', 'api_name', MAX_CHART_POINTS)
+        latency = latency.assign(series=latency['api_name'] + " avg")
+        resolution_note = f"LTTB over {base_resolution}s buckets"
+    else:
+        points = rebucket(visible, resolution)
+        points['rps'] = points['requests'] / resolution
+        points['avg_latency'] = points['latency_sum'] / points['responses'].where(points['responses'] > 0)
+        throughput = points
+        # Average and per-bucket maximum, so downsampling never hides a spike
+        latency = pd.concat([
+            points.assign(series=points['api_name'] + " avg"),
+            points.assign(series=points['api_name'] + " max", avg_latency=points['latency_max'])
+        ]).dropna(subset=['avg_latency'])
+        resolution_note = f"{resolution}s buckets"
+
+    throughput = throughput.assign(time=pd.to_datetime(throughput['bucket'], unit='s'))
+    latency = latency.assign(time=pd.to_datetime(latency['bucket'], unit='s'))
+    st.caption(f"{resolution_note}, at most {MAX_CHART_POINTS} points per API.")
+    st.write("### Throughput over Time (requests per second)")
+    st.line_chart(throughput, x='time', y='rps', color='api_name', use_container_width=True, height=300)
+    st.write("### Latency over Time (seconds)")
+    st.line_chart(latency.rename(columns={'avg_latency': 'latency'}), x='time', y='latency', color='series',
+                  use_container_width=True, height=300)
+
+def latency_summary(row):
+    """Fastest/percentiles/slowest/average latency for one metrics row."""
+    if isinstance(row.get('latency_histogram'), dict):
+        histogram = histogram_from(row['latency_histogram'])
+    else:
+        # Metrics files written before histograms were kept raw sample lists
+        histogram = StreamingHistogram()
+        for latency in row.get('latencies') if isinstance(row.get('latencies'), list) else []:
+            histogram.add(latency)
+    summary = {'API': row['api_name'], 'Fastest': histogram.min or 0}
+    summary.update(histogram.percentiles())
+    summary.update({'Slowest': histogram.max or 0, 'Average': histogram.mean})
+    return summary
+
 if st.toggle("Show Enhanced Visualizations", value=True):
     try:
-        df = load_enhanced_metrics()
+        store = get_metrics_store()
+        runs = store.runs() if store else []
+        rollups = pd.DataFrame()
+        if runs:
+            control_cols = st.columns([3, 1])
+            run_choice = control_cols[0].selectbox("Run", ["Latest run", "All runs"] + runs, key="dashboard_run")
+            live_refresh = control_cols[1].toggle("Live refresh", value=False, key="dashboard_live_refresh",
+                                                  help=f"Reload new data every {LIVE_REFRESH_INTERVAL}s while a job runs.")
+            run_id = {"Latest run": runs[0], "All runs": None}.get(run_choice, run_choice)
+            version = store.version()
+            df = load_store_metrics(run_id, version)
+            rollups = load_rollups_incrementally(store, run_id, version)
+            if run_id == runs[0] and not df.empty:
+                # Sliding-window rates, retries and breaker state of the latest run come from its metrics files
+                run_state = load_enhanced_metrics(metrics_files_version())
+                if not run_state.empty:
+                    run_state = run_state[['api_name'] + [col for col in RUN_STATE_COLUMNS if col in run_state.columns]]
+                    df = df.drop(columns=[col for col in RUN_STATE_COLUMNS if col in run_state.columns and col in df.columns])
+                    df = df.merge(run_state, on='api_name', how='left')
+        else:
+            # No rollups yet (e.g. only metrics files from older versions)
+            live_refresh = False
+            df = load_enhanced_metrics(metrics_files_version())
 
         if not df.empty:
             # Dashboard Layout
@@ -69,17 +239,12 @@ if st.toggle("Show Enhanced Visualizations", value=True):
             with tab2:
                 # Performance Trends
                 st.subheader("Performance Trends")
-                time_df = df.explode('timestamps')
-                time_df['timestamp'] = pd.to_datetime(time_df['timestamps'], unit='s')
-                
+
                 # Enhanced Latency Analysis
                 st.write("### Latency Performance (Per API)")
                 
-                # Calculate min, max, mean latency per API
-                latency_stats = df.explode('latencies').groupby('api_name')['latencies'].agg(
-                    ['min', 'max', 'mean']
-                ).reset_index()
-                latency_stats.columns = ['API', 'Fastest', 'Slowest', 'Average']
+                # Calculate min, max, mean and percentile latency per API
+                latency_stats = pd.DataFrame([latency_summary(row) for _, row in df.iterrows()])
                 
                 # Display as bar chart with error bars
                 st.bar_chart(
@@ -92,15 +257,17 @@ if st.toggle("Show Enhanced Visualizations", value=True):
                 st.write("#### Detailed Latency Metrics (seconds)")
                 st.dataframe(
                     latency_stats.style.format({
-                        'Fastest': '{:.3f}',
-                        'Slowest': '{:.3f}', 
-                        'Average': '{:.3f}'
+                        column: '{:.3f}' for column in latency_stats.columns if column != 'API'
                     }),
                     use_container_width=True,
                     hide_index=True
                 )
 
-                # Per-API RPM comparison
+                if not rollups.empty:
+                    # Trends from the per-bucket rollups (see metrics_store), downsampled for long runs
+                    show_trends(rollups, store.bucket_seconds)
+
+                # Per-API RPM comparison (sliding-window counters, see rate_counter)
                 st.write("### Throughput (Requests Per Minute)")
                 rpm_df = df[['api_name', 'rpm']].set_index('api_name')
                 st.bar_chart(
@@ -108,6 +275,13 @@ if st.toggle("Show Enhanced Visualizations", value=True):
                     use_container_width=True,
                     height=300
                 )
+                if 'rps' in df.columns:
+                    st.write("### Throughput (Requests Per Second, recent window)")
+                    st.bar_chart(
+                        df[['api_name', 'rps']].set_index('api_name').fillna(0),
+                        use_container_width=True,
+                        height=300
+                    )
 
             with tab3:
                 # Enhanced Status Code Visualization
@@ -126,9 +300,9 @@ if st.toggle("Show Enhanced Visualizations", value=True):
                 st.write("### API Performance Metrics")
                 metrics_cols = [
                     'api_name', 'processed', 'errors', 'success_rate',
-                    'avg_latency', 'rpm'
+                    'avg_latency', 'rpm', 'rps', 'window_error_rate', 'retries', 'shed', 'breaker_state'
                 ]
-                metrics_df = df[metrics_cols].copy()
+                metrics_df = df[[col for col in metrics_cols if col in df.columns]].copy()
                 metrics_df['success_rate'] = metrics_df['success_rate'].apply(lambda x: f"{x*100:.1f}%")
                 metrics_df['avg_latency'] = metrics_df['avg_latency'].apply(lambda x: f"{x:.3f}s")
                 
@@ -169,6 +343,10 @@ if st.toggle("Show Enhanced Visualizations", value=True):
         else:
             st.warning("No metrics data found. Run some API tests first.")
 
+        if live_refresh:
+            time.sleep(LIVE_REFRESH_INTERVAL)
+            st.rerun()
+
     except Exception as e:
         st.error(f"Error generating visualizations: {str(e)}")
 
@@ -0,0 +1,120 @@
+import collections
+import time
+import logging # Import logging module
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+BREAKER_STATES = (CLOSED, HALF_OPEN, OPEN) # in order of severity
+
+DEFAULT_CIRCUIT_BREAKER = {
+    "enabled": False, # opt-in per API, like the response cache and request coalescing
+    "failure_streak": 5, # consecutive failures that open the breaker
+    "failure_rate": 0.5, # or this share of failures among the last `window` calls...
+    "min_requests": 20, # ...once at least this many have been seen
+    "window": 50,
+    "open_seconds": 30, # how long calls are shed before a probe
+    "probes": 1 # calls let through at a time while half-open
+}
+
+
+class CircuitBreaker:
+    """
+    Per-API circuit breaker.
+
+    Closed: calls go through and outcomes are tracked over the last `window`
+    calls. A streak of `failure_streak` failures, or a failure rate of at
+    least `failure_rate` once `min_requests` calls were seen, opens it.
+    Open: calls are shed immediately for `open_seconds`. Half-open: up to
+    `probes` calls are let through; a success closes the breaker and a
+    failure opens it again.
+    """
+
+    def __init__(self, name: str = "", failure_streak: int = 5, failure_rate: float = 0.5, min_requests: int = 20,
+                 window: int = 50, open_seconds: float = 30, probes: int = 1, clock=time.monotonic):
+        self.name = name
+        self.failure_streak = failure_streak
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._clock = clock
+        self.state = CLOSED
+        self.shed = 0
+        self.times_opened = 0
+        self._outcomes = collections.deque(maxlen=window) # True = failure
+        self._failures = 0 # failures in _outcomes
+        self._streak = 0
+        self._opened_at = None
+        self._probes_in_flight = 0
+
+    @classmethod
+    def from_config(cls, api_config):
+        """Builds a breaker from api_config['circuit_breaker'] (defaults above), or returns None if disabled."""
+        settings = {**DEFAULT_CIRCUIT_BREAKER, **(api_config.get("circuit_breaker") or {})}
+        if not settings["enabled"]:
+            return None
+        return cls(api_config.get("name", "Unnamed API"), settings["failure_streak"], settings["failure_rate"],
+                   settings["min_requests"], settings["window"], settings["open_seconds"], settings["probes"])
+
+    def allow(self) -> bool:
+        """
+        Returns True if a call may go out now; False means shed it.
+
+        Every allowed call must be followed by record() or release().
+        """
+        if self.state == OPEN:
+            if self._clock() - self._opened_at < self.open_seconds:
+                self.shed += 1
+                return False
+            self.state = HALF_OPEN
+            logging.info(f"Circuit breaker for {self.name} half-open, probing.")
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.probes:
+                self.shed += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def release(self):
+        """Gives back an allowed call that ended without an outcome (e.g. cancelled)."""
+        if self.state == HALF_OPEN and self._probes_in_flight:
+            self._probes_in_flight -= 1
+
+    def record(self, failed: bool):
+        """Records the outcome of an allowed call."""
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if failed:
+                self._open()
+            else:
+                logging.info(f"Circuit breaker for {self.name} closed.")
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._failures = 0
+                self._streak = 0
+            return
+        if self.state == OPEN:
+            return # a call let through before the breaker opened
+
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        if failed:
+            self._failures += 1
+            self._streak += 1
+        else:
+            self._streak = 0
+        if self._streak >= self.failure_streak or (
+                len(self._outcomes) >= self.min_requests and self._failures / len(self._outcomes) >= self.failure_rate):
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = self._clock()
+        self.times_opened += 1
+        self._probes_in_flight = 0
+        logging.warning(f"Circuit breaker for {self.name} opened; shedding calls for {self.open_seconds}s.")
@@ -0,0 +1,261 @@
+"""
+Headless runner: processes an input file against an exported API configuration
+without Streamlit.
+
+    python cli.py --config atap_config.json questions.csv --column question
+
+The configuration file is the one written by "Export Configuration" on the
+Configuration page. Logs and metrics go to output/logs and output/metrics like
+runs started from the Metrics page. Live throughput is printed to stderr and a
+per-API summary to stdout.
+
+    python cli.py extract --api "API 1" --since 2024-05-01T12:00 --errors-only -o errors.jsonl
+
+prints (or writes) the matching records of an API's call log as plain JSONL,
+reading rotated, compressed segments through their sidecar indexes.
+
+Exit codes:
+    0  all requests done and every API's error rate within --max-error-rate
+    1  the run failed
+    2  bad arguments, configuration or input file
+    3  an API's error rate exceeded --max-error-rate
+    130  interrupted (Ctrl+C)
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import logging # Import logging module
+from datetime import datetime
+
+from config_file import load_config
+from input_handler import QuestionStream
+from job_runner import JOB_RUNNER, FAILED, STOPPED
+from log_sink import flush_log_sinks, iter_log_records, extract_log_records, log_segments, DURABILITY_MODES, COMPRESSION_MODES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_ERRORS = 3
+EXIT_INTERRUPTED = 130
+
+STATE_DB_PATH = os.path.join("output", "state", "processing_state.db")
+LOG_DIR = os.path.join("output", "logs")
+LOG_KINDS = ("calls", "requests") # output/logs/<api>_calls.jsonl, <api>_requests.jsonl
+DEFAULT_PROGRESS_INTERVAL = 2 # seconds between throughput lines
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run API test jobs without the Streamlit app.",
+                                     epilog="See `cli.py extract --help` to pull records out of the logs.")
+    parser.add_argument("input", help="Input file (.txt, .csv or .xlsx)")
+    parser.add_argument("-c", "--config", required=True, help="Configuration exported from the Configuration page")
+    parser.add_argument("--column", default="question", help="Question column of CSV/XLSX files (default: question)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--fan-out", action="store_true", help="Send each question to all APIs in parallel")
+    mode.add_argument("--weighted", action="store_true", help="Per-API weighted queues")
+    parser.add_argument("--resume", action="store_true", help="Skip (question, API) pairs completed by an earlier run")
+    parser.add_argument("--state-db", default=STATE_DB_PATH, help=f"Checkpoint database (default: {STATE_DB_PATH})")
+
+    overrides = parser.add_argument_group("overrides of the configuration file's global settings")
+    overrides.add_argument("--rate", type=int, dest="global_rate_limit_rate", help="Global rate limit (requests per period)")
+    overrides.add_argument("--period", type=int, dest="global_rate_limit_period", help="Global rate limit period (seconds)")
+    overrides.add_argument("--burst", type=int, dest="global_rate_limit_burst", help="Global burst (requests)")
+    overrides.add_argument("--max-concurrency", type=int, dest="max_concurrency", help="Max concurrent requests")
+    overrides.add_argument("--workers", type=int, dest="worker_processes", help="Worker processes")
+    overrides.add_argument("--durability", choices=list(DURABILITY_MODES), dest="log_durability", help="Log durability")
+    overrides.add_argument("--log-compression", choices=list(COMPRESSION_MODES), dest="log_compression",
+                           help="Compression of rotated log segments")
+    overrides.add_argument("--log-rotate-mb", type=float, dest="log_rotate_mb", help="Rotate logs at this size (0 = never)")
+
+    parser.add_argument("--max-error-rate", type=float, default=0.0,
+                        help="Highest error percentage per API that still exits with 0 (default: 0)")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_PROGRESS_INTERVAL,
+                        help=f"Seconds between throughput lines, 0 to disable (default: {DEFAULT_PROGRESS_INTERVAL})")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show INFO log messages")
+    return parser
+
+
+def parse_time(value: str) -> float:
+    """argparse type for --since/--until: epoch seconds or an ISO date/time (local time unless it has an offset)."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a date/time or epoch seconds: {value!r}")
+
+
+def build_extract_parser():
+    parser = argparse.ArgumentParser(prog="cli.py extract",
+                                     description="Extract records from an API's (rotated, compressed) log as plain JSONL.")
+    parser.add_argument("--api", required=True, help="API name as in the configuration")
+    parser.add_argument("--log", choices=LOG_KINDS, default="calls", help="Which log to read (default: calls)")
+    parser.add_argument("--since", type=parse_time, help="Earliest record time, inclusive (ISO date/time or epoch seconds)")
+    parser.add_argument("--until", type=parse_time, help="Latest record time, exclusive (ISO date/time or epoch seconds)")
+    parser.add_argument("--errors-only", action="store_true", help="Only records without a response or with status >= 400")
+    parser.add_argument("--status", nargs="+", metavar="CODE", help="Only records with one of these status codes")
+    parser.add_argument("-o", "--output", help="Write to this file instead of stdout")
+    parser.add_argument("--log-dir", default=LOG_DIR, help=f"Log directory (default: {LOG_DIR})")
+    return parser
+
+
+def extract_main(argv) -> int:
+    """`cli.py extract`: prints or writes the log records of one API that match the filters."""
+    args = build_extract_parser().parse_args(argv)
+    log_path = os.path.join(args.log_dir, f"{args.api}_{args.log}.jsonl")
+    if not os.path.isfile(log_path) and not log_segments(log_path):
+        print(f"No {args.log} log found for {args.api} in {args.log_dir}", file=sys.stderr)
+        return EXIT_USAGE
+    filters = {'start': args.since, 'end': args.until, 'errors_only': args.errors_only, 'status_codes': args.status}
+    if args.output:
+        count = extract_log_records(log_path, args.output, **filters)
+        print(f"Wrote {count} records to {args.output}", file=sys.stderr)
+    else:
+        for record in iter_log_records(log_path, **filters):
+            print(json.dumps(record, default=str))
+    return EXIT_OK
+
+
+def error_rate(api_metrics) -> float:
+    """
+    Failure percentage of one API's metrics snapshot.
+
+    Like the metrics' error_percentage (errors over processed + errors, so
+    timeouts and connection errors, which never count as processed, are
+    included), with calls shed by the open circuit breaker counted as failures.
+    """
+    failures = api_metrics.get('errors', 0) + api_metrics.get('shed', 0)
+    total = api_metrics.get('processed', 0) + failures
+    return failures / total * 100 if total else 0.0
+
+
+def format_progress(snapshot, elapsed: float, questions_per_second: float) -> str:
+    """One throughput line: overall progress, then processed/errors/recent RPS per API."""
+    done = snapshot.get('completed_questions', 0)
+    total = snapshot.get('total_questions')
+    progress = f"{done}/{total}" if total else f"{done}"
+    parts = [f"[{elapsed:7.1f}s] {progress} questions ({questions_per_second:.1f}/s)"]
+    for api_name, api_metrics in snapshot.get('api_metrics', {}).items():
+        part = (f"{api_name}: {api_metrics.get('processed', 0)} done, {api_metrics.get('errors', 0)} err, "
+                f"{api_metrics.get('rps', 0):.1f} rps")
+        if api_metrics.get('breaker_state') not in (None, 'closed'):
+            part += f", breaker {api_metrics['breaker_state']}"
+        parts.append(part)
+    return " | ".join(parts)
+
+
+def print_summary(snapshot, out=sys.stdout):
+    """Final per-API table."""
+    print(f"{'API':<30} {'processed':>10} {'errors':>8} {'error %':>8} {'avg latency':>12} {'retries':>8} {'shed':>6} {'cached':>7}", file=out)
+    for api_name, api_metrics in snapshot.get('api_metrics', {}).items():
+        print(f"{api_name[:30]:<30} {api_metrics.get('processed', 0):>10} {api_metrics.get('errors', 0):>8} "
+              f"{error_rate(api_metrics):>7.2f}% {api_metrics.get('avg_latency', 0):>11.4f}s "
+              f"{api_metrics.get('retries', 0):>8} {api_metrics.get('shed', 0):>6} {api_metrics.get('cache_hits', 0):>7}",
+              file=out)
+    if snapshot.get('start_time') and snapshot.get('end_time'):
+        print(f"Total time: {snapshot['end_time'] - snapshot['start_time']:.2f}s", file=out)
+
+
+def wait_for_job(job, progress_interval: float):
+    """
+    Prints throughput until the job ends. The first Ctrl+C stops the job
+    (requests in flight finish and are logged), a second one gives up waiting.
+
+    Returns:
+        True if the run was interrupted
+    """
+    interrupted = False
+    last_done, last_time = 0, time.monotonic()
+    while job.thread.is_alive():
+        try:
+            job.thread.join(timeout=progress_interval or 1)
+        except KeyboardInterrupt:
+            if interrupted:
+                return True
+            interrupted = True
+            print("Stopping: waiting for requests in flight (Ctrl+C again to quit now)...", file=sys.stderr, flush=True)
+            job.stop()
+            continue
+        if progress_interval and job.thread.is_alive():
+            snapshot = job.snapshot
+            now = time.monotonic()
+            done = snapshot.get('completed_questions', 0)
+            rate = (done - last_done) / (now - last_time) if now > last_time else 0.0
+            last_done, last_time = done, now
+            print(format_progress(snapshot, time.time() - job.start_time, rate), file=sys.stderr, flush=True)
+    return interrupted
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["extract"]:
+        return extract_main(argv[1:])
+    args = build_parser().parse_args(argv)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        api_configs, settings = load_config(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Error loading configuration: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if not api_configs:
+        print("The configuration has no APIs.", file=sys.stderr)
+        return EXIT_USAGE
+    for key in ('global_rate_limit_rate', 'global_rate_limit_period', 'global_rate_limit_burst',
+                'max_concurrency', 'worker_processes', 'log_durability', 'log_compression', 'log_rotate_mb'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+
+    file_type = os.path.splitext(args.input)[1].lstrip('.').lower()
+    if file_type not in ('txt', 'csv', 'xlsx'):
+        print(f"Unsupported input file type: {args.input}", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        questions = QuestionStream(args.input, file_type, args.column)
+        if questions.peek() is None:
+            print(f"No questions found in {args.input}", file=sys.stderr)
+            return EXIT_USAGE
+    except (OSError, ValueError) as e:
+        print(f"Error reading {args.input}: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    if args.resume:
+        os.makedirs(os.path.dirname(args.state_db) or ".", exist_ok=True)
+    job = JOB_RUNNER.start({
+        **settings,
+        'api_configs': api_configs,
+        'questions': questions,
+        'fan_out': args.fan_out,
+        'weighted': args.weighted,
+        'resume': args.resume,
+        'state_db': args.state_db
+    })
+    interrupted = wait_for_job(job, args.progress_interval)
+    flush_log_sinks(timeout=10)
+
+    snapshot = job.snapshot
+    print_summary(snapshot)
+    if interrupted or job.status == STOPPED:
+        print("Interrupted; the metrics cover the requests sent before the stop.", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    if job.status == FAILED:
+        print(f"Processing failed: {job.error}", file=sys.stderr)
+        return EXIT_FAILED
+    over = [name for name, api_metrics in snapshot.get('api_metrics', {}).items()
+            if error_rate(api_metrics) > args.max_error_rate]
+    if over:
+        print(f"Error rate above {args.max_error_rate:g}% for: {', '.join(over)}", file=sys.stderr)
+        return EXIT_ERRORS
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import copy
+import json
+import logging # Import logging module
+
+from log_sink import DURABILITY_BUFFERED, COMPRESSION_GZIP
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CONFIG_VERSION = 1
+
+# Global settings saved with the API configurations, with the Configuration page defaults
+GLOBAL_SETTINGS = {
+    'global_rate_limit_rate': 15,
+    'global_rate_limit_period': 60,
+    'global_rate_limit_burst': None, # None = same as the rate
+    'max_concurrency': 10,
+    'log_durability': DURABILITY_BUFFERED,
+    'log_compression': COMPRESSION_GZIP,
+    'log_rotate_mb': 100, # 0 = no size-based rotation
+    'log_rotate_minutes': 0, # 0 = no time-based rotation
+    'log_keep_segments': 0, # 0 = keep all segments
+    'write_metric_samples': False,
+    'response_cache': {},
+    'coalesce_requests': False, # opt-in: when on, repeated questions in a run share one call
+    'worker_processes': 1
+}
+
+# Fetched at run time; never written to an exported file
+RUNTIME_AUTH_FIELDS = ('current_token', 'token_expires_at')
+
+
+def log_sink_options(settings) -> dict:
+    """configure_log_sinks() keyword arguments for the log settings in `settings` (defaults above)."""
+    def setting(key):
+        value = settings.get(key)
+        return GLOBAL_SETTINGS[key] if value is None else value
+
+    return {
+        'durability': setting('log_durability'),
+        'compression': setting('log_compression'),
+        'rotate_bytes': int(setting('log_rotate_mb') * 1024 * 1024) or None,
+        'rotate_seconds': setting('log_rotate_minutes') * 60 or None,
+        'max_segments': setting('log_keep_segments') or None
+    }
+
+
+def export_config(api_configs, settings) -> dict:
+    """
+    Builds the exportable form of a configuration.
+
+    Args:
+        api_configs: API configurations as edited on the Configuration page
+        settings: Mapping holding (some of) the GLOBAL_SETTINGS keys, e.g. st.session_state
+
+    Returns:
+        {"version": ..., "settings": {...}, "api_configs": [...]} with fetched tokens removed
+    """
+    exported_apis = copy.deepcopy(list(api_configs))
+    for api_config in exported_apis:
+        auth_config = api_config.get('auth_config') or {}
+        for field in RUNTIME_AUTH_FIELDS:
+            auth_config.pop(field, None)
+    return {
+        'version': CONFIG_VERSION,
+        'settings': {key: copy.deepcopy(settings.get(key, default)) for key, default in GLOBAL_SETTINGS.items()},
+        'api_configs': exported_apis
+    }
+
+
+def load_config(source):
+    """
+    Reads a configuration written by export_config().
+
+    Args:
+        source: File path, file object (e.g. a Streamlit UploadedFile) or parsed dict
+
+    Returns:
+        (api_configs, settings): settings holds every GLOBAL_SETTINGS key, defaults filled in
+
+    Raises:
+        ValueError: If the file is not valid JSON or not a configuration export
+    """
+    if isinstance(source, dict):
+        data = source
+    else:
+        try:
+            if hasattr(source, 'read'):
+                data = json.loads(source.read())
+            else:
+                with open(source, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Configuration file is not valid JSON: {e}")
+
+    if not isinstance(data, dict) or not isinstance(data.get('api_configs'), list):
+        raise ValueError("Configuration file has no 'api_configs' list")
+    if data.get('version', CONFIG_VERSION) > CONFIG_VERSION:
+        raise ValueError(f"Configuration file version {data['version']} is newer than supported ({CONFIG_VERSION})")
+
+    api_configs = []
+    for index, api_config in enumerate(data['api_configs']):
+        if not isinstance(api_config, dict) or not api_config.get('url'):
+            raise ValueError(f"API configuration {index + 1} has no 'url'")
+        api_config = copy.deepcopy(api_config)
+        api_config.setdefault('name', f"API {index + 1}")
+        api_config.setdefault('auth_config', {})
+        api_configs.append(api_config)
+
+    settings = copy.deepcopy(GLOBAL_SETTINGS)
+    for key, value in (data.get('settings') or {}).items():
+        if key in GLOBAL_SETTINGS:
+            settings[key] = value
+        else:
+            logging.warning(f"Ignoring unknown setting '{key}' in configuration file.")
+    return api_configs, settings
@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+MAX_CHART_POINTS = 500 # points per series sent to the browser
+# Chart resolutions in seconds; the finest one that keeps a series under MAX_CHART_POINTS is used
+RESOLUTIONS = (10, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+ADDITIVE_COLUMNS = ('requests', 'responses', 'errors', 'latency_sum', 'payload_sum')
+
+
+def choose_resolution(span_seconds: float, base: int, max_points: int = MAX_CHART_POINTS) -> int:
+    """
+    Coarsest-needed time resolution for a chart.
+
+    Args:
+        span_seconds: Visible time range
+        base: Resolution of the stored data (MetricsStore.bucket_seconds)
+        max_points: Maximum buckets per series
+
+    Returns:
+        A multiple of `base` from RESOLUTIONS (or beyond), at least `base`
+    """
+    for resolution in RESOLUTIONS:
+        if resolution >= base and resolution % base == 0 and span_seconds / resolution <= max_points:
+            return resolution
+    return base * math.ceil(span_seconds / max_points / base)
+
+
+def rebucket(rollups: pd.DataFrame, resolution: int) -> pd.DataFrame:
+    """
+    Min/max-per-bucket downsampling of rollup rows (see MetricsStore.read_rollups).
+
+    Sums are added up and latency_min/latency_max keep the extremes of each
+    coarser bucket, so spikes stay visible however far the chart zooms out.
+    """
+    if rollups.empty:
+        return rollups
+    coarse = rollups.assign(bucket=rollups['bucket'] // resolution * resolution)
+    aggregations = {column: 'sum' for column in ADDITIVE_COLUMNS if column in coarse.columns}
+    aggregations.update({'latency_min': 'min', 'latency_max': 'max'})
+    return coarse.groupby(['api_name', 'bucket'], as_index=False).agg(aggregations)
+
+
+def lttb(x, y, threshold: int = MAX_CHART_POINTS):
+    """
+    Largest-Triangle-Three-Buckets: indexes of at most `threshold` points that
+    keep the visual shape of the series (x sorted ascending).
+
+    Returns:
+        numpy array of indexes into x/y, including the first and last point
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = length - 1
+    # Buckets between the fixed first and last points
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle corner
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else length
+        if next_end <= next_start:
+            next_end = next_start + 1
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas)) if len(areas) else start
+        selected[i + 1] = previous
+    return selected
+
+
+def lttb_frame(df: pd.DataFrame, x: str, y: str, group: str, threshold: int = MAX_CHART_POINTS) -> pd.DataFrame:
+    """Applies lttb() to the `y` series of every `group` (e.g. per API), dropping rows where `y` is missing."""
+    parts = []
+    for _, series in df.dropna(subset=[y]).sort_values(x).groupby(group):
+        parts.append(series.iloc[lttb(series[x].to_numpy(), series[y].to_numpy(), threshold)])
+    return pd.concat(parts) if parts else df.iloc[0:0]
@@ -1,5 +1,5 @@
 import pandas as pd
-import streamlit as st
+import io
 from io import StringIO
 
 def load_questions(file_obj, file_type: str, column_name: str = None):
@@ -14,6 +14,8 @@ def load_questions(file_obj, file_type: str, column_name: str = None):
     Returns:
         List of questions or empty list on error
     """
+    import streamlit as st # errors are shown on the page; imported here so the CLI runs without Streamlit
+
     questions = []
     try:
         # Handle text files
@@ -56,3 +58,129 @@ def load_questions(file_obj, file_type: str, column_name: str = None):
         return []
 
     return questions
+
+
+DEFAULT_CHUNKSIZE = 10000 # rows per CSV chunk
+
+
+def _rewind(file_obj):
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+
+
+def iter_questions(file_obj, file_type: str, column_name: str = None, chunksize: int = DEFAULT_CHUNKSIZE):
+    """
+    Yields questions one at a time without materializing the whole file.
+
+    TXT files are read line by line, CSV files in chunks of `chunksize` rows
+    (only the question column is parsed) and XLSX files in openpyxl read-only
+    row mode.
+
+    Args:
+        file_obj: File object (Streamlit UploadedFile or file path string)
+        file_type: Type of the file ('txt', 'csv', 'xlsx')
+        column_name: Column name for CSV/Excel files containing questions
+        chunksize: Number of CSV rows parsed at a time
+
+    Raises:
+        ValueError: If the file type is unsupported or the column is missing
+    """
+    if file_type == 'txt':
+        if hasattr(file_obj, 'read'):
+            _rewind(file_obj)
+            text = io.TextIOWrapper(file_obj, encoding='utf-8')
+            try:
+                for line in text:
+                    line = line.strip()
+                    if line:
+                        yield line
+            finally:
+                text.detach() # leave the uploaded file open for re-reads
+        else:
+            with open(file_obj, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+
+    elif file_type == 'csv':
+        if not column_name:
+            raise ValueError("Column name is required for CSV files")
+        _rewind(file_obj)
+        try:
+            reader = pd.read_csv(file_obj, usecols=[column_name], chunksize=chunksize)
+        except ValueError:
+            raise ValueError(f"Column '{column_name}' not found")
+        with reader:
+            for chunk in reader:
+                yield from chunk[column_name].dropna().tolist()
+
+    elif file_type == 'xlsx':
+        if not column_name:
+            raise ValueError("Column name is required for XLSX files")
+        from openpyxl import load_workbook
+
+        _rewind(file_obj)
+        workbook = load_workbook(file_obj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, ())
+            if column_name not in header:
+                raise ValueError(f"Column '{column_name}' not found")
+            index = header.index(column_name)
+            for row in rows:
+                value = row[index] if index < len(row) else None
+                if value is not None and value != '':
+                    yield value
+        finally:
+            workbook.close()
+
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
+
+class QuestionStream:
+    """
+    Re-iterable wrapper around iter_questions().
+
+    `count` is the number of questions yielded so far by the current pass;
+    `total` stays None until a pass has read the whole file.
+    """
+
+    def __init__(self, file_obj, file_type: str, column_name: str = None, chunksize: int = DEFAULT_CHUNKSIZE):
+        self.file_obj = file_obj
+        self.file_type = file_type
+        self.column_name = column_name
+        self.chunksize = chunksize
+        self.count = 0
+        self.total = None
+
+    def __iter__(self):
+        self.count = 0
+        for question in iter_questions(self.file_obj, self.file_type, self.column_name, self.chunksize):
+            self.count += 1
+            yield question
+        self.total = self.count
+
+    def reopen(self):
+        """
+        Another stream over the same input with its own read position, so that
+        several passes can read it at the same time.
+
+        Returns:
+            QuestionStream, or None if the input is a file object that cannot be shared
+        """
+        file_obj = self.file_obj
+        if hasattr(file_obj, 'getvalue'):
+            file_obj = io.BytesIO(file_obj.getvalue()) # e.g. a Streamlit UploadedFile; the bytes are shared, not copied
+        elif hasattr(file_obj, 'read'):
+            return None
+        return QuestionStream(file_obj, self.file_type, self.column_name, self.chunksize)
+
+    def peek(self):
+        """Returns the first question, or None if the file has none."""
+        questions = iter_questions(self.file_obj, self.file_type, self.column_name, self.chunksize)
+        try:
+            return next(questions, None)
+        finally:
+            questions.close()
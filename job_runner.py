@@ -0,0 +1,277 @@
+import asyncio
+import copy
+import itertools
+import threading
+import time
+import logging # Import logging module
+
+from config_file import log_sink_options
+from log_sink import configure_log_sinks
+from processing_engine import ProcessingEngine, new_api_metrics, update_rate_metrics, DEFAULT_MAX_CONCURRENCY
+from response_cache import ResponseCache, count_duplicates
+from metrics_store import MetricsStore, METRICS_DB, new_run_id
+from sharded_runner import run_sharded, ShardFailedError
+from state_manager import StateStore
+from streaming_histogram import StreamingHistogram
+from rate_counter import RateCounter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SNAPSHOT_INTERVAL = 0.5 # seconds between progress snapshots taken by a running job
+MAX_FINISHED_JOBS = 20 # finished jobs kept for display
+
+RUNNING = "running"
+STOPPING = "stopping"
+FINISHED = "finished"
+STOPPED = "stopped"
+FAILED = "failed"
+
+
+def snapshot_api_metrics(api_metrics):
+    """
+    Plain copy of a per-API metrics dict for display from another thread.
+
+    Histograms become their to_dict() form and rate counters are replaced by
+    the rpm/rps/window_error_rate values they yield right now.
+    """
+    update_rate_metrics(api_metrics)
+    snapshot = {}
+    for key, value in api_metrics.items():
+        if isinstance(value, StreamingHistogram):
+            snapshot[key] = value.to_dict()
+        elif isinstance(value, RateCounter):
+            continue
+        elif isinstance(value, (dict, list)):
+            snapshot[key] = copy.deepcopy(value)
+        else:
+            snapshot[key] = value
+    return snapshot
+
+
+class Job:
+    """
+    One processing run owned by a background thread.
+
+    The engine's thread publishes a snapshot (in the layout of the Metrics
+    page's st.session_state.metrics) at most every SNAPSHOT_INTERVAL seconds;
+    readers only ever take `job.snapshot`, so rendering never touches the
+    live metrics or blocks sending.
+    """
+
+    def __init__(self, job_id, settings):
+        self.id = job_id
+        self.settings = settings
+        self.status = RUNNING
+        self.error = None
+        self.stop_event = threading.Event()
+        self.start_time = time.time()
+        self.end_time = None
+        self.api_metrics = {}
+        self.completed_questions = 0
+        self.total_questions = None
+        self.resume_report = None
+        self.duplicates = None # duplicate pre-pass result, only with the response cache on
+        self.avg_row_time = None
+        self.thread = None
+        self._last_snapshot = 0.0
+        self.snapshot = self._build_snapshot()
+
+    @property
+    def running(self):
+        return self.status in (RUNNING, STOPPING)
+
+    def stop(self):
+        """Asks the engine to stop; requests already in flight still complete."""
+        if self.running:
+            self.status = STOPPING
+            self.stop_event.set()
+
+    def on_progress(self, done, total):
+        self.completed_questions = done
+        self.total_questions = total
+        now = time.monotonic()
+        if now - self._last_snapshot >= SNAPSHOT_INTERVAL:
+            self._last_snapshot = now
+            self.snapshot = self._build_snapshot()
+
+    def _build_snapshot(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'total_questions': self.total_questions or 0,
+            'completed_questions': self.completed_questions,
+            'api_metrics': {name: snapshot_api_metrics(metrics) for name, metrics in list(self.api_metrics.items())},
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'processing_running': self.running,
+            'stop_processing': self.stop_event.is_set(),
+            'avg_row_time': self.avg_row_time,
+            'resume_report': self.resume_report,
+            'duplicates': self.duplicates
+        }
+
+    def _run(self):
+        try:
+            run_processing_job(self)
+            self.status = STOPPED if self.stop_event.is_set() else FINISHED
+        except Exception as e:
+            logging.error(f"Job {self.id} failed: {e}")
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.end_time = time.time()
+            self.snapshot = self._build_snapshot()
+
+
+def start_duplicate_count(job, questions):
+    """
+    Counts repeated questions (response_cache.count_duplicates) on a thread of
+    its own, over a separate pass of the input, so the run does not wait for
+    it; the result appears as 'duplicates' in the job snapshot.
+    """
+    if not isinstance(questions, (list, tuple)):
+        questions = questions.reopen() if hasattr(questions, 'reopen') else None
+        if questions is None:
+            return # one-shot input: the run itself has to read it
+
+    def count():
+        try:
+            job.duplicates = count_duplicates(questions)
+        except Exception as e:
+            logging.warning(f"Duplicate count for job {job.id} failed: {e}")
+            return
+        if not job.running:
+            job.snapshot = job._build_snapshot() # the run finished first
+
+    threading.Thread(target=count, name=f"duplicates-job-{job.id}", daemon=True).start()
+
+
+def run_processing_job(job):
+    """
+    Runs the engine (or the sharded runner) for a job; called on the job's thread.
+
+    job.settings holds the Metrics/Configuration page settings: api_configs,
+    questions, fan_out, weighted, resume, state_db, and the global settings
+    (global_rate_limit_*, max_concurrency, worker_processes, response_cache,
+    coalesce_requests, write_metric_samples, log_*) and optionally metrics_db.
+    """
+    settings = job.settings
+    api_configs = settings['api_configs']
+    questions = settings['questions']
+    for cfg in api_configs:
+        job.api_metrics[cfg.get("name", "Unnamed API")] = new_api_metrics()
+
+    common = dict(
+        rate_limit_rate=settings.get('global_rate_limit_rate', 15),
+        rate_limit_period=settings.get('global_rate_limit_period', 60),
+        rate_limit_burst=settings.get('global_rate_limit_burst'),
+        max_concurrency=settings.get('max_concurrency', DEFAULT_MAX_CONCURRENCY),
+        fan_out=settings.get('fan_out', False),
+        coalesce=settings.get('coalesce_requests', False),
+        weighted=settings.get('weighted', False)
+    )
+    state_db = settings.get('state_db') if settings.get('resume') else None
+    if (settings.get('response_cache') or {}).get('enabled'):
+        start_duplicate_count(job, questions)
+    log_options = log_sink_options(settings)
+    configure_log_sinks(**log_options)
+    # Dashboard rollups of this run (see metrics_store)
+    metrics_store_settings = {
+        'db_path': settings.get('metrics_db', METRICS_DB),
+        'run_id': new_run_id(),
+        'keep_samples': settings.get('write_metric_samples', False)
+    }
+
+    if settings.get('worker_processes', 1) > 1:
+        # Shard across processes; each worker re-opens the input and reads its own share lazily
+        try:
+            job.api_metrics = run_sharded(questions, api_configs, settings['worker_processes'],
+                                          on_progress=job.on_progress, should_stop=job.stop_event.is_set,
+                                          state_db=state_db,
+                                          cache_settings=settings.get('response_cache'),
+                                          metrics_store_settings=metrics_store_settings, log_options=log_options,
+                                          **common)
+        except ShardFailedError as e:
+            job.api_metrics = e.api_metrics # what the other workers did; the job still fails
+            raise
+        job.total_questions = job.total_questions or job.completed_questions
+        skipped_requests = sum(m.get('skipped', 0) for m in job.api_metrics.values())
+        if skipped_requests:
+            job.resume_report = {'skipped_rows': None, 'skipped_requests': skipped_requests, 'time_saved': None}
+        return # run_sharded writes the merged metrics
+
+    state_store = StateStore(state_db) if state_db else None
+    response_cache = ResponseCache.from_settings(settings.get('response_cache'))
+    metrics_store = MetricsStore(**metrics_store_settings)
+    engine = ProcessingEngine(
+        api_configs,
+        job.api_metrics,
+        should_stop=job.stop_event.is_set,
+        on_progress=job.on_progress,
+        write_samples=settings.get('write_metric_samples', False),
+        state_store=state_store,
+        response_cache=response_cache,
+        metrics_store=metrics_store,
+        **common
+    )
+    try:
+        asyncio.run(engine.run(questions))
+    finally:
+        if state_store:
+            state_store.close()
+        if response_cache:
+            response_cache.close()
+        metrics_store.close()
+    job.total_questions = getattr(questions, 'total', None) or getattr(questions, 'count', None) or engine.completed_questions
+    if engine.skipped_requests:
+        job.resume_report = {
+            'skipped_rows': engine.skipped_rows,
+            'skipped_requests': engine.skipped_requests,
+            'time_saved': engine.estimated_time_saved
+        }
+    if settings.get('fan_out'):
+        job.avg_row_time = engine.avg_row_time
+    # The engine's MetricsPersister has already written the final metrics files
+
+
+class JobRunner:
+    """
+    Process-wide registry of background processing jobs.
+
+    Jobs run on daemon threads and live as long as the Streamlit server
+    process, so a browser refresh (which starts a new session) can pick the
+    latest job up again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+    def start(self, settings) -> Job:
+        """Starts a job on a new thread and returns it."""
+        with self._lock:
+            job = Job(next(self._ids), settings)
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, other in self._jobs.items() if not other.running]
+            for job_id in finished[:-MAX_FINISHED_JOBS]:
+                del self._jobs[job_id]
+        job.thread = threading.Thread(target=job._run, name=f"processing-job-{job.id}", daemon=True)
+        job.thread.start()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def latest(self):
+        """The most recently started job, or None."""
+        with self._lock:
+            return self._jobs[max(self._jobs)] if self._jobs else None
+
+    def running(self):
+        return [job for job in list(self._jobs.values()) if job.running]
+
+
+JOB_RUNNER = JobRunner()
@@ -0,0 +1,496 @@
+import atexit
+import calendar
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import zstandard # optional, enables zstd-compressed log segments
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# Durability modes, from fastest to safest:
+#   buffered - records are batched in memory and written when `batch_size` records
+#              are pending or `flush_interval` seconds have passed; a hard crash can
+#              lose up to that much data
+#   flush    - every batch the writer thread picks up is written to the OS at once;
+#              survives a process crash, not a power loss
+#   fsync    - like flush, followed by os.fsync() on every batch
+DURABILITY_BUFFERED = "buffered"
+DURABILITY_FLUSH = "flush"
+DURABILITY_FSYNC = "fsync"
+DURABILITY_MODES = (DURABILITY_BUFFERED, DURABILITY_FLUSH, DURABILITY_FSYNC)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0 # seconds
+DEFAULT_MAX_QUEUE = 100000 # records; writers block when the queue is full
+
+# Compression of rotated log segments; every written batch is one gzip member / zstd frame
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_MODES = (COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZSTD)
+SEGMENT_EXTENSIONS = {COMPRESSION_NONE: ".jsonl", COMPRESSION_GZIP: ".jsonl.gz", COMPRESSION_ZSTD: ".jsonl.zst"}
+INDEX_SUFFIX = ".idx" # sidecar index of a segment: one JSON line per record
+_SEGMENT_NAME = re.compile(r"\.(\d{8}-\d{6}-\d{3})(\.jsonl(?:\.gz|\.zst)?)$")
+
+_STOP = object()
+
+
+def index_fields(record: dict) -> dict:
+    """
+    Fields of a log record kept in the sidecar index: epoch timestamp, status code and latency.
+
+    Understands the records of output/logs/<api>_calls.jsonl, <api>_requests.jsonl
+    and output/metrics/<api>_samples.jsonl.
+    """
+    timestamp = record.get('timestamp')
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            timestamp = None
+    response = record.get('response') if isinstance(record.get('response'), dict) else {}
+    status_code = record.get('status_code', response.get('status_code'))
+    latency = next((value for value in (record.get('latency'), response.get('processing_time'),
+                                        record.get('duration'), record.get('processing_time'))
+                    if isinstance(value, (int, float))), None)
+    return {"t": timestamp, "status": status_code, "latency": latency}
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(data, compresslevel=6)
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    if compression == COMPRESSION_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Reading zstd log segments needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def _segment_compression(segment) -> str:
+    name = str(segment)
+    for compression, extension in SEGMENT_EXTENSIONS.items():
+        if compression != COMPRESSION_NONE and name.endswith(extension):
+            return compression
+    return COMPRESSION_NONE
+
+
+def log_segments(path):
+    """
+    Rotated segments of a log, oldest first.
+
+    Segments of output/logs/api_calls.jsonl are named
+    output/logs/api_calls.<UTC creation time>.jsonl[.gz|.zst].
+    """
+    path = Path(path)
+    stem = path.name[:-len(".jsonl")] if path.name.endswith(".jsonl") else path.name
+    if not path.parent.is_dir():
+        return []
+    segments = []
+    for candidate in path.parent.iterdir():
+        match = _SEGMENT_NAME.search(candidate.name)
+        if match and candidate.name[:match.start()] == stem:
+            segments.append(candidate)
+    return sorted(segments, key=lambda segment: _SEGMENT_NAME.search(segment.name).group(1))
+
+
+def _segment_created(segment) -> float:
+    stamp = _SEGMENT_NAME.search(Path(segment).name).group(1)
+    created = calendar.timegm(time.strptime(stamp[:15], "%Y%m%d-%H%M%S")) # name is UTC
+    return created + int(stamp[16:]) / 1000
+
+
+class LogSink:
+    """
+    Append-only JSONL writer with a persistent file handle and a background thread.
+
+    write() only enqueues the record, so callers never block on serialization
+    or disk I/O. The writer thread serializes records in batches and appends
+    each batch with a single write() call on an O_APPEND handle, which keeps
+    lines intact even when several processes share the file.
+
+    With compression or rotation configured the log is written as segments
+    (see log_segments()) instead of one growing file. Each batch becomes one
+    gzip member / zstd frame, and a sidecar index (<segment>.idx) records the
+    timestamp, status code and latency of every record with the byte offset
+    of its batch, so iter_log_records() can pull a time range or the errors
+    out of a segment by decompressing only the batches that hold them.
+    """
+
+    def __init__(self, path, batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 durability: str = DURABILITY_BUFFERED, max_queue: int = DEFAULT_MAX_QUEUE,
+                 compression: str = COMPRESSION_NONE, rotate_bytes: int = None, rotate_seconds: float = None,
+                 max_segments: int = None):
+        """
+        Args:
+            path: Log file (segments are written next to it when segmented)
+            batch_size: Records per write
+            flush_interval: Maximum seconds records stay queued in buffered mode
+            durability: One of DURABILITY_MODES
+            max_queue: Queued records before write() blocks
+            compression: One of COMPRESSION_MODES; anything but "none" writes segments
+            rotate_bytes: Start a new segment once the current one reaches this size
+            rotate_seconds: Start a new segment once the current one is this old
+            max_segments: Delete the oldest segments beyond this many
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        # Segment options may be changed on an open sink (see configure_log_sinks); they apply from the next batch
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_segments = max_segments
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = None # opened by the writer thread
+        self._index_file = None
+        self._segment = None # current segment path, None when writing self.path
+        self._segment_format = None
+        self._segment_created = None
+        self._pending = [] # (JSON line, index fields or None)
+        self._last_flush = time.monotonic()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"LogSink({self.path.name})", daemon=True)
+        self._thread.start()
+
+    @property
+    def segmented(self) -> bool:
+        return self.compression != COMPRESSION_NONE or bool(self.rotate_bytes) or bool(self.rotate_seconds)
+
+    def write(self, record: dict):
+        """Queues a record to be appended as one JSON line."""
+        if self._closed:
+            raise ValueError(f"Log sink for {self.path} is closed")
+        self._queue.put(record)
+
+    def flush(self, timeout: float = None):
+        """Blocks until everything queued so far has been written (and synced in fsync mode)."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Writes out all queued records and closes the file."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._close_files()
+
+    def _close_files(self):
+        for handle in (self._file, self._index_file):
+            if handle is not None:
+                handle.close()
+        self._file = self._index_file = None
+        self._segment = None
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            # Drain whatever else is already queued, up to one batch
+            items = [] if item is None else [item]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            waiters = []
+            segmented = self.segmented
+            for entry in items:
+                if entry is _STOP:
+                    stop = True
+                elif isinstance(entry, threading.Event):
+                    waiters.append(entry)
+                else:
+                    try:
+                        self._pending.append((json.dumps(entry, default=str) + '\n',
+                                              index_fields(entry) if segmented else None))
+                    except Exception as e:
+                        logging.error(f"Error serializing log record for {self.path}: {e}")
+
+            due = (time.monotonic() - self._last_flush >= self.flush_interval
+                   or len(self._pending) >= self.batch_size)
+            if self._pending and (stop or waiters or due or self.durability != DURABILITY_BUFFERED):
+                self._write_pending()
+            elif not self._pending:
+                self._last_flush = time.monotonic()
+
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write_pending(self):
+        pending = self._pending
+        self._pending = []
+        try:
+            self._open_for_write()
+            data = ''.join(line for line, _ in pending).encode('utf-8')
+            if self._segment is None:
+                self._write_all(self._file, data)
+            else:
+                payload = _compress(data, self._segment_format)
+                self._write_all(self._file, payload)
+                # O_APPEND leaves the position at the end of this write, even if other processes append too
+                offset = self._file.tell() - len(payload)
+                index = ''.join(
+                    json.dumps({**(fields or {}), "offset": offset, "length": len(payload), "line": line},
+                               separators=(',', ':')) + '\n'
+                    for line, (_, fields) in enumerate(pending))
+                self._write_all(self._index_file, index.encode('utf-8'))
+            if self.durability == DURABILITY_FSYNC:
+                os.fsync(self._file.fileno())
+                if self._index_file is not None:
+                    os.fsync(self._index_file.fileno())
+        except Exception as e:
+            logging.error(f"Error writing log file {self.path}: {e}")
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def _write_all(handle, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = handle.write(view)
+            view = view[written:]
+
+    def _open_for_write(self):
+        """Opens (or rotates to) the file the next batch goes to."""
+        if not self.segmented:
+            if self._segment is not None:
+                self._close_files()
+            if self._file is None:
+                self._file = open(self.path, 'ab', buffering=0)
+            return
+
+        compression = self.compression
+        if compression == COMPRESSION_ZSTD and not ZSTD_AVAILABLE:
+            if self._segment_format != COMPRESSION_GZIP:
+                logging.warning("zstd log compression needs the zstandard package (pip install zstandard). Using gzip.")
+            compression = COMPRESSION_GZIP
+        if self._segment is not None and compression == self._segment_format and not self._rotation_due():
+            return
+        # On first open, continue the newest segment (e.g. one another worker process is writing) if it is not due
+        join_existing = self._segment is None
+        self._close_files()
+        segment = None
+        if join_existing:
+            existing = [candidate for candidate in log_segments(self.path) if _segment_compression(candidate) == compression]
+            if existing:
+                segment = existing[-1]
+                self._segment_created = _segment_created(segment)
+        if segment is not None:
+            self._segment, self._segment_format = segment, compression
+            self._file = open(segment, 'ab', buffering=0)
+            if not self._rotation_due():
+                self._index_file = open(str(segment) + INDEX_SUFFIX, 'ab', buffering=0)
+                return
+            self._close_files()
+        self._new_segment(compression)
+
+    def _new_segment(self, compression: str):
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+        stem = self.path.name[:-len(".jsonl")] if self.path.name.endswith(".jsonl") else self.path.name
+        segment = self.path.parent / f"{stem}.{stamp}{SEGMENT_EXTENSIONS[compression]}"
+        self._segment, self._segment_format, self._segment_created = segment, compression, now
+        self._file = open(segment, 'ab', buffering=0)
+        self._index_file = open(str(segment) + INDEX_SUFFIX, 'ab', buffering=0)
+        if self.max_segments:
+            for old in log_segments(self.path)[:-self.max_segments]:
+                if old != segment:
+                    for stale in (old, Path(str(old) + INDEX_SUFFIX)):
+                        try:
+                            stale.unlink()
+                        except FileNotFoundError:
+                            pass
+
+    def _rotation_due(self) -> bool:
+        if self.rotate_bytes and os.fstat(self._file.fileno()).st_size >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self._segment_created >= self.rotate_seconds
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+_sink_defaults = {}
+# Options that also apply to sinks that are already open
+_LIVE_OPTIONS = ('durability', 'compression', 'rotate_bytes', 'rotate_seconds', 'max_segments')
+
+
+def configure_log_sinks(**options):
+    """
+    Sets the options (batch_size, flush_interval, durability, max_queue, compression,
+    rotate_bytes, rotate_seconds, max_segments) used for sinks created by get_log_sink();
+    durability and the segment options also apply to open sinks from their next batch.
+    """
+    if 'durability' in options and options['durability'] not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode: {options['durability']}")
+    if 'compression' in options and options['compression'] not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression: {options['compression']}")
+    with _sinks_lock:
+        _sink_defaults.update(options)
+        for key in _LIVE_OPTIONS:
+            if key in options:
+                for sink in _sinks.values():
+                    setattr(sink, key, options[key])
+
+
+def get_log_sink(path) -> LogSink:
+    """Returns the shared sink for `path`, creating it on first use."""
+    key = os.path.abspath(path)
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            sink = LogSink(path, **_sink_defaults)
+            _sinks[key] = sink
+        return sink
+
+
+def flush_log_sinks(timeout: float = None):
+    """Flushes every open sink."""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+    for sink in sinks:
+        sink.flush(timeout)
+
+
+def close_log_sinks():
+    """Flushes and closes every open sink; registered to run at interpreter exit."""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
+
+
+atexit.register(close_log_sinks)
+
+
+def _epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return value.timestamp() # datetime
+
+
+def _is_error(status_code) -> bool:
+    try:
+        return status_code is None or int(status_code) >= 400
+    except (TypeError, ValueError):
+        return True
+
+
+def _matches(entry: dict, start, end, errors_only: bool, wanted_codes) -> bool:
+    """Whether index fields (see index_fields) pass the iter_log_records() filters."""
+    timestamp = entry.get('t')
+    if start is not None and (timestamp is None or timestamp < start):
+        return False
+    if end is not None and (timestamp is None or timestamp >= end):
+        return False
+    if errors_only and not _is_error(entry.get('status')):
+        return False
+    if wanted_codes is not None and str(entry.get('status')) not in wanted_codes:
+        return False
+    return True
+
+
+def iter_log_records(path, start=None, end=None, errors_only: bool = False, status_codes=None):
+    """
+    Yields the records of a log that match the filters: first those of the
+    plain file itself (written without compression and rotation), then those
+    of its segments, oldest segment first.
+
+    Of the segments only the sidecar indexes are scanned in full; of the
+    segments themselves just the batches holding matching records are read
+    and decompressed.
+
+    Args:
+        path: Log file the sink was created for (e.g. output/logs/api_calls.jsonl)
+        start: Earliest record timestamp (epoch seconds or datetime), inclusive
+        end: Latest record timestamp (epoch seconds or datetime), exclusive
+        errors_only: Only records without a response or with status code >= 400
+        status_codes: Only records with one of these status codes
+    """
+    start, end = _epoch(start), _epoch(end)
+    wanted_codes = {str(code) for code in status_codes} if status_codes else None
+    if Path(path).is_file():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # torn last line of a file being written
+                if _matches(index_fields(record), start, end, errors_only, wanted_codes):
+                    yield record
+    for segment in log_segments(path):
+        index_path = Path(str(segment) + INDEX_SUFFIX)
+        if not index_path.exists():
+            logging.warning(f"No index for log segment {segment}; skipping it.")
+            continue
+        batches = {} # offset -> (length, [line numbers]), in file order
+        with open(index_path, 'r', encoding='utf-8') as index:
+            for row in index:
+                try:
+                    entry = json.loads(row)
+                except json.JSONDecodeError:
+                    continue # torn last line of a segment being written
+                if _matches(entry, start, end, errors_only, wanted_codes):
+                    batches.setdefault(entry['offset'], (entry['length'], []))[1].append(entry['line'])
+        if not batches:
+            continue
+        compression = _segment_compression(segment)
+        with open(segment, 'rb') as f:
+            for offset in sorted(batches):
+                length, lines = batches[offset]
+                f.seek(offset)
+                batch = _decompress(f.read(length), compression).decode('utf-8').splitlines()
+                for line in lines:
+                    yield json.loads(batch[line])
+
+
+def extract_log_records(path, output_path, **filters) -> int:
+    """
+    Writes the records selected by iter_log_records(path, **filters) to a plain JSONL file.
+
+    Returns:
+        Number of records written
+    """
+    count = 0
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for record in iter_log_records(path, **filters):
+            out.write(json.dumps(record, default=str) + '\n')
+            count += 1
+    return count
@@ -0,0 +1,312 @@
+import os
+import sqlite3
+import threading
+import time
+import logging # Import logging module
+
+from streaming_histogram import StreamingHistogram, DEFAULT_RELATIVE_ACCURACY, DEFAULT_MIN_VALUE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+METRICS_DB = os.path.join("output", "metrics", "metrics.db")
+DEFAULT_BUCKET_SECONDS = 10 # width of one rollup time bucket
+DEFAULT_FLUSH_INTERVAL = 1.0 # seconds between writes of buffered rollups
+DEFAULT_FLUSH_SAMPLES = 5000 # buffered samples that trigger a write
+ZERO_BIN = -(2 ** 31) # latency_bins row holding the histogram's zero bucket
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS runs ("
+    " run_id TEXT PRIMARY KEY,"
+    " started REAL NOT NULL"
+    ")",
+    # One row per (run, API, time bucket); every column is additive so writers in several processes can upsert
+    "CREATE TABLE IF NOT EXISTS rollups ("
+    " run_id TEXT NOT NULL,"
+    " api_name TEXT NOT NULL,"
+    " bucket INTEGER NOT NULL," # bucket start, epoch seconds
+    " requests INTEGER NOT NULL,"
+    " responses INTEGER NOT NULL," # requests that got an HTTP response (latency is over these)
+    " errors INTEGER NOT NULL,"
+    " latency_sum REAL NOT NULL,"
+    " latency_min REAL,"
+    " latency_max REAL,"
+    " payload_sum REAL NOT NULL,"
+    " PRIMARY KEY (run_id, api_name, bucket)"
+    ") WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS status_counts ("
+    " run_id TEXT NOT NULL,"
+    " api_name TEXT NOT NULL,"
+    " bucket INTEGER NOT NULL,"
+    " status_code TEXT NOT NULL,"
+    " count INTEGER NOT NULL,"
+    " PRIMARY KEY (run_id, api_name, bucket, status_code)"
+    ") WITHOUT ROWID",
+    # Latency histogram per (run, API) in streaming_histogram's logarithmic bins
+    "CREATE TABLE IF NOT EXISTS latency_bins ("
+    " run_id TEXT NOT NULL,"
+    " api_name TEXT NOT NULL,"
+    " bin INTEGER NOT NULL,"
+    " count INTEGER NOT NULL,"
+    " PRIMARY KEY (run_id, api_name, bin)"
+    ") WITHOUT ROWID",
+    # Raw samples, only kept when requested (Write Raw Metric Samples)
+    "CREATE TABLE IF NOT EXISTS samples ("
+    " run_id TEXT NOT NULL,"
+    " api_name TEXT NOT NULL,"
+    " timestamp REAL NOT NULL,"
+    " latency REAL,"
+    " payload_size REAL,"
+    " status_code TEXT,"
+    " success INTEGER NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+)
+
+
+def new_run_id() -> str:
+    """Sortable id for a run, e.g. 20240101-120000-4321."""
+    return time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+
+
+class _Rollup:
+    __slots__ = ("requests", "responses", "errors", "latency_sum", "latency_min", "latency_max", "payload_sum", "status_codes")
+
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.payload_sum = 0.0
+        self.status_codes = {}
+
+
+class MetricsStore:
+    """
+    Per-API, per-time-bucket rollups of request samples in SQLite (WAL mode).
+
+    Samples are aggregated in memory as they arrive and upserted at most
+    once per `flush_interval` seconds: a few rows per API and bucket instead
+    of one per request. All columns are sums (or min/max), so engines in
+    several worker processes can write the same run. The dashboard reads
+    these small aggregates; `version()` changes whenever new data was
+    written, and `read_rollups(since_bucket=...)` returns only newer buckets.
+    """
+
+    def __init__(self, db_path: str = METRICS_DB, run_id: str = None, bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+                 keep_samples: bool = False, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 flush_samples: int = DEFAULT_FLUSH_SAMPLES):
+        """
+        Args:
+            db_path: SQLite database file
+            run_id: Run the samples belong to (see new_run_id); shared by all workers of a run
+            bucket_seconds: Width of a rollup time bucket
+            keep_samples: Also store every raw sample
+            flush_interval: Maximum seconds samples stay buffered
+            flush_samples: Number of buffered samples that triggers a write
+        """
+        self.db_path = db_path
+        self.run_id = run_id or new_run_id()
+        self.bucket_seconds = max(1, int(bucket_seconds))
+        self.keep_samples = keep_samples
+        self.flush_interval = flush_interval
+        self.flush_samples = flush_samples
+        self._lock = threading.Lock()
+        self._rollups = {} # (api_name, bucket) -> _Rollup
+        self._histograms = {} # api_name -> StreamingHistogram of buffered latencies
+        self._samples = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, api_name: str, sample: dict):
+        """
+        Records one request.
+
+        Args:
+            api_name: API the request went to
+            sample: {"timestamp", "latency", "payload_size", "status_code", "success"}
+                (as passed to output_writer.MetricsPersister.record)
+        """
+        timestamp = sample.get('timestamp') or time.time()
+        bucket = int(timestamp // self.bucket_seconds) * self.bucket_seconds
+        latency = sample.get('latency')
+        status_code = sample.get('status_code')
+        with self._lock:
+            rollup = self._rollups.get((api_name, bucket))
+            if rollup is None:
+                rollup = self._rollups[(api_name, bucket)] = _Rollup()
+            rollup.requests += 1
+            if not sample.get('success'):
+                rollup.errors += 1
+            if status_code is not None:
+                # Like the per-API metrics: latency and payload only for requests that got a response
+                rollup.responses += 1
+                rollup.latency_sum += latency
+                rollup.latency_min = latency if rollup.latency_min is None else min(rollup.latency_min, latency)
+                rollup.latency_max = latency if rollup.latency_max is None else max(rollup.latency_max, latency)
+                histogram = self._histograms.get(api_name)
+                if histogram is None:
+                    histogram = self._histograms[api_name] = StreamingHistogram()
+                histogram.add(latency)
+                rollup.payload_sum += sample.get('payload_size') or 0
+                rollup.status_codes[str(status_code)] = rollup.status_codes.get(str(status_code), 0) + 1
+            if self.keep_samples:
+                self._samples.append((self.run_id, api_name, timestamp, latency, sample.get('payload_size'),
+                                      None if status_code is None else str(status_code), 1 if sample.get('success') else 0))
+            self._buffered += 1
+            if (self._buffered >= self.flush_samples
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def flush(self):
+        """Writes all buffered rollups in one transaction."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buffered:
+            return
+        rollups = [(self.run_id, api_name, bucket, r.requests, r.responses, r.errors, r.latency_sum, r.latency_min,
+                    r.latency_max, r.payload_sum) for (api_name, bucket), r in self._rollups.items()]
+        status_counts = [(self.run_id, api_name, bucket, code, count)
+                         for (api_name, bucket), r in self._rollups.items() for code, count in r.status_codes.items()]
+        bins = []
+        for api_name, histogram in self._histograms.items():
+            bins.extend((self.run_id, api_name, index, count) for index, count in histogram.buckets.items())
+            if histogram.zero_count:
+                bins.append((self.run_id, api_name, ZERO_BIN, histogram.zero_count))
+        try:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO runs (run_id, started) VALUES (?, ?)",
+                                   (self.run_id, time.time()))
+                self._conn.executemany(
+                    "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (run_id, api_name, bucket) DO UPDATE SET "
+                    " requests = requests + excluded.requests,"
+                    " responses = responses + excluded.responses,"
+                    " errors = errors + excluded.errors,"
+                    " latency_sum = latency_sum + excluded.latency_sum,"
+                    " latency_min = min(coalesce(latency_min, excluded.latency_min), coalesce(excluded.latency_min, latency_min)),"
+                    " latency_max = max(coalesce(latency_max, excluded.latency_max), coalesce(excluded.latency_max, latency_max)),"
+                    " payload_sum = payload_sum + excluded.payload_sum", rollups)
+                self._conn.executemany(
+                    "INSERT INTO status_counts VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (run_id, api_name, bucket, status_code) DO UPDATE SET count = count + excluded.count",
+                    status_counts)
+                self._conn.executemany(
+                    "INSERT INTO latency_bins VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (run_id, api_name, bin) DO UPDATE SET count = count + excluded.count", bins)
+                if self._samples:
+                    self._conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)", self._samples)
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+        except sqlite3.Error as e:
+            # Keep the buffer and try again with the next flush
+            logging.error(f"Error writing metrics rollups to {self.db_path}: {e}")
+            return
+        self._rollups.clear()
+        self._histograms.clear()
+        self._samples.clear()
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    # --- Reading (dashboard) ---
+
+    def version(self) -> int:
+        """Increases with every write from any process; use it to tell whether cached reads are stale."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def runs(self):
+        """Run ids, newest first."""
+        return [row[0] for row in self._conn.execute("SELECT run_id FROM runs ORDER BY started DESC")]
+
+    def summary(self, run_id: str = None):
+        """
+        Per-API totals over all buckets.
+
+        Args:
+            run_id: One run, or None for all runs
+
+        Returns:
+            List of dicts: api_name, requests, responses, errors, latency_sum, latency_min, latency_max,
+            payload_sum, first_bucket, last_bucket
+        """
+        where, params = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+        cursor = self._conn.execute(
+            "SELECT api_name, SUM(requests), SUM(responses), SUM(errors), SUM(latency_sum), MIN(latency_min),"
+            f" MAX(latency_max), SUM(payload_sum), MIN(bucket), MAX(bucket) FROM rollups {where}"
+            " GROUP BY api_name ORDER BY api_name", params)
+        columns = ("api_name", "requests", "responses", "errors", "latency_sum", "latency_min", "latency_max",
+                   "payload_sum", "first_bucket", "last_bucket")
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def read_rollups(self, run_id: str = None, since_bucket: int = None):
+        """
+        Rollup rows ordered by bucket, optionally only those at or after `since_bucket`.
+
+        Returns:
+            List of dicts: api_name, bucket, requests, responses, errors, latency_sum, latency_min, latency_max, payload_sum
+            (summed over runs when run_id is None)
+        """
+        conditions, params = [], []
+        if run_id:
+            conditions.append("run_id = ?")
+            params.append(run_id)
+        if since_bucket is not None:
+            conditions.append("bucket >= ?")
+            params.append(since_bucket)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self._conn.execute(
+            "SELECT api_name, bucket, SUM(requests), SUM(responses), SUM(errors), SUM(latency_sum), MIN(latency_min),"
+            f" MAX(latency_max), SUM(payload_sum) FROM rollups {where} GROUP BY api_name, bucket ORDER BY bucket",
+            params)
+        columns = ("api_name", "bucket", "requests", "responses", "errors", "latency_sum", "latency_min", "latency_max", "payload_sum")
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def status_codes(self, run_id: str = None):
+        """Returns {api_name: {status_code: count}}."""
+        where, params = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+        counts = {}
+        for api_name, status_code, count in self._conn.execute(
+                f"SELECT api_name, status_code, SUM(count) FROM status_counts {where} GROUP BY api_name, status_code",
+                params):
+            counts.setdefault(api_name, {})[status_code] = count
+        return counts
+
+    def latency_histogram(self, api_name: str, run_id: str = None) -> StreamingHistogram:
+        """Rebuilds an API's latency histogram (for percentiles) from its stored bins."""
+        where = "WHERE api_name = ?" + (" AND run_id = ?" if run_id else "")
+        params = (api_name, run_id) if run_id else (api_name,)
+        histogram = StreamingHistogram(DEFAULT_RELATIVE_ACCURACY, DEFAULT_MIN_VALUE)
+        for index, count in self._conn.execute(f"SELECT bin, SUM(count) FROM latency_bins {where} GROUP BY bin", params):
+            if index == ZERO_BIN:
+                histogram.zero_count = count
+            else:
+                histogram.buckets[index] = count
+        histogram.count = histogram.zero_count + sum(histogram.buckets.values())
+        row = self._conn.execute(
+            f"SELECT SUM(latency_sum), MIN(latency_min), MAX(latency_max) FROM rollups {where}", params).fetchone()
+        if row and histogram.count:
+            histogram.sum, histogram.min, histogram.max = row[0] or 0.0, row[1], row[2]
+        return histogram
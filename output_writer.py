@@ -1,50 +1,81 @@
 import json
 import logging
+import time
 from pathlib import Path
 from datetime import datetime
 
+from log_sink import get_log_sink
+from streaming_histogram import histogram_from
+
 def write_api_log(api_name: str, request: dict, response: dict):
-    """Write API call log to JSONL file"""
+    """Queue an API call log entry for output/logs/<api>_calls.jsonl (see log_sink)"""
     try:
         log_dir = Path("output/logs")
-        log_dir.mkdir(parents=True, exist_ok=True)
-        
+
         log_file = log_dir / f"{api_name}_calls.jsonl"
-        with open(log_file, 'a') as f:
-            json.dump({
-                "timestamp": datetime.now().isoformat(),
-                "api_name": api_name,
-                "request": request,
-                "response": response,
-                "processing_time": (datetime.now() - request['start_time']).total_seconds()
-            }, f)
-            f.write('\n')
+        start_time = request['start_time']
+        if isinstance(start_time, datetime):
+            processing_time = (datetime.now() - start_time).total_seconds()
+        else:
+            # Epoch seconds from time.time()
+            processing_time = time.time() - start_time
+        # Serialized and appended in batches by the shared background writer
+        get_log_sink(log_file).write({
+            "timestamp": datetime.now().isoformat(),
+            "api_name": api_name,
+            "request": request,
+            "response": response,
+            "processing_time": processing_time
+        })
     except Exception as e:
         logging.error(f"Error writing API log: {e}")
 
+DEFAULT_SNAPSHOT_INTERVAL = 2.0 # seconds between metrics snapshots per API
+
+
+def update_derived_metrics(metrics: dict):
+    """Recompute averages and percentages from the running sums in O(1)"""
+    if 'latency_sum' not in metrics:
+        # Metrics recorded before running sums were kept: seed them once
+        latencies = metrics.get('latencies', [])
+        payload_sizes = metrics.get('payload_sizes', [])
+        metrics['latency_sum'] = sum(latencies)
+        metrics['latency_count'] = len(latencies)
+        metrics['payload_size_sum'] = sum(payload_sizes)
+        metrics['payload_size_count'] = len(payload_sizes)
+
+    # Safely calculate derived metrics with zero-division protection
+    latency_count = metrics.get('latency_count', 0)
+    metrics['avg_latency'] = metrics['latency_sum']/latency_count if latency_count else 0
+
+    payload_size_count = metrics.get('payload_size_count', 0)
+    metrics['avg_payload_size'] = metrics['payload_size_sum']/payload_size_count if payload_size_count else 0
+
+    total_requests = metrics.get('processed', 0) + metrics.get('errors', 0)
+    metrics['error_percentage'] = (metrics.get('errors', 0)/total_requests)*100 if total_requests > 0 else 0
+    metrics['success_percentage'] = (metrics.get('successes', 0)/total_requests)*100 if total_requests > 0 else 0
+
+
 def write_api_metrics(api_name: str, metrics: dict):
     """Write enhanced API metrics to JSON file with robust error handling"""
     try:
         metrics_dir = Path("output/metrics")
         metrics_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Safely calculate derived metrics with zero-division protection
-        latencies = metrics.get('latencies', [])
-        metrics['avg_latency'] = sum(latencies)/len(latencies) if latencies else 0
-        
-        payload_sizes = metrics.get('payload_sizes', [])
-        metrics['avg_payload_size'] = sum(payload_sizes)/len(payload_sizes) if payload_sizes else 0
-        
-        total_requests = metrics.get('processed', 0) + metrics.get('errors', 0)
-        metrics['error_percentage'] = (metrics['errors']/total_requests)*100 if total_requests > 0 else 0
-        metrics['success_percentage'] = (metrics.get('successes', 0)/total_requests)*100 if total_requests > 0 else 0
-        
+
+        update_derived_metrics(metrics)
+        for key, prefix in (('latency_histogram', 'latency'), ('payload_size_histogram', 'payload_size')):
+            if metrics.get(key) is not None:
+                for label, value in histogram_from(metrics[key]).percentiles().items():
+                    metrics[f'{label}_{prefix}'] = value
+
         metrics_file = metrics_dir / f"{api_name}_metrics.json"
         
         # Write to temp file first then rename to ensure atomic write
         temp_file = metrics_dir / f"temp_{api_name}_metrics.json"
         with open(temp_file, 'w') as f:
-            json.dump(metrics, f, indent=2)
+            # Histograms are stored in their compact to_dict() form
+            json.dump(metrics, f, separators=(',', ':'),
+                      default=lambda o: o.to_dict() if hasattr(o, 'to_dict') else str(o))
         
         # Replace existing file
         temp_file.replace(metrics_file)
@@ -53,3 +84,35 @@ def write_api_metrics(api_name: str, metrics: dict):
     except Exception as e:
         logging.error(f"Error writing metrics for {api_name}: {str(e)}")
         raise
+
+
+class MetricsPersister:
+    """
+    Persists per-API metrics incrementally during a run.
+
+    Instead of rewriting output/metrics/<api>_metrics.json after every
+    request, a snapshot of the running aggregates is written at most once per
+    `interval` seconds per API. With `write_samples` every raw sample is also
+    appended to output/metrics/<api>_samples.jsonl through the log sink.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SNAPSHOT_INTERVAL, write_samples: bool = False):
+        self.interval = interval
+        self.write_samples = write_samples
+        self._last_written = {}
+
+    def record(self, api_name: str, metrics: dict, sample: dict = None):
+        """Call after each request; writes a snapshot if one is due."""
+        if self.write_samples and sample is not None:
+            get_log_sink(Path("output/metrics") / f"{api_name}_samples.jsonl").write(sample)
+
+        now = time.monotonic()
+        if now - self._last_written.get(api_name, float('-inf')) >= self.interval:
+            self._last_written[api_name] = now
+            write_api_metrics(api_name, metrics)
+
+    def write_all(self, api_metrics: dict):
+        """Writes a final snapshot for every API."""
+        for api_name, metrics in api_metrics.items():
+            write_api_metrics(api_name, metrics)
+            self._last_written[api_name] = time.monotonic()
@@ -2,14 +2,22 @@ import streamlit as st
 import os
 import pandas as pd
 import time
-import json
-import numpy as np
 import logging
-import requests # Ensure requests is imported
-
-from input_handler import load_questions
-from output_writer import write_api_log, write_api_metrics
-from api_logger import APILogger
+import copy
+
+from input_handler import QuestionStream
+from processing_engine import update_rate_metrics
+from state_manager import StateStore
+from streaming_histogram import histogram_from, REPORTED_PERCENTILES
+from job_runner import JOB_RUNNER
+
+STATE_DB_PATH = os.path.join("output", "state", "processing_state.db")
+REFRESH_INTERVAL = 1 # seconds between progress polls while a job runs
+# Settings from the Configuration page that are handed to a job
+JOB_SETTINGS = ('global_rate_limit_rate', 'global_rate_limit_period', 'global_rate_limit_burst', 'max_concurrency',
+                'worker_processes', 'response_cache', 'coalesce_requests', 'write_metric_samples',
+                'log_durability', 'log_compression', 'log_rotate_mb', 'log_rotate_minutes', 'log_keep_segments')
+os.makedirs(os.path.dirname(STATE_DB_PATH), exist_ok=True)
 
 st.set_page_config(layout="wide")
 st.title("API Processing Metrics")
@@ -25,6 +33,7 @@ if st.button("Reset Metrics & Clear File", key="reset_metrics_button", type="sec
         'processing_running': False,
         'stop_processing': False,
     }
+    st.session_state.job_id = None # detach from the finished job
     # Clear the file uploader state by setting its key in session_state to None
     if "file_uploader" in st.session_state:
         st.session_state.file_uploader = None
@@ -51,6 +60,18 @@ if 'metrics' not in st.session_state:
         'stop_processing': False,
     }
 
+# Reattach to this session's job; a new session (e.g. after a browser refresh) picks up
+# the latest job, and a running job is always shown even after Reset
+if 'job_id' in st.session_state:
+    job = JOB_RUNNER.get(st.session_state.job_id)
+else:
+    job = JOB_RUNNER.latest()
+if job is None and JOB_RUNNER.running():
+    job = JOB_RUNNER.running()[-1]
+if job is not None:
+    st.session_state.job_id = job.id
+    st.session_state.metrics = job.snapshot
+
 # Function to display metrics (simplified based on current state structure)
 def display_metrics():
     metrics = st.session_state.metrics
@@ -66,6 +87,20 @@ def display_metrics():
          st.metric("Processing Time", "N/A")
 
     st.metric("Total Questions", metrics.get('total_questions', 0))
+    resume_report = metrics.get('resume_report')
+    if resume_report:
+        message = f"Resumed from checkpoint: skipped {resume_report['skipped_requests']} already completed requests"
+        if resume_report.get('skipped_rows') is not None:
+            message += f" ({resume_report['skipped_rows']} whole rows)"
+        if resume_report.get('time_saved') is not None:
+            message += f", saving an estimated {resume_report['time_saved']:.1f}s"
+        st.info(message + ".")
+    duplicates = metrics.get('duplicates')
+    if duplicates and duplicates['duplicates']:
+        st.info(f"{duplicates['duplicates']} of {duplicates['total']} questions repeat an earlier one "
+                f"({duplicates['unique']} unique); repeats are answered from the response cache.")
+    if metrics.get('avg_row_time'):
+        st.metric("Avg Time per Question (fan-out)", f"{metrics['avg_row_time']:.4f}s")
 
     for api_name, api_metrics_data in metrics.get('api_metrics', {}).items():
         st.write(f"**{api_name}**")
@@ -80,7 +115,46 @@ def display_metrics():
         col4, col5, col6 = st.columns(3)
         col4.metric("Avg Latency", f"{api_metrics_data.get('avg_latency', 0):.4f}s")
         col5.metric("Avg Payload", f"{api_metrics_data.get('avg_payload_size', 0):.2f} bytes")
-        col6.metric("RPM", api_metrics_data.get('rpm', 0))
+        update_rate_metrics(api_metrics_data)
+        col6.metric("RPM", f"{api_metrics_data.get('rpm', 0):.0f}")
+        col7, col8, col9 = st.columns(3)
+        col7.metric("RPS (recent)", f"{api_metrics_data.get('rps', 0):.2f}")
+        col8.metric("Error % (last minute)", f"{api_metrics_data.get('window_error_rate', 0):.2f}%")
+        col9.metric("Retries", api_metrics_data.get('retries', 0),
+                    help=f"{api_metrics_data.get('retry_budget_exhausted', 0)} retries refused by the retry budget")
+        if api_metrics_data.get('concurrency_limit') is not None:
+            st.metric("Concurrency Limit", f"{api_metrics_data['concurrency_limit']:.1f}")
+        if 'queue_wait_avg' in api_metrics_data:
+            queue_cols = st.columns(3)
+            queue_cols[0].metric("Queue Depth", api_metrics_data.get('queue_depth', 0),
+                                 help=f"Peak: {api_metrics_data.get('queue_max_depth', 0)}")
+            queue_cols[1].metric("Avg Queue Wait", f"{api_metrics_data['queue_wait_avg']:.2f}s")
+            queue_cols[2].metric("Max Queue Wait", f"{api_metrics_data.get('queue_wait_max', 0):.2f}s")
+        breaker_state = api_metrics_data.get('breaker_state')
+        if breaker_state and breaker_state != 'closed':
+            st.warning(f"Circuit breaker {breaker_state.replace('_', '-')}: "
+                       f"{api_metrics_data.get('shed', 0)} calls shed without contacting the API.")
+        elif api_metrics_data.get('shed'):
+            st.metric("Shed Calls", api_metrics_data['shed'], help="Refused by the circuit breaker while the API was failing.")
+        if api_metrics_data.get('cache_hits'):
+            st.metric("Cache Hits", api_metrics_data['cache_hits'],
+                      help="Answered from the response cache; not included in latency, RPM or Processed.")
+        if api_metrics_data.get('coalesced'):
+            st.metric("Coalesced Requests", api_metrics_data['coalesced'],
+                      help="Shared the answer of an identical request already in flight; not included in latency or Processed.")
+        connections = api_metrics_data.get('connections')
+        if connections:
+            conn_cols = st.columns(3)
+            conn_cols[0].metric("Connections Opened", connections.get('connections_opened', 0))
+            conn_cols[1].metric("Connection Reuse", f"{connections.get('reuse_rate', 0)*100:.1f}%")
+            conn_cols[2].metric("HTTP/2 Requests", connections.get('http2_requests', 0))
+
+        # Latency percentiles from the fixed-memory histogram
+        latency_histogram = api_metrics_data.get('latency_histogram')
+        if latency_histogram is not None and histogram_from(latency_histogram).count:
+            percentile_cols = st.columns(len(REPORTED_PERCENTILES))
+            for col, (label, value) in zip(percentile_cols, histogram_from(latency_histogram).percentiles().items()):
+                col.metric(f"{label} Latency", f"{value:.4f}s")
         
         # Enhanced Status Code Visualization
         st.subheader("Status Code Analysis")
@@ -127,12 +201,14 @@ if uploaded_file:
         column_name = st.text_input("Enter the column name containing questions", value="question", key="column_name_input")
 
     try:
-        # Attempt to load questions
-        questions = load_questions(uploaded_file, file_type, column_name)
+        # Questions are streamed from the file during processing; only check
+        # here that the file yields at least one question
+        questions = QuestionStream(uploaded_file, file_type, column_name)
 
-        if not questions:
+        if questions.peek() is None:
              # Display warning only if loading succeeded but returned no questions
              st.warning("No questions loaded - check file format, content, and column name (if applicable).")
+             questions = None
 
     except Exception as e:
         # Display error if loading itself failed
@@ -143,7 +219,38 @@ if uploaded_file:
 # This section now runs regardless of upload success, but buttons are active only if questions exist
 
 if questions:
-    st.success(f"Loaded {len(questions)} questions successfully.")
+    st.success("File ready - questions will be streamed from it while processing.")
+
+    fan_out = st.checkbox(
+        "Send each question to all APIs in parallel",
+        value=st.session_state.get('fan_out_mode', False),
+        key="fan_out_mode",
+        help="The slowest API sets the time per question instead of the sum of all APIs."
+    )
+
+    weighted = st.checkbox(
+        "Per-API queues (weighted)",
+        value=st.session_state.get('weighted_mode', False),
+        key="weighted_mode",
+        disabled=fan_out,
+        help="Each API works through its own queue at its own rate limit, shared by API weight, "
+             "so fast APIs don't wait for slow ones."
+    )
+
+    col_resume, col_clear = st.columns(2)
+    with col_resume:
+        resume = st.checkbox(
+            "Resume from checkpoint",
+            value=st.session_state.get('resume_from_checkpoint', False),
+            key="resume_from_checkpoint",
+            help="Skip (question, API) pairs that already succeeded in an earlier run. Off by default "
+                 "(like cli.py --resume) so re-running the same file repeats the whole benchmark."
+        )
+    with col_clear:
+        if st.button("Clear Checkpoint", key="clear_checkpoint_button"):
+            with StateStore(STATE_DB_PATH) as state_store:
+                state_store.clear()
+            st.success("Checkpoint cleared.")
 
     # --- Processing Buttons ---
     col_start, col_stop = st.columns(2)
@@ -157,173 +264,67 @@ if questions:
             if not api_configs:
                 st.warning("No API configurations found. Please configure APIs on the Configuration page.")
             else:
-                # Reset metrics and set state for a new run
-                st.session_state.metrics['processing_running'] = True
-                st.session_state.metrics['stop_processing'] = False
-                st.session_state.metrics['start_time'] = time.time()
-                st.session_state.metrics['end_time'] = None # Reset end time
-                st.session_state.metrics['total_questions'] = len(questions)
-                st.session_state.metrics['api_metrics'] = {} # Reset specific API metrics
-
-                # Initialize metrics structure for this run
-                for cfg in api_configs:
-                    api_name = cfg.get("name", "Unnamed API")
-                    st.session_state.metrics['api_metrics'][api_name] = {
-                        'processed': 0,
-                        'successes': 0, 
-                        'errors': 0,
-                        'latencies': [],
-                        'payload_sizes': [],
-                        'status_codes': {},
-                        'timestamps': []
-                    }
-
-                # --- Start the actual processing loop ---
-                st.info("Processing started...")
-                progress_bar = st.progress(0)
-                total_q = len(questions)
-
-                for i, question in enumerate(questions):
-                    # Check stop flag at the beginning of each question iteration
-                    if st.session_state.metrics.get('stop_processing', False):
-                        st.warning("Processing stopped by user.")
-                        break # Exit the question loop
-
-                    for api_config in api_configs:
-                         # Check stop flag again before processing each API for a question
-                        if st.session_state.metrics.get('stop_processing', False):
-                            break # Exit the API config loop for this question
-
-                        api_name = api_config.get("name", "Unnamed API")
-                        try:
-                            # Parse headers and payload template safely
-                            headers = json.loads(api_config.get('headers', '{}') or '{}')
-                            payload_template_str = api_config.get('payload', '{}') or '{}'
-                            payload_template = json.loads(payload_template_str)
-
-                            # Replace placeholder with current question/entry
-                            if 'user_input' in payload_template:
-                                payload_template['user_input'] = question
-                            else:
-                                payload_template['question_entry'] = question
-
-                            # Prepare request
-                            method = api_config.get('method', 'POST').upper()
-                            url = api_config.get('url', '')
-                            request_args = {
-                                "headers": headers,
-                                "timeout": 15,
-                                "verify": not api_config.get('disable_ssl_verify', False)
-                            }
-                            
-                            # Add certificate if configured
-                            if api_config.get('auth_config', {}).get('cert_path'):
-                                request_args['cert'] = api_config['auth_config']['cert_path']
-                            
-                            # Add auth token if available
-                            if api_config.get('auth_config', {}).get('current_token'):
-                                if 'headers' not in request_args:
-                                    request_args['headers'] = {}
-                                request_args['headers']['Authorization'] = f"Bearer {api_config['auth_config']['current_token']}"
-
-                            # Make API call
-                            start_time = time.time()
-                            if method in ['POST', 'PUT', 'PATCH']:
-                                request_args["json"] = payload_template
-                                response = getattr(requests, method.lower())(url, **request_args)
-                            elif method == 'GET':
-                                request_args["params"] = payload_template
-                                response = requests.get(url, **request_args)
-                            elif method == 'DELETE':
-                                request_args["json"] = payload_template
-                                response = requests.delete(url, **request_args)
-                            else:
-                                raise ValueError(f"Unsupported HTTP method: {method}")
-
-                            # Track metrics
-                            api_metrics = st.session_state.metrics['api_metrics'][api_name]
-                            is_success = 200 <= response.status_code < 300
-                            
-                            if is_success:
-                                api_metrics['successes'] += 1
-                            else:
-                                api_metrics['errors'] += 1
-                            
-                            # Only raise for status if we want to stop on errors
-                            # response.raise_for_status()  # Removed to continue processing
-
-                            # Update metrics
-                            processing_time = time.time() - start_time
-                            api_metrics['processed'] += 1
-                            api_metrics.setdefault('latencies', []).append(processing_time)
-                            api_metrics.setdefault('payload_sizes', []).append(len(str(response.content)))
-                            api_metrics.setdefault('status_codes', {})[str(response.status_code)] = api_metrics['status_codes'].get(str(response.status_code), 0) + 1
-                            api_metrics.setdefault('timestamps', []).append(time.time())
-                            api_metrics['rpm'] = len([t for t in api_metrics['timestamps'] if time.time() - t <= 60])
-
-                            # Log the call
-                            write_api_log(
-                                api_name,
-                                {
-                                    "headers": headers,
-                                    "payload": payload_template,
-                                    "url": url,
-                                    "method": method,
-                                    "start_time": start_time
-                                },
-                                {
-                                    "status_code": response.status_code,
-                                    "headers": dict(response.headers),
-                                    "body": response.json() if response.content else {},
-                                    "processing_time": processing_time
-                                }
-                            )
-
-                            write_api_metrics(api_name, api_metrics)
-
-                        except json.JSONDecodeError as json_err:
-                            st.session_state.metrics['api_metrics'][api_name]['errors'] += 1
-                            logging.error(f"JSON Error for API '{api_name}': {json_err}")
-                        except requests.exceptions.RequestException as req_err:
-                            st.session_state.metrics['api_metrics'][api_name]['errors'] += 1
-                            logging.error(f"Request Error for API '{api_name}': {req_err}")
-                        except Exception as e:
-                            st.session_state.metrics['api_metrics'][api_name]['errors'] += 1
-                            logging.error(f"Error processing API '{api_name}': {e}")
-
-                    # Update progress bar after processing all APIs for one question
-                    progress_bar.progress((i + 1) / total_q)
-
-                    # Check stop flag again after processing all APIs for a question
-                    if st.session_state.metrics.get('stop_processing', False):
-                        break # Exit the question loop
-
-                # --- End of processing loop ---
-                st.session_state.metrics['end_time'] = time.time()
-                st.session_state.metrics['processing_running'] = False
-                if not st.session_state.metrics.get('stop_processing', False):
-                    # Save metrics for each API
-                    for api_name, api_metrics in st.session_state.metrics['api_metrics'].items():
-                        write_api_metrics(api_name, api_metrics)
-                    output_file = "metrics_saved"  # Confirmation message
-                    st.success(f"Processing finished! Results saved to {output_file}")
+                # The run belongs to a background thread; this page only polls its snapshots
+                job = JOB_RUNNER.start({
+                    # Copied so edits on the Configuration page don't change a running job
+                    'api_configs': copy.deepcopy(api_configs),
+                    'questions': questions,
+                    'fan_out': fan_out,
+                    'weighted': weighted,
+                    'resume': resume,
+                    'state_db': STATE_DB_PATH,
+                    **{key: st.session_state.get(key) for key in JOB_SETTINGS if key in st.session_state}
+                })
+                st.session_state.job_id = job.id
+                st.session_state.metrics = job.snapshot
                 st.rerun() # Rerun to update metrics display and button states
 
     with col_stop:
         # Disable button if not running
         stop_disabled = not st.session_state.metrics.get('processing_running', False)
         if st.button("Stop Processing", key="stop_processing_button", disabled=stop_disabled):
-            st.session_state.metrics['stop_processing'] = True
-            st.warning("Stop signal sent. Processing will halt soon...")
-            # No rerun here, let the loop handle stopping and rerun
+            if job is not None:
+                job.stop()
+                st.session_state.metrics = job.snapshot
+            st.warning("Stop signal sent. Requests already in flight will finish...")
 
 # --- Display Metrics ---
 # Moved display_metrics call outside the 'if uploaded_file' block
 # so metrics are always visible if they exist
-display_metrics()
+def show_job_metrics():
+    current = JOB_RUNNER.get(st.session_state.get('job_id'))
+    if current is not None:
+        st.session_state.metrics = current.snapshot
+        if current.status == 'failed':
+            st.error(f"Processing failed: {current.error}")
+        elif current.status == 'stopped':
+            st.warning("Processing stopped by user.")
+    metrics = st.session_state.metrics
+    if metrics.get('processing_running'):
+        total = metrics.get('total_questions')
+        done = metrics.get('completed_questions', 0)
+        if total:
+            st.progress(min(done / total, 1.0), text=f"{done}/{total} questions")
+        else:
+            st.progress(0, text=f"{done} questions processed")
+        # Live adaptive concurrency limits (single-process runs only)
+        limits = {name: m['concurrency_limit'] for name, m in metrics['api_metrics'].items()
+                  if m.get('concurrency_limit') is not None}
+        if limits:
+            st.caption("Concurrency limits: " + ", ".join(f"{name}: {limit:.1f}" for name, limit in limits.items()))
+    display_metrics()
+    if current is not None and not current.running and st.session_state.get('job_rendered_running'):
+        # The job just finished: rerun the whole page so the Start/Stop buttons update
+        st.session_state.job_rendered_running = False
+        st.rerun()
+    st.session_state.job_rendered_running = current is not None and current.running
 
 # --- Auto-refresh Section ---
-# Auto-refresh only if processing is actively running
-if st.session_state.metrics.get('processing_running', False):
-    time.sleep(3) # Slightly shorter refresh
-    st.rerun()
+# Poll the job's snapshot while it runs; only this part of the page re-renders
+if hasattr(st, 'fragment'):
+    st.fragment(run_every=REFRESH_INTERVAL if st.session_state.metrics.get('processing_running') else None)(show_job_metrics)()
+else:
+    show_job_metrics()
+    if st.session_state.metrics.get('processing_running', False):
+        time.sleep(REFRESH_INTERVAL)
+        st.rerun()
@@ -5,10 +5,11 @@ import json
 import time
 import logging
 import os
-try:
-    from jsonpath_ng import parse  # For JSON path extraction
-except ImportError:
-    st.error("jsonpath-ng package not found. Please install it with: pip install jsonpath-ng")
+from log_sink import DURABILITY_MODES, DURABILITY_BUFFERED, COMPRESSION_MODES, COMPRESSION_GZIP, ZSTD_AVAILABLE
+from request_template import compile_request
+from token_manager import parse_token_response
+from api_client import SUPPORTED_METHODS, HTTP2_AVAILABLE
+from config_file import export_config, load_config
 
 st.set_page_config(layout="wide") # Ensure wide layout for better display
 st.title("API Configuration")
@@ -21,6 +22,38 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 st.sidebar.subheader("Global Settings")
 global_rate_limit_rate = st.sidebar.number_input("Global Rate Limit Rate (requests)", min_value=1, value=st.session_state.get('global_rate_limit_rate', 15), key="sidebar_rate_rate")
 global_rate_limit_period = st.sidebar.number_input("Global Rate Limit Period (seconds)", min_value=1, value=st.session_state.get('global_rate_limit_period', 60), key="sidebar_rate_period")
+global_rate_limit_burst = st.sidebar.number_input("Global Burst (requests)", min_value=1, value=st.session_state.get('global_rate_limit_burst', global_rate_limit_rate), key="sidebar_rate_burst", help="Requests that may be sent back-to-back before the rate applies.")
+max_concurrency = st.sidebar.number_input("Max Concurrent Requests", min_value=1, value=st.session_state.get('max_concurrency', 10), key="sidebar_max_concurrency")
+log_durability = st.sidebar.selectbox(
+    "Log Durability",
+    options=list(DURABILITY_MODES),
+    index=list(DURABILITY_MODES).index(st.session_state.get('log_durability', DURABILITY_BUFFERED)),
+    key="sidebar_log_durability",
+    help="buffered: fastest, batches log writes (a crash can lose the last second). "
+         "flush: writes every batch immediately. fsync: also syncs every batch to disk (slowest)."
+)
+log_compression = st.sidebar.selectbox(
+    "Log Compression",
+    options=list(COMPRESSION_MODES),
+    index=list(COMPRESSION_MODES).index(st.session_state.get('log_compression', COMPRESSION_GZIP)),
+    key="sidebar_log_compression",
+    help="Logs are written as rotating segments with a sidecar index (see log_sink.iter_log_records). "
+         "none with both rotation settings at 0 keeps the single uncompressed .jsonl file."
+)
+if log_compression == "zstd" and not ZSTD_AVAILABLE:
+    st.sidebar.warning("zstd needs the zstandard package (pip install zstandard); gzip will be used.")
+log_rotate_mb = st.sidebar.number_input("Rotate Logs at (MB, 0 = never)", min_value=0, value=int(st.session_state.get('log_rotate_mb', 100)), key="sidebar_log_rotate_mb")
+log_rotate_minutes = st.sidebar.number_input("Rotate Logs Every (minutes, 0 = never)", min_value=0, value=int(st.session_state.get('log_rotate_minutes', 0)), key="sidebar_log_rotate_minutes")
+log_keep_segments = st.sidebar.number_input("Keep Log Segments (0 = all)", min_value=0, value=int(st.session_state.get('log_keep_segments', 0)), key="sidebar_log_keep_segments", help="Oldest segments beyond this many are deleted.")
+write_metric_samples = st.sidebar.checkbox("Write Raw Metric Samples", value=st.session_state.get('write_metric_samples', False), key="sidebar_write_metric_samples", help="Append every latency/payload sample to output/metrics/<api>_samples.jsonl")
+st.sidebar.subheader("Response Cache")
+response_cache = dict(st.session_state.get('response_cache') or {})
+response_cache['enabled'] = st.sidebar.checkbox("Cache Responses", value=response_cache.get('enabled', False), key="sidebar_cache_enabled", help="Answer repeated identical requests from a cache instead of calling the API again.")
+response_cache['ttl'] = st.sidebar.number_input("Cache TTL (hours)", min_value=1, value=int(response_cache.get('ttl', 86400) // 3600), key="sidebar_cache_ttl") * 3600
+response_cache['memory_entries'] = st.sidebar.number_input("In-Memory Entries", min_value=1, value=int(response_cache.get('memory_entries', 1024)), key="sidebar_cache_memory")
+response_cache['max_disk_mb'] = st.sidebar.number_input("Disk Cache Size (MB)", min_value=1, value=int(response_cache.get('max_disk_mb', 100)), key="sidebar_cache_disk")
+coalesce_requests = st.sidebar.checkbox("Coalesce Identical Requests", value=st.session_state.get('coalesce_requests', False), key="sidebar_coalesce_requests", help="Identical requests in flight at the same time (also from other users' runs) share one API call. Off by default: repeated questions in the input would not all be sent.")
+worker_processes = st.sidebar.number_input("Worker Processes", min_value=1, value=st.session_state.get('worker_processes', 1), key="sidebar_worker_processes", help="Shard the input across processes for very large files. The rate limit is split evenly between them.")
 
 # Initialize API configurations and global settings in session state and server state
 if 'api_configs' not in st.session_state:
@@ -44,6 +77,50 @@ if st.session_state.get('global_rate_limit_period') != global_rate_limit_period:
     st.session_state.global_rate_limit_period = global_rate_limit_period
     server_state.global_rate_limit_period = global_rate_limit_period
 
+if st.session_state.get('global_rate_limit_burst') != global_rate_limit_burst:
+    st.session_state.global_rate_limit_burst = global_rate_limit_burst
+    server_state.global_rate_limit_burst = global_rate_limit_burst
+
+if st.session_state.get('max_concurrency') != max_concurrency:
+    st.session_state.max_concurrency = max_concurrency
+    server_state.max_concurrency = max_concurrency
+
+if st.session_state.get('log_durability') != log_durability:
+    st.session_state.log_durability = log_durability
+    server_state.log_durability = log_durability
+
+if st.session_state.get('log_compression') != log_compression:
+    st.session_state.log_compression = log_compression
+    server_state.log_compression = log_compression
+
+if st.session_state.get('log_rotate_mb') != log_rotate_mb:
+    st.session_state.log_rotate_mb = log_rotate_mb
+    server_state.log_rotate_mb = log_rotate_mb
+
+if st.session_state.get('log_rotate_minutes') != log_rotate_minutes:
+    st.session_state.log_rotate_minutes = log_rotate_minutes
+    server_state.log_rotate_minutes = log_rotate_minutes
+
+if st.session_state.get('log_keep_segments') != log_keep_segments:
+    st.session_state.log_keep_segments = log_keep_segments
+    server_state.log_keep_segments = log_keep_segments
+
+if st.session_state.get('write_metric_samples') != write_metric_samples:
+    st.session_state.write_metric_samples = write_metric_samples
+    server_state.write_metric_samples = write_metric_samples
+
+if st.session_state.get('response_cache') != response_cache:
+    st.session_state.response_cache = response_cache
+    server_state.response_cache = response_cache
+
+if st.session_state.get('coalesce_requests') != coalesce_requests:
+    st.session_state.coalesce_requests = coalesce_requests
+    server_state.coalesce_requests = coalesce_requests
+
+if st.session_state.get('worker_processes') != worker_processes:
+    st.session_state.worker_processes = worker_processes
+    server_state.worker_processes = worker_processes
+
 
 st.subheader("API Configurations")
 
@@ -56,13 +133,43 @@ if st.button("Add API Configuration", key="add_api_button"):
                                 "headers": "{}",
                                 "payload": "",
                                 "disable_ssl_verify": False,
+                                "weight": 1,  # share of workers in per-API queue mode
+                                "rate_limit": {
+                                    "rate": 0,  # 0 = only the global limit applies
+                                    "period": 1,
+                                    "burst": 0  # 0 = same as rate
+                                },
+                                "retry_budget": {
+                                    "ratio": 0.1,  # retries <= 10% of requests
+                                    "reserve": 10
+                                },
+                                "connection_pool": {
+                                    "max_connections": 100,
+                                    "max_keepalive": 20,
+                                    "keepalive_expiry": 30,
+                                    "http2": False
+                                },
+                                "circuit_breaker": {
+                                    "enabled": False,
+                                    "failure_streak": 5,
+                                    "failure_rate": 0.5,
+                                    "open_seconds": 30
+                                },
+                                "adaptive_concurrency": {
+                                    "enabled": False,
+                                    "min": 1,
+                                    "max": 50,
+                                    "initial": 4
+                                },
                                 "auth_config": {
                                     "auth_url": "",
                                     "auth_method": "POST",
                                     "auth_headers": "{}",
                                     "auth_payload": "",
                                     "token_path": "token",  # JSON path to extract token
+                                    "expires_in_path": "expires_in",  # JSON path to the token lifetime in seconds
                                     "current_token": "",
+                                    "token_expires_at": None,
                                     "cert_path": ""
                                 }
                             }
@@ -102,6 +209,70 @@ for i, api_config in enumerate(api_configs_copy):
         if api_config['disable_ssl_verify']:
             st.warning("Warning: SSL verification is disabled - this is less secure!")
 
+        # Per-API rate limit, applied on top of the global limit
+        st.subheader("Rate Limit")
+        rate_limit = api_config.setdefault('rate_limit', {"rate": 0, "period": 1, "burst": 0})
+        rate_cols = st.columns(4)
+        rate_limit['rate'] = rate_cols[0].number_input("Requests per Period (0 = global only)", min_value=0,
+            value=int(rate_limit.get('rate', 0)), key=f"api_rate_{i}")
+        rate_limit['period'] = rate_cols[1].number_input("Period (seconds)", min_value=1,
+            value=int(rate_limit.get('period', 1)), key=f"api_rate_period_{i}")
+        rate_limit['burst'] = rate_cols[2].number_input("Burst (0 = same as rate)", min_value=0,
+            value=int(rate_limit.get('burst', 0)), key=f"api_rate_burst_{i}")
+        api_config['weight'] = rate_cols[3].number_input("Scheduling Weight", min_value=1,
+            value=int(api_config.get('weight', 1)), key=f"api_weight_{i}",
+            help="Relative share of workers when 'Per-API queues' is used on the Metrics page.")
+
+        # Retry budget: caps retries at a share of requests so outages don't cause retry storms
+        retry_budget = api_config.setdefault('retry_budget', {"ratio": 0.1, "reserve": 10})
+        retry_cols = st.columns(2)
+        retry_budget['ratio'] = retry_cols[0].number_input("Retry Budget (% of requests)", min_value=0, max_value=100,
+            value=int(round(retry_budget.get('ratio', 0.1) * 100)), key=f"api_retry_ratio_{i}") / 100
+        retry_budget['reserve'] = retry_cols[1].number_input("Retry Reserve (retries)", min_value=0,
+            value=int(retry_budget.get('reserve', 10)), key=f"api_retry_reserve_{i}",
+            help="Retries allowed before any requests have built up budget.")
+
+        # Connection pool: one pooled client per API, connections kept alive between requests
+        pool = api_config.setdefault('connection_pool', {"max_connections": 100, "max_keepalive": 20, "keepalive_expiry": 30, "http2": False})
+        pool_cols = st.columns(4)
+        pool['max_connections'] = pool_cols[0].number_input("Max Connections", min_value=1,
+            value=int(pool.get('max_connections', 100)), key=f"api_pool_max_{i}")
+        pool['max_keepalive'] = pool_cols[1].number_input("Keep-Alive Connections", min_value=0,
+            value=int(pool.get('max_keepalive', 20)), key=f"api_pool_keepalive_{i}")
+        pool['keepalive_expiry'] = pool_cols[2].number_input("Keep-Alive Expiry (s)", min_value=0,
+            value=int(pool.get('keepalive_expiry', 30)), key=f"api_pool_expiry_{i}")
+        pool['http2'] = pool_cols[3].checkbox("HTTP/2", value=pool.get('http2', False), key=f"api_pool_http2_{i}",
+            help="Multiplex requests over one connection. Requires: pip install httpx[http2]")
+        if pool['http2'] and not HTTP2_AVAILABLE:
+            st.warning("HTTP/2 needs the h2 package (pip install httpx[http2]); HTTP/1.1 will be used.")
+
+        # Circuit breaker: stop sending to an API that keeps failing, probe it again later
+        breaker = api_config.setdefault('circuit_breaker', {"enabled": False, "failure_streak": 5, "failure_rate": 0.5, "open_seconds": 30})
+        breaker['enabled'] = st.checkbox("Circuit Breaker", value=breaker.get('enabled', False), key=f"api_breaker_{i}",
+            help="Shed calls to this API while it fails (timeouts, connection errors, 5xx) so the other APIs keep running.")
+        if breaker['enabled']:
+            breaker_cols = st.columns(3)
+            breaker['failure_streak'] = breaker_cols[0].number_input("Open After Consecutive Failures", min_value=1,
+                value=int(breaker.get('failure_streak', 5)), key=f"api_breaker_streak_{i}")
+            breaker['failure_rate'] = breaker_cols[1].number_input("Or Failure Rate (%)", min_value=1, max_value=100,
+                value=int(round(breaker.get('failure_rate', 0.5) * 100)), key=f"api_breaker_rate_{i}") / 100
+            breaker['open_seconds'] = breaker_cols[2].number_input("Probe Again After (s)", min_value=1,
+                value=int(breaker.get('open_seconds', 30)), key=f"api_breaker_open_{i}")
+
+        # Adaptive concurrency: grows while the API keeps up, backs off on 429/5xx/timeouts
+        adaptive = api_config.setdefault('adaptive_concurrency', {"enabled": False, "min": 1, "max": 50, "initial": 4})
+        adaptive['enabled'] = st.checkbox("Adaptive Concurrency", value=adaptive.get('enabled', False),
+            key=f"api_adaptive_{i}",
+            help="Tune in-flight requests to this API automatically (AIMD). Max Concurrent Requests still caps the total.")
+        if adaptive['enabled']:
+            adaptive_cols = st.columns(3)
+            adaptive['min'] = adaptive_cols[0].number_input("Min In-Flight", min_value=1,
+                value=int(adaptive.get('min', 1)), key=f"api_adaptive_min_{i}")
+            adaptive['initial'] = adaptive_cols[1].number_input("Initial In-Flight", min_value=1,
+                value=int(adaptive.get('initial', 4)), key=f"api_adaptive_initial_{i}")
+            adaptive['max'] = adaptive_cols[2].number_input("Max In-Flight", min_value=1,
+                value=int(adaptive.get('max', 50)), key=f"api_adaptive_max_{i}")
+
         # Authorization Configuration Section
         st.subheader("Authorization Settings")
         auth_config = api_config['auth_config']
@@ -121,6 +292,14 @@ for i, api_config in enumerate(api_configs_copy):
         auth_config['token_path'] = st.text_input("Token JSON Path",
             value=auth_config.get('token_path', 'token'),
             key=f"token_path_{i}")
+        token_cols = st.columns(2)
+        auth_config['expires_in_path'] = token_cols[0].text_input("Expires-In JSON Path",
+            value=auth_config.get('expires_in_path', 'expires_in'),
+            key=f"expires_in_path_{i}",
+            help="Seconds until the token expires. JWT 'exp' claims are also understood.")
+        auth_config['refresh_margin'] = token_cols[1].number_input("Refresh Before Expiry (s)", min_value=0,
+            value=int(auth_config.get('refresh_margin', 60)), key=f"refresh_margin_{i}",
+            help="With an Auth Endpoint URL set, tokens are fetched and refreshed automatically during runs.")
         
         # Certificate Upload
         cert_file = st.file_uploader("Upload Certificate",
@@ -149,13 +328,10 @@ for i, api_config in enumerate(api_configs_copy):
                     )
                     response.raise_for_status()
                     
-                    # Extract token using JSON path
-                    jsonpath_expr = parse(auth_config['token_path'])
-                    matches = [match.value for match in jsonpath_expr.find(response.json())]
-                    if not matches:
-                        raise ValueError(f"Token path '{auth_config['token_path']}' not found in response")
-                    token = matches[0]
+                    # Extract token and expiry using JSON paths (same parsing as token_manager)
+                    token, expires_at = parse_token_response(auth_config, response.json())
                     auth_config['current_token'] = token
+                    auth_config['token_expires_at'] = expires_at
                     st.success(f"Token acquired: {token[:50]}...")
                     st.code(token)  # Display full token in copyable format
                     
@@ -170,6 +346,8 @@ for i, api_config in enumerate(api_configs_copy):
         st.subheader("Test API")
         # Add a button to test this specific API configuration
         test_button_key = f"test_api_button_{i}"
+        st.text_input("Test Question", value="test", key=f"test_question_{i}",
+            help="Fills the {question} placeholder (or user_input field) of the test request.")
         if st.button("Test This API", key=test_button_key):
             # Set the index of the API test to run on the next rerun
             st.session_state.test_api_index_to_run = i
@@ -224,44 +402,24 @@ if st.session_state.test_api_index_to_run is not None:
         current_api_config = st.session_state.api_configs[index_to_test]
 
         try:
-            # Parse headers and payload template safely
-            headers = json.loads(current_api_config.get('headers', '{}') or '{}')
-            payload_template_str = current_api_config.get('payload', '{}') or '{}'
-            payload_template = json.loads(payload_template_str)
-
-            # For testing, we can use a sample value for 'user_input' or just send the template
-            # Let's send the template as is for a basic connectivity test
-            # If 'user_input' exists, maybe put a placeholder? Let's just send the template.
-
-            # Make the API call dynamically based on method
-            method = current_api_config.get('method', 'POST').upper()
-            url = current_api_config.get('url', '')
+            # Same compiled request builder as the processing engine (see request_template)
+            template = compile_request(current_api_config)
+            token = (current_api_config.get('auth_config') or {}).get('current_token')
+            method, url, headers, payload_data = template.render(
+                st.session_state.get(f"test_question_{index_to_test}", "test"), token=token)
 
-            response = None
+            if method not in SUPPORTED_METHODS:
+                raise ValueError(f"Unsupported HTTP method: {method}")
             request_args = {
                 "headers": headers,
                 "timeout": 15, # Add a timeout
                 "verify": not current_api_config.get('disable_ssl_verify', False)
             }
-
-            if method in ['POST', 'PUT', 'PATCH']:
-                request_args["json"] = payload_template
-                if method == 'POST':
-                    response = requests.post(url, **request_args)
-                elif method == 'PUT':
-                    response = requests.put(url, **request_args)
-                else: # PATCH
-                    response = requests.patch(url, **request_args)
-            elif method == 'GET':
-                 # For GET, send payload items as URL params
-                request_args["params"] = payload_template
-                response = requests.get(url, **request_args)
-            elif method == 'DELETE':
-                # Send payload as json for DELETE
-                request_args["json"] = payload_template
-                response = requests.delete(url, **request_args)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
+            if isinstance(payload_data, dict):
+                request_args["params"] = payload_data # GET sends payload items as URL params
+            elif method != 'GET':
+                request_args["data"] = payload_data.encode('utf-8')
+            response = requests.request(method, url, **request_args)
 
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
 
@@ -310,6 +468,57 @@ if st.session_state.test_api_index_to_run is not None:
 
 st.divider() # Add a visual separator
 
+# --- Export / Import ---
+# The exported file is also what `python cli.py --config` reads
+CONFIG_WIDGET_PREFIXES = ("sidebar_", "api_", "auth_", "disable_ssl_", "token_path_", "expires_in_path_",
+                          "refresh_margin_", "test_question_", "expander_expanded_")
+
+
+def import_config():
+    """on_change callback of the import uploader; runs before the page so the widgets pick up the new values."""
+    uploaded = st.session_state.get("config_import_file")
+    if uploaded is None:
+        st.session_state.config_imported = None
+        return
+    try:
+        api_configs, settings = load_config(uploaded)
+    except ValueError as e:
+        st.session_state.config_import_error = str(e)
+        return
+    # Drop widget state so every input is rebuilt from the imported values
+    for key in [key for key in st.session_state.keys() if key.startswith(CONFIG_WIDGET_PREFIXES)]:
+        del st.session_state[key]
+    st.session_state.api_configs = api_configs
+    server_state.api_configs = api_configs.copy()
+    for key, value in settings.items():
+        if value is None:
+            st.session_state.pop(key, None)
+            continue
+        st.session_state[key] = value
+        setattr(server_state, key, value)
+    st.session_state.test_results = {}
+    st.session_state.config_import_error = None
+    st.session_state.config_imported = uploaded.name
+
+
+st.subheader("Export / Import")
+col_export, col_import = st.columns(2)
+with col_export:
+    st.download_button(
+        "Export Configuration",
+        data=json.dumps(export_config(st.session_state.api_configs, st.session_state), indent=2),
+        file_name="atap_config.json",
+        mime="application/json",
+        key="export_config_button",
+        help="APIs and global settings as JSON (fetched tokens are left out). Run it headless with: python cli.py --config atap_config.json INPUT"
+    )
+with col_import:
+    st.file_uploader("Import Configuration", type=["json"], key="config_import_file", on_change=import_config)
+if st.session_state.get('config_import_error'):
+    st.error(f"Could not import configuration: {st.session_state.config_import_error}")
+elif st.session_state.get('config_imported'):
+    st.success(f"Imported configuration from {st.session_state.config_imported}.")
+
 if st.button("Reset All Configurations", key="reset_configs_button", type="secondary"):
     if 'api_configs' in st.session_state:
         st.session_state.api_configs = []
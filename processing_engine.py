@@ -0,0 +1,515 @@
+import asyncio
+import logging
+import time
+
+from api_client import ApiClient, RateLimiter
+from request_coalescer import REQUEST_COALESCER
+from scheduler import WeightedScheduler, DEFAULT_QUEUE_SIZE
+from log_sink import flush_log_sinks
+from rate_counter import RateCounter
+from streaming_histogram import StreamingHistogram
+from output_writer import write_api_log, update_derived_metrics, MetricsPersister, DEFAULT_SNAPSHOT_INTERVAL
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_TIMEOUT = 15 # seconds, same as the old per-request timeout on the Metrics page
+DEFAULT_RPM_WINDOW = 60 # seconds covered by the 'rpm' counter
+DEFAULT_RPS_WINDOW = 10 # seconds covered by the 'rps' counter
+RATE_COUNTER_BUCKETS = 60
+RESUME_BATCH_SIZE = 256 # questions checked against the state store per bulk lookup
+
+
+def new_api_metrics(rpm_window: float = DEFAULT_RPM_WINDOW, rps_window: float = DEFAULT_RPS_WINDOW):
+    """Returns an empty per-API metrics dict in the layout used by the Metrics page."""
+    return {
+        'processed': 0,
+        'successes': 0,
+        'errors': 0,
+        'skipped': 0, # already completed in an earlier run (see state_manager.StateStore)
+        'retries': 0, # extra attempts, counted apart from requests so latency stays per attempt
+        'retry_budget_exhausted': 0, # retries refused by the per-API retry budget
+        'cache_hits': 0, # answered from the response cache; kept out of latency/RPM
+        'coalesced': 0, # shared an identical in-flight request's answer; also kept out of latency/RPM
+        'shed': 0, # refused by the open circuit breaker without calling the API
+        'breaker_state': None,
+        # Fixed-memory distributions (see streaming_histogram) instead of raw sample lists
+        'latency_histogram': StreamingHistogram(),
+        'payload_size_histogram': StreamingHistogram(),
+        'status_codes': {},
+        # Sliding-window rate counters (see rate_counter) instead of a list of timestamps
+        'rpm_counter': RateCounter(rpm_window, RATE_COUNTER_BUCKETS),
+        'rps_counter': RateCounter(rps_window, RATE_COUNTER_BUCKETS),
+        # Running aggregates so derived fields are maintained in O(1)
+        'latency_sum': 0.0,
+        'latency_count': 0,
+        'payload_size_sum': 0,
+        'payload_size_count': 0
+    }
+
+
+def build_rate_limiter(api_configs, rate, period, burst=None, share: float = 1.0):
+    """
+    RateLimiter with the global budget plus each config's optional 'rate_limit'
+    ({"rate", "period", "burst"}), every budget scaled by `share` (e.g. 1/N for N workers).
+    """
+    api_limits = {}
+    for cfg in api_configs:
+        limits = cfg.get('rate_limit') or {}
+        if limits.get('rate'):
+            api_limits[cfg.get("name", "Unnamed API")] = {
+                "rate": limits['rate'] * share,
+                "period": limits.get('period') or 1,
+                "burst": (limits.get('burst') or limits['rate']) * share
+            }
+    return RateLimiter(rate * share, period, burst=(burst or rate) * share, api_limits=api_limits)
+
+
+def _independent_passes(questions, count: int):
+    """
+    `count` iterables over the same questions that can be read at the same
+    time (lists, or QuestionStreams re-opened per pass), or None for one-shot
+    iterators that can only be read once.
+    """
+    if isinstance(questions, (list, tuple)):
+        return [questions] * count
+    if not hasattr(questions, 'reopen'):
+        return None
+    passes = [questions] # the caller's stream learns its total from the first pass
+    for _ in range(count - 1):
+        copy = questions.reopen()
+        if copy is None:
+            return None
+        passes.append(copy)
+    return passes
+
+
+def update_rate_metrics(api_metrics, now: float = None):
+    """Refreshes 'rpm', 'rps' and 'window_error_rate' (%) from the rate counters in O(1)."""
+    now = time.time() if now is None else now
+    if 'rpm_counter' in api_metrics:
+        api_metrics['rpm'] = api_metrics['rpm_counter'].per_minute(now)
+        api_metrics['window_error_rate'] = api_metrics['rpm_counter'].error_rate(now) * 100
+    if 'rps_counter' in api_metrics:
+        api_metrics['rps'] = api_metrics['rps_counter'].per_second(now)
+
+
+def record_result(api_metrics, result):
+    """
+    Updates a per-API metrics dict with the outcome of a single API call.
+
+    Args:
+        api_metrics: Metrics dict as returned by new_api_metrics()
+        result: Dict returned by ApiClient.call_api_detailed()
+    """
+    if result.get('cached'):
+        api_metrics['cache_hits'] = api_metrics.get('cache_hits', 0) + 1
+        return
+    if result.get('coalesced'):
+        api_metrics['coalesced'] = api_metrics.get('coalesced', 0) + 1
+        return
+    if result.get('breaker_state') is not None:
+        api_metrics['breaker_state'] = result['breaker_state']
+    if result.get('shed'):
+        api_metrics['shed'] = api_metrics.get('shed', 0) + 1
+        return
+
+    now = time.time()
+    status_code = result['status_code']
+    for counter in ('rpm_counter', 'rps_counter'):
+        if counter in api_metrics:
+            api_metrics[counter].record(now, error=not result['success'])
+    update_rate_metrics(api_metrics, now)
+    api_metrics['retries'] = api_metrics.get('retries', 0) + result.get('retries', 0)
+    if 'retry_budget_exhausted' in result:
+        api_metrics['retry_budget_exhausted'] = result['retry_budget_exhausted'] # running count per client
+    if result.get('connection_stats'):
+        api_metrics['connections'] = result['connection_stats'] # running counts per client
+    if result.get('concurrency_limit') is not None:
+        api_metrics['concurrency_limit'] = result['concurrency_limit'] # current adaptive limit
+
+    if status_code is None:
+        # No response at all (timeout, connection error, unsupported method)
+        api_metrics['errors'] += 1
+        update_derived_metrics(api_metrics)
+        return
+
+    if result['success']:
+        api_metrics['successes'] += 1
+    else:
+        api_metrics['errors'] += 1
+
+    api_metrics['processed'] += 1
+    api_metrics.setdefault('latency_histogram', StreamingHistogram()).add(result['latency'])
+    api_metrics.setdefault('payload_size_histogram', StreamingHistogram()).add(result['payload_size'])
+    api_metrics['latency_sum'] = api_metrics.get('latency_sum', 0.0) + result['latency']
+    api_metrics['latency_count'] = api_metrics.get('latency_count', 0) + 1
+    api_metrics['payload_size_sum'] = api_metrics.get('payload_size_sum', 0) + result['payload_size']
+    api_metrics['payload_size_count'] = api_metrics.get('payload_size_count', 0) + 1
+    status_codes = api_metrics.setdefault('status_codes', {})
+    status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+    update_derived_metrics(api_metrics)
+
+
+class ProcessingEngine:
+    """
+    Sends every question to every configured API with bounded concurrency.
+
+    A producer feeds (question, API) pairs into a bounded queue which a fixed
+    pool of workers drains through ApiClient. At most ``max_concurrency``
+    requests are in flight at once, so throughput is capped by the shared
+    RateLimiter instead of by round-trip latency.
+
+    In fan-out mode the queue holds whole questions instead: each one is sent
+    to all APIs at once and the results are joined back per question, so the
+    slowest API sets the time per row rather than the sum of all of them.
+
+    With a state store, completed (question, API) pairs are checkpointed as
+    they succeed and skipped on the next run. Pairs are looked up in bulk per
+    batch of questions, so rows that are being skipped never sit in the work
+    queue ahead of rows that still have to be sent.
+    """
+
+    def __init__(self, api_configs, api_metrics, rate_limit_rate: int = 15, rate_limit_period: int = 60,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: int = DEFAULT_TIMEOUT,
+                 retries: int = 3, should_stop=None, on_progress=None, persist_metrics: bool = True,
+                 fan_out: bool = False, on_row=None, snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL,
+                 write_samples: bool = False, rpm_window: float = DEFAULT_RPM_WINDOW,
+                 rps_window: float = DEFAULT_RPS_WINDOW, state_store=None, rate_limit_burst: int = None,
+                 rate_share: float = 1.0, response_cache=None, coalesce: bool = False, weighted: bool = False,
+                 scheduler_queue_size: int = DEFAULT_QUEUE_SIZE, metrics_store=None):
+        """
+        Args:
+            api_configs: API configurations from the Configuration page
+            api_metrics: Dict of per-API metrics dicts, updated in place
+            rate_limit_rate: Global rate limit (requests per period)
+            rate_limit_period: Global rate limit period in seconds
+            rate_limit_burst: Global burst size (defaults to rate_limit_rate); per-API
+                budgets come from each config's 'rate_limit'
+            rate_share: Fraction of every rate budget this engine may use
+            max_concurrency: Maximum number of requests in flight
+            timeout: Per-request timeout in seconds
+            retries: Attempts per request (see ApiClient.call_api)
+            should_stop: Optional callable returning True when processing should stop
+            on_progress: Optional callable(completed_questions, total_questions)
+            persist_metrics: Write snapshots of output/metrics/<api>_metrics.json during the run
+            fan_out: Dispatch each question to all APIs at once and join the results
+            on_row: Optional callable(index, question, {api_name: result}) called per
+                question in fan-out mode; result is None if the call raised
+            snapshot_interval: Minimum seconds between metrics snapshots per API
+            write_samples: Also append raw samples to output/metrics/<api>_samples.jsonl
+            rpm_window: Seconds covered by the 'rpm' rate counter of new metrics
+            rps_window: Seconds covered by the 'rps' rate counter of new metrics
+            state_store: Optional state_manager.StateStore to resume from and checkpoint to
+            response_cache: Optional response_cache.ResponseCache shared by all APIs' clients
+            coalesce: Share one upstream call between identical in-flight requests,
+                including those of other runs in this process
+            weighted: Give every API its own queue and dispatch by rate-limit readiness and
+                api_config['weight'] (see scheduler.WeightedScheduler); ignored with fan_out.
+                Lists and QuestionStreams are read once per API so every queue is fed on its own
+            scheduler_queue_size: Questions buffered per API in weighted mode
+            metrics_store: Optional metrics_store.MetricsStore that receives every sample
+                for the dashboard's rollups; flushed at the end of the run, closed by the caller
+        """
+        self.api_configs = api_configs
+        self.api_metrics = api_metrics
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_period = rate_limit_period
+        self.rate_limit_burst = rate_limit_burst
+        self.rate_share = rate_share
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.retries = retries
+        self.should_stop = should_stop
+        self.on_progress = on_progress
+        self.persist_metrics = persist_metrics
+        self.rpm_window = rpm_window
+        self.rps_window = rps_window
+        self.persister = MetricsPersister(snapshot_interval, write_samples) if persist_metrics else None
+        self.metrics_store = metrics_store
+        self.fan_out = fan_out
+        self.on_row = on_row
+        self.completed_questions = 0
+        self.total_questions = None
+        self.row_count = 0
+        self.row_time_total = 0.0
+        self.state_store = state_store
+        self.skipped_rows = 0
+        self.skipped_requests = 0
+        self.response_cache = response_cache
+        self.coalesce = coalesce
+        self.weighted = weighted and not fan_out
+        self.scheduler_queue_size = scheduler_queue_size
+        self.scheduler = None
+        self._api_done = None # {api_name: questions done} while every API has its own producer
+
+    def _stopped(self):
+        return bool(self.should_stop and self.should_stop())
+
+    @property
+    def avg_row_time(self):
+        """Average wall time per question in fan-out mode (seconds)."""
+        return self.row_time_total / self.row_count if self.row_count else 0
+
+    @property
+    def estimated_time_saved(self):
+        """
+        Estimated wall time (seconds) saved by skipping checkpointed requests: the
+        larger of their latency at this run's concurrency and their rate-limit cost.
+        """
+        request_seconds = sum(metrics.get('skipped', 0) * metrics.get('avg_latency', 0)
+                              for metrics in self.api_metrics.values())
+        latency_bound = request_seconds / self.max_concurrency
+        rate = self.rate_limit_rate * self.rate_share
+        rate_bound = self.skipped_requests * self.rate_limit_period / rate if rate else 0
+        return max(latency_bound, rate_bound)
+
+    async def run(self, questions):
+        """
+        Processes all questions and returns the per-API metrics dict.
+
+        Args:
+            questions: Iterable of questions. Generators are consumed lazily, with the
+                bounded work queue providing backpressure; a `total` attribute (see
+                input_handler.QuestionStream) is reported once it becomes known.
+        """
+        for cfg in self.api_configs:
+            self.api_metrics.setdefault(cfg.get("name", "Unnamed API"), new_api_metrics(self.rpm_window, self.rps_window))
+
+        self.completed_questions = 0
+        self._questions = questions
+        self.total_questions = len(questions) if hasattr(questions, '__len__') else getattr(questions, 'total', None)
+        self.row_count = 0
+        self.row_time_total = 0.0
+        self.skipped_rows = 0
+        self.skipped_requests = 0
+
+        rate_limiter = build_rate_limiter(self.api_configs, self.rate_limit_rate, self.rate_limit_period,
+                                          self.rate_limit_burst, self.rate_share)
+        coalescer = REQUEST_COALESCER if self.coalesce else None
+        clients = [ApiClient(cfg, rate_limiter, timeout=self.timeout, response_cache=self.response_cache,
+                             coalescer=coalescer)
+                   for cfg in self.api_configs]
+        # Bounded so the producer never runs far ahead of the workers
+        queue = asyncio.Queue(maxsize=self.max_concurrency * 2)
+        pending = {} # question index -> number of APIs still to answer
+        self.scheduler = None
+        if self.weighted:
+            # Per-API queues instead of the shared one; workers take whichever API can send next
+            self.scheduler = WeightedScheduler(clients, rate_limiter, self.scheduler_queue_size)
+            workers = [asyncio.create_task(self._scheduled_worker(pending)) for _ in range(self.max_concurrency)]
+        elif self.fan_out:
+            # Every question worker has one request in flight per API
+            worker_count = max(1, self.max_concurrency // max(1, len(clients)))
+            workers = [asyncio.create_task(self._fan_out_worker(queue)) for _ in range(worker_count)]
+        else:
+            workers = [asyncio.create_task(self._worker(queue, pending)) for _ in range(self.max_concurrency)]
+
+        self._api_done = None
+        passes = _independent_passes(questions, len(clients)) if self.scheduler else None
+        try:
+            if passes:
+                # One producer per API, each reading its own pass over the input, so a full
+                # queue of a slow API never holds back the questions of the others
+                self._api_done = {client.api_config.get("name", "Unnamed API"): 0 for client in clients}
+                self.skipped_rows = None # not known when every API skips on its own
+                await asyncio.gather(*(self._produce(source, [client], queue, pending)
+                                       for source, client in zip(passes, clients)))
+            else:
+                await self._produce(questions, clients, queue, pending)
+            if self.scheduler:
+                await self.scheduler.close()
+                await asyncio.gather(*workers)
+            else:
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for client in clients:
+                await client.aclose()
+            if self.state_store:
+                self.state_store.commit()
+            if self.persister:
+                self.persister.write_all(self.api_metrics)
+            if self.metrics_store:
+                self.metrics_store.flush()
+            # Make sure this run's logs are on disk before reporting completion
+            await asyncio.to_thread(flush_log_sinks)
+
+        return self.api_metrics
+
+    async def _produce(self, questions, clients, queue, pending):
+        """Reads questions and queues them for `clients` in batches (see _dispatch) until done or stopped."""
+        batch_size = RESUME_BATCH_SIZE if self.state_store else 1
+        batch = []
+        for index, question in enumerate(questions):
+            if self._stopped():
+                logging.info("Processing stopped by user.")
+                return
+            batch.append((index, question))
+            if len(batch) >= batch_size:
+                await self._dispatch(batch, clients, queue, pending)
+                batch = []
+        if batch:
+            await self._dispatch(batch, clients, queue, pending)
+
+    async def _dispatch(self, batch, clients, queue, pending):
+        """Queues a batch of (index, question), leaving out pairs already in the state store."""
+        done = {}
+        if self.state_store:
+            questions = [question for _, question in batch]
+            for client in clients:
+                api_name = client.api_config.get("name", "Unnamed API")
+                done[api_name] = self.state_store.processed_among(questions, api_name)
+
+        for position, (index, question) in enumerate(batch):
+            to_call = []
+            for client in clients:
+                api_name = client.api_config.get("name", "Unnamed API")
+                if done and done[api_name][position]:
+                    self.api_metrics[api_name]['skipped'] += 1
+                    self.skipped_requests += 1
+                    if self._api_done is not None:
+                        self._api_question_done(api_name)
+                else:
+                    to_call.append(client)
+
+            if self._api_done is not None:
+                # Per-API producer: progress is counted per API (see _api_question_done)
+                for client in to_call:
+                    await self.scheduler.put(client.api_config.get("name", "Unnamed API"), index, question)
+                continue
+
+            if not to_call:
+                # Every API already answered this question in an earlier run
+                self.skipped_rows += 1
+                self._question_done()
+                continue
+            if self.fan_out:
+                await queue.put((index, question, to_call))
+                continue
+            pending[index] = len(to_call)
+            for client in to_call:
+                if self.scheduler:
+                    await self.scheduler.put(client.api_config.get("name", "Unnamed API"), index, question)
+                else:
+                    await queue.put((index, question, client))
+
+    def _api_question_done(self, api_name):
+        """With per-API producers a question counts as done once every API got that many questions done."""
+        self._api_done[api_name] += 1
+        if min(self._api_done.values()) > self.completed_questions:
+            self._question_done()
+
+    def _question_done(self):
+        self.completed_questions += 1
+        if self.total_questions is None:
+            self.total_questions = getattr(self._questions, 'total', None)
+        if self.on_progress:
+            self.on_progress(self.completed_questions, self.total_questions)
+
+    async def _worker(self, queue, pending):
+        while True:
+            index, question, client = await queue.get()
+            try:
+                # Drain without sending once a stop was requested
+                if not self._stopped():
+                    await self._process_safe(client, question)
+            finally:
+                pending[index] -= 1
+                if pending[index] == 0:
+                    del pending[index]
+                    self._question_done()
+                queue.task_done()
+
+    async def _scheduled_worker(self, pending):
+        while True:
+            work = await self.scheduler.get()
+            if work is None:
+                return
+            client, index, question = work
+            try:
+                if not self._stopped():
+                    await self._process_safe(client, question)
+            finally:
+                api_name = client.api_config.get("name", "Unnamed API")
+                self.api_metrics[api_name].update(self.scheduler.queues[api_name].stats())
+                if self._api_done is not None:
+                    self._api_question_done(api_name)
+                else:
+                    pending[index] -= 1
+                    if pending[index] == 0:
+                        del pending[index]
+                        self._question_done()
+
+    async def _fan_out_worker(self, queue):
+        while True:
+            index, question, clients = await queue.get()
+            try:
+                if not self._stopped():
+                    row_start = time.monotonic()
+                    results = await asyncio.gather(*(self._process_safe(client, question) for client in clients))
+                    self.row_time_total += time.monotonic() - row_start
+                    self.row_count += 1
+                    if self.on_row:
+                        names = [client.api_config.get("name", "Unnamed API") for client in clients]
+                        self.on_row(index, question, dict(zip(names, results)))
+            finally:
+                self._question_done()
+                queue.task_done()
+
+    async def _process_safe(self, client, question):
+        """Runs _process, counting any exception as an error for that API. Returns the result or None."""
+        try:
+            return await self._process(client, question)
+        except Exception as e:
+            api_name = client.api_config.get("name", "Unnamed API")
+            self.api_metrics[api_name]['errors'] += 1
+            update_derived_metrics(self.api_metrics[api_name])
+            logging.error(f"Error processing API '{api_name}': {e}")
+            return None
+
+    async def _process(self, client, question):
+        api_name = client.api_config.get("name", "Unnamed API")
+        api_metrics = self.api_metrics[api_name]
+
+        start_time = time.time()
+        result = await client.call_api_detailed(question, retries=self.retries)
+        record_result(api_metrics, result)
+        if self.state_store and result['success']:
+            self.state_store.mark_processed(question, api_name)
+
+        request = result['request']
+        write_api_log(
+            api_name,
+            {
+                "headers": request['headers'],
+                "payload": request['payload'],
+                "url": request['url'],
+                "method": request['method'],
+                "start_time": start_time
+            },
+            {
+                "status_code": result['status_code'],
+                "headers": result['response_headers'],
+                "body": result['response'],
+                "processing_time": result['latency']
+            }
+        )
+
+        if (self.persister or self.metrics_store) and not (result.get('cached') or result.get('coalesced') or result.get('shed')):
+            sample = {
+                "timestamp": time.time(),
+                "latency": result['latency'],
+                "payload_size": result['payload_size'],
+                "status_code": result['status_code'],
+                "success": result['success']
+            }
+            if self.persister:
+                self.persister.record(api_name, api_metrics, sample)
+            if self.metrics_store:
+                self.metrics_store.add(api_name, sample)
+
+        return result
@@ -0,0 +1,92 @@
+import time
+
+
+class RateCounter:
+    """
+    Sliding-window request/error counter in constant time and memory.
+
+    The window is split into `buckets` slots of a ring buffer. Each slot holds
+    the counts for one bucket-width of time; running totals are kept for the
+    whole window, and slots that fall out of the window are subtracted as the
+    clock advances. Rates are therefore accurate to one bucket width.
+    """
+
+    def __init__(self, window: float = 60.0, buckets: int = 60):
+        self.window = window
+        self.bucket_count = buckets
+        self.bucket_width = window / buckets
+        self._counts = [0] * buckets
+        self._errors = [0] * buckets
+        self._total = 0
+        self._total_errors = 0
+        self._epoch = None # index of the newest bucket, in bucket widths since the epoch
+
+    def _advance(self, now):
+        self._advance_to(int(now // self.bucket_width))
+
+    def _advance_to(self, epoch):
+        if self._epoch is None:
+            self._epoch = epoch
+            return
+        if epoch <= self._epoch:
+            return
+        # Clear every slot that left the window; at most one full turn of the ring
+        for expired in range(self._epoch + 1, min(epoch, self._epoch + self.bucket_count) + 1):
+            slot = expired % self.bucket_count
+            self._total -= self._counts[slot]
+            self._total_errors -= self._errors[slot]
+            self._counts[slot] = 0
+            self._errors[slot] = 0
+        self._epoch = epoch
+
+    def record(self, now: float = None, error: bool = False, count: int = 1):
+        """Records `count` requests at time `now` (defaults to time.time())."""
+        now = time.time() if now is None else now
+        self._advance(now)
+        slot = int(now // self.bucket_width)
+        if slot <= self._epoch - self.bucket_count:
+            return # older than the window
+        slot %= self.bucket_count
+        self._counts[slot] += count
+        self._total += count
+        if error:
+            self._errors[slot] += count
+            self._total_errors += count
+
+    def count(self, now: float = None) -> int:
+        """Requests in the last `window` seconds."""
+        self._advance(time.time() if now is None else now)
+        return self._total
+
+    def per_second(self, now: float = None) -> float:
+        return self.count(now) / self.window
+
+    def per_minute(self, now: float = None) -> float:
+        return self.count(now) * 60 / self.window
+
+    def error_rate(self, now: float = None) -> float:
+        """Fraction of requests in the window that were errors."""
+        total = self.count(now)
+        return self._total_errors / total if total else 0
+
+    def merge(self, other: "RateCounter"):
+        """Adds another counter with the same window and bucket layout (e.g. from another worker)."""
+        if other.bucket_count != self.bucket_count or other.bucket_width != self.bucket_width:
+            raise ValueError("Cannot merge rate counters with different windows")
+        if other._epoch is None:
+            return self
+        self._advance_to(other._epoch)
+        other._advance_to(self._epoch)
+        for slot in range(self.bucket_count):
+            self._counts[slot] += other._counts[slot]
+            self._errors[slot] += other._errors[slot]
+        self._total += other._total
+        self._total_errors += other._total_errors
+        return self
+
+    def to_dict(self):
+        return {
+            "window": self.window,
+            "count": self._total,
+            "errors": self._total_errors
+        }
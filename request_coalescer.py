@@ -0,0 +1,67 @@
+import asyncio
+import concurrent.futures
+import threading
+
+
+class RequestCoalescer:
+    """
+    Single-flight for identical requests across threads and event loops.
+
+    The first caller for a key becomes the leader and makes the upstream
+    call; callers arriving while it is in flight wait on the leader's
+    concurrent.futures.Future and receive the same result. Streamlit runs
+    every session (and every engine run) on its own thread and event loop,
+    so a process-wide registry lets concurrent users share calls. If the
+    leader fails or is cancelled, waiters make their own call instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {} # key -> concurrent.futures.Future
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def run(self, key, call):
+        """
+        Awaits call() once per key among concurrent callers.
+
+        Args:
+            key: Rendered request key (see response_cache.cache_key)
+            call: Zero-argument coroutine function making the upstream call
+
+        Returns:
+            (result, coalesced): coalesced is True if another caller's call was shared
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            try:
+                # shield: a waiter being cancelled must not cancel the leader's future
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise # this waiter was cancelled, not the leader
+            return await call(), False
+
+        try:
+            result = await call()
+        except BaseException:
+            future.cancel() # waiters fall back to their own call
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+
+
+# Shared by all sessions and runs in this process (worker processes each have their own)
+REQUEST_COALESCER = RequestCoalescer()
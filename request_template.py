@@ -0,0 +1,151 @@
+import functools
+import json
+import re
+import logging # Import logging module
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+# Configuration page convention for templates without a {question} placeholder
+LEGACY_QUESTION_FIELDS = ("user_input", "question_entry")
+
+
+class RequestTemplate:
+    """
+    An API config compiled once into a request builder.
+
+    Headers are parsed up front and the payload template is split at its
+    {name} placeholders into literal text and slots, so rendering a request
+    is a single join. A slot inside a JSON string literal receives the
+    JSON-escaped value ("Answer: {question}"), anywhere else it receives a
+    complete JSON value ({"q": {question}}). Templates without a {question}
+    placeholder follow the Configuration page convention: the question goes
+    into the 'user_input' field, or a 'question_entry' field is added.
+    """
+
+    def __init__(self, url: str, method: str = "POST", headers: str = "{}", payload: str = ""):
+        """
+        Args:
+            url: Endpoint URL
+            method: HTTP method
+            headers: Headers as a JSON object string
+            payload: Payload template string
+
+        Raises:
+            json.JSONDecodeError: If headers are not valid JSON
+        """
+        self.url = url
+        self.method = (method or "POST").upper()
+        self.headers = json.loads(headers or "{}")
+        payload = payload or ""
+        if "{question}" not in payload:
+            payload = _legacy_template(payload)
+        self._literals, self._slots = _split(payload)
+        self.placeholders = tuple(sorted({name for name, _ in self._slots}))
+        # Decide once whether rendered payloads are JSON (sent as such) or plain text
+        try:
+            sample = json.loads(self.render_body(**{name: "" for name in self.placeholders}))
+        except json.JSONDecodeError:
+            sample = None
+            logging.warning(f"Payload template for {url} is not valid JSON. Sending it as plain text.")
+        self.is_json = sample is not None
+        self.is_object = isinstance(sample, dict)
+        if self.is_json and not any(key.lower() == "content-type" for key in self.headers):
+            self.headers["Content-Type"] = "application/json"
+
+    def render_body(self, question=None, **values) -> str:
+        """Renders the payload text with `question` and any other {name} values."""
+        if not self._slots:
+            return self._literals[0]
+        if question is not None:
+            values["question"] = question
+        literals = self._literals
+        parts = [literals[0]]
+        for i, (name, in_string) in enumerate(self._slots):
+            if name in values:
+                encoded = json.dumps(values[name])
+                parts.append(encoded[1:-1] if in_string and encoded[0] == '"' else encoded)
+            else:
+                parts.append("{" + name + "}") # unknown placeholders are left as written
+            parts.append(literals[i + 1])
+        return "".join(parts)
+
+    def render_headers(self, token: str = None) -> dict:
+        """Returns a fresh headers dict for this method (no Content-Type on GET), with a Bearer token if given."""
+        headers = dict(self.headers)
+        if self.method == "GET":
+            headers.pop("Content-Type", None)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    def render(self, question, token: str = None, **values):
+        """
+        Builds a request for one question.
+
+        Returns:
+            (method, url, headers, payload_data): payload_data is the rendered text,
+            or a dict of query parameters for GET requests with an object template
+        """
+        body = self.render_body(question, **values)
+        headers = self.render_headers(token)
+        if self.method == "GET":
+            return self.method, self.url, headers, json.loads(body) if self.is_object else body
+        return self.method, self.url, headers, body
+
+
+def _legacy_template(payload: str) -> str:
+    """Turns a {"user_input": ...} style template into one with a {question} slot."""
+    try:
+        parsed = json.loads(payload or "{}")
+    except json.JSONDecodeError:
+        return payload
+    if not isinstance(parsed, dict):
+        return payload
+    field = LEGACY_QUESTION_FIELDS[0] if LEGACY_QUESTION_FIELDS[0] in parsed else LEGACY_QUESTION_FIELDS[1]
+    parsed[field] = "{question}"
+    return json.dumps(parsed)
+
+
+def _split(template: str):
+    """
+    Splits a template at its placeholders.
+
+    Returns:
+        (literals, slots): len(literals) == len(slots) + 1, each slot is (name, inside_json_string)
+    """
+    literals, slots = [], []
+    in_string = False
+    escaped = False
+    start = 0
+    i = 0
+    while i < len(template):
+        char = template[i]
+        if escaped:
+            escaped = False
+        elif char == "\\" and in_string:
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+        elif char == "{":
+            match = PLACEHOLDER.match(template, i)
+            if match:
+                literals.append(template[start:i])
+                slots.append((match.group(1), in_string))
+                start = i = match.end()
+                continue
+        i += 1
+    literals.append(template[start:])
+    return literals, slots
+
+
+@functools.lru_cache(maxsize=128)
+def _compile(url, method, headers, payload):
+    return RequestTemplate(url, method, headers, payload)
+
+
+def compile_request(api_config) -> RequestTemplate:
+    """Returns the (cached) RequestTemplate for an API config from the Configuration page."""
+    return _compile(api_config.get("url") or "", (api_config.get("method") or "POST").upper(),
+                    api_config.get("headers") or "{}", api_config.get("payload") or "")
@@ -0,0 +1,187 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging # Import logging module
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CACHE_DB = "output/state/response_cache.db"
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_TTL = 24 * 3600 # seconds
+DEFAULT_MAX_DISK_BYTES = 100 * 1024 * 1024
+EVICT_TO = 0.9 # on overflow, evict down to this fraction of the size cap
+
+
+def cache_key(api_name: str, method: str, url: str, payload) -> str:
+    """Key for a rendered request: SHA-256 of API name, method, URL and body."""
+    if not isinstance(payload, (str, bytes)):
+        payload = json.dumps(payload, sort_keys=True, default=str)
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    digest = hashlib.sha256()
+    for part in (api_name.encode('utf-8'), method.encode('utf-8'), url.encode('utf-8'), payload):
+        digest.update(len(part).to_bytes(8, 'big')) # length-prefixed so fields can't run together
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of successful API responses.
+
+    An in-memory LRU of `memory_entries` answers repeats within a run; an
+    optional SQLite file (WAL mode, shared by worker processes) keeps
+    responses across runs. Entries older than `ttl` seconds are ignored and
+    the disk tier is trimmed, oldest first, once it exceeds `max_disk_bytes`.
+    """
+
+    def __init__(self, db_path: str = CACHE_DB, memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+                 ttl: float = DEFAULT_TTL, max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+        """
+        Args:
+            db_path: SQLite file for the disk tier (None for memory only)
+            memory_entries: Size of the in-memory LRU tier
+            ttl: Seconds an entry stays valid
+            max_disk_bytes: Size cap of the stored responses on disk
+        """
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict() # key -> (stored_at, entry)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_bytes = 0
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY,"
+                    " stored_at REAL NOT NULL,"
+                    " size INTEGER NOT NULL,"
+                    " entry TEXT NOT NULL"
+                    ") WITHOUT ROWID"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+                self._conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - ttl,))
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if self._disk_bytes > max_disk_bytes:
+                self._evict_locked() # the cap may have been lowered since the last run
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Builds a cache from the Configuration page's response_cache settings, or returns None if disabled."""
+        if not settings or not settings.get("enabled"):
+            return None
+        return cls(settings.get("db_path", CACHE_DB),
+                   memory_entries=settings.get("memory_entries", DEFAULT_MEMORY_ENTRIES),
+                   ttl=settings.get("ttl", DEFAULT_TTL),
+                   max_disk_bytes=settings.get("max_disk_mb", DEFAULT_MAX_DISK_BYTES / 1024 / 1024) * 1024 * 1024)
+
+    def get(self, key: str):
+        """Returns the cached entry for `key`, or None."""
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if now - item[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._memory[key]
+            if self._conn is not None:
+                row = self._conn.execute("SELECT stored_at, entry FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and now - row[0] <= self.ttl:
+                    entry = json.loads(row[1])
+                    self._remember(key, row[0], entry)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key: str, entry: dict):
+        """Stores a JSON-serializable entry in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, entry)
+            if self._conn is None:
+                return
+            text = json.dumps(entry, default=str)
+            try:
+                with self._conn:
+                    old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                    self._conn.execute("INSERT OR REPLACE INTO responses (key, stored_at, size, entry) VALUES (?, ?, ?, ?)",
+                                       (key, now, len(text), text))
+                self._disk_bytes += len(text) - (old[0] if old else 0)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_locked()
+            except sqlite3.Error as e:
+                logging.error(f"Error writing response cache {self.db_path}: {e}")
+
+    def _remember(self, key, stored_at, entry):
+        self._memory[key] = (stored_at, entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_locked(self):
+        target = self.max_disk_bytes * EVICT_TO
+        with self._conn:
+            self._conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY stored_at").fetchall()
+            expired = []
+            for key, size in rows:
+                if total <= target:
+                    break
+                expired.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", expired)
+        self._disk_bytes = total
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses")
+                self._disk_bytes = 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def count_duplicates(questions):
+    """
+    Pre-pass over the input: how many questions repeat an earlier one.
+
+    Returns:
+        Dict with total, unique and duplicates counts
+    """
+    seen = set()
+    total = 0
+    for question in questions:
+        total += 1
+        # 16-byte digests keep the set small for very large inputs
+        seen.add(hashlib.blake2b(str(question).encode('utf-8'), digest_size=16).digest())
+    return {"total": total, "unique": len(seen), "duplicates": total - len(seen)}
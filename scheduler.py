@@ -0,0 +1,124 @@
+import asyncio
+import collections
+import time
+
+DEFAULT_QUEUE_SIZE = 10000 # questions buffered per API before its producer waits
+IDLE_POLL = 0.05 # seconds between readiness checks while every API is rate limited
+
+
+class _ApiQueue:
+    def __init__(self, client, weight):
+        self.client = client
+        self.name = client.api_config.get("name", "Unnamed API")
+        self.weight = max(weight, 0.001)
+        self.current_weight = 0.0
+        self.items = collections.deque() # (index, question, enqueued_at)
+        self.dispatched = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.max_depth = 0
+
+    def stats(self):
+        return {
+            "queue_depth": len(self.items),
+            "queue_max_depth": self.max_depth,
+            "queue_wait_avg": self.wait_total / self.dispatched if self.dispatched else 0,
+            "queue_wait_max": self.wait_max,
+            "weight": self.weight
+        }
+
+
+class WeightedScheduler:
+    """
+    One work queue per API, dispatched by smooth weighted round robin.
+
+    Only APIs that have queued work, whose rate limit allows a request now
+    and that have no request already waiting on the rate limiter take part
+    in a round, so a slow API holds at most one worker while fast APIs use
+    the rest. Among those, each API's share of dispatches follows its
+    weight (api_config['weight'], default 1).
+    """
+
+    def __init__(self, clients, rate_limiter, queue_size: int = DEFAULT_QUEUE_SIZE, clock=time.monotonic):
+        """
+        Args:
+            clients: ApiClients of the run
+            rate_limiter: The run's RateLimiter (see api_client.RateLimiter.time_until_available)
+            queue_size: Maximum queued questions per API
+        """
+        self.queues = {client.api_config.get("name", "Unnamed API"): _ApiQueue(client, float(client.api_config.get("weight", 1) or 1))
+                       for client in clients}
+        self.rate_limiter = rate_limiter
+        self.queue_size = max(1, queue_size)
+        self._clock = clock
+        self._changed = asyncio.Condition()
+        self._closed = False
+
+    async def put(self, api_name, index, question):
+        """Queues a question for one API, waiting while that API's queue is full."""
+        queue = self.queues[api_name]
+        async with self._changed:
+            await self._changed.wait_for(lambda: len(queue.items) < self.queue_size)
+            queue.items.append((index, question, self._clock()))
+            queue.max_depth = max(queue.max_depth, len(queue.items))
+            self._changed.notify_all()
+
+    async def close(self):
+        """No more work will be queued; get() returns None once the queues are drained."""
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    async def get(self):
+        """
+        Waits for the next request to send.
+
+        Returns:
+            (client, index, question), or None when closed and drained
+        """
+        async with self._changed:
+            while True:
+                queue, delay = self._pick()
+                if queue is not None:
+                    index, question, enqueued_at = queue.items.popleft()
+                    waited = self._clock() - enqueued_at
+                    queue.dispatched += 1
+                    queue.wait_total += waited
+                    queue.wait_max = max(queue.wait_max, waited)
+                    self._changed.notify_all() # room for the producer
+                    return queue.client, index, question
+                if delay is None and self._closed:
+                    return None
+                try:
+                    # Woken by new work; otherwise re-check when the soonest rate limit frees up
+                    await asyncio.wait_for(self._changed.wait(), timeout=delay if delay is not None else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _pick(self):
+        """Smooth weighted round robin over the APIs that can send now; returns (queue or None, seconds to wait)."""
+        ready = []
+        delay = None
+        for queue in self.queues.values():
+            if not queue.items:
+                continue
+            if queue.client.waiting_for_rate_limit:
+                wait = IDLE_POLL # its last request has not got through the rate limiter yet
+            else:
+                wait = self.rate_limiter.time_until_available(queue.name)
+            if wait <= 0:
+                ready.append(queue)
+            else:
+                delay = wait if delay is None else min(delay, wait)
+        if not ready:
+            return None, delay
+        total = sum(queue.weight for queue in ready)
+        for queue in ready:
+            queue.current_weight += queue.weight
+        chosen = max(ready, key=lambda queue: queue.current_weight)
+        chosen.current_weight -= total
+        return chosen, 0
+
+    def stats(self):
+        """Returns {api_name: queue stats} (depth, max depth, average and maximum wait in seconds)."""
+        return {name: queue.stats() for name, queue in self.queues.items()}
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from output_writer import write_api_metrics, update_derived_metrics
+from state_manager import StateStore
+from response_cache import ResponseCache
+from metrics_store import MetricsStore
+from log_sink import configure_log_sinks
+from circuit_breaker import BREAKER_STATES, CLOSED
+from streaming_histogram import histogram_from
+from processing_engine import ProcessingEngine, new_api_metrics, update_rate_metrics, DEFAULT_MAX_CONCURRENCY, DEFAULT_TIMEOUT
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STOP_POLL_INTERVAL = 0.5 # seconds between checks of the stop signal (parent and workers)
+
+
+class ShardFailedError(RuntimeError):
+    """Raised by run_sharded() when worker processes failed; `api_metrics` holds the merged metrics of the others."""
+
+    def __init__(self, message, api_metrics):
+        super().__init__(message)
+        self.api_metrics = api_metrics
+
+
+def shard_questions(questions, workers: int):
+    """Splits questions round-robin into `workers` shards of (almost) equal size."""
+    return [questions[i::workers] for i in range(workers)]
+
+
+class QuestionShard:
+    """
+    Every `workers`-th question of a QuestionStream, starting at `shard`, read
+    lazily in the worker process (the round-robin split of shard_questions()
+    without loading the input). `total` is set once a pass has read it all.
+    """
+
+    def __init__(self, questions, shard: int, workers: int):
+        self.questions = questions
+        self.shard = shard
+        self.workers = workers
+        self.total = None
+
+    def __iter__(self):
+        count = 0
+        for index, question in enumerate(self.questions):
+            if index % self.workers == self.shard:
+                count += 1
+                yield question
+        self.total = count
+
+    def reopen(self):
+        """Another pass over the same shard (see input_handler.QuestionStream.reopen)."""
+        questions = self.questions.reopen()
+        return QuestionShard(questions, self.shard, self.workers) if questions is not None else None
+
+
+def merge_api_metrics(shard_metrics):
+    """
+    Merges per-worker api_metrics dicts into one dict per API.
+
+    Args:
+        shard_metrics: List of {api_name: metrics} dicts, one per worker
+
+    Returns:
+        {api_name: metrics} with counters summed and histograms merged
+    """
+    merged = {}
+    for api_metrics in shard_metrics:
+        for api_name, metrics in api_metrics.items():
+            target = merged.setdefault(api_name, new_api_metrics())
+            for key in ('processed', 'successes', 'errors', 'skipped', 'retries', 'retry_budget_exhausted', 'cache_hits', 'coalesced', 'shed',
+                        'latency_sum', 'latency_count',
+                        'payload_size_sum', 'payload_size_count'):
+                target[key] += metrics.get(key, 0)
+            for key in ('latency_histogram', 'payload_size_histogram'):
+                if key in metrics:
+                    target[key].merge(histogram_from(metrics[key]))
+            for key in ('rpm_counter', 'rps_counter'):
+                if key in metrics:
+                    target[key].merge(metrics[key])
+            for key in ('queue_max_depth', 'queue_wait_max'):
+                if key in metrics:
+                    target[key] = max(target.get(key, 0), metrics[key])
+            if 'queue_wait_avg' in metrics:
+                target.setdefault('_queue_wait_avgs', []).append(metrics['queue_wait_avg'])
+            if metrics.get('breaker_state') in BREAKER_STATES:
+                # Report the most severe state any worker ended in
+                current = target.get('breaker_state') or CLOSED
+                target['breaker_state'] = max(current, metrics['breaker_state'], key=BREAKER_STATES.index)
+            if metrics.get('concurrency_limit') is not None:
+                # Each worker tunes its own limiter; the API sees their sum
+                target['concurrency_limit'] = target.get('concurrency_limit', 0) + metrics['concurrency_limit']
+            if metrics.get('connections'):
+                connections = target.setdefault('connections', {})
+                for key in ('requests', 'connections_opened', 'tls_handshakes', 'http2_requests'):
+                    connections[key] = connections.get(key, 0) + metrics['connections'].get(key, 0)
+                connections['reuse_rate'] = (max(0, connections['requests'] - connections['connections_opened'])
+                                             / connections['requests'] if connections['requests'] else 0)
+            for code, count in metrics.get('status_codes', {}).items():
+                target['status_codes'][code] = target['status_codes'].get(code, 0) + count
+
+    for metrics in merged.values():
+        waits = metrics.pop('_queue_wait_avgs', None)
+        if waits:
+            metrics['queue_wait_avg'] = sum(waits) / len(waits)
+        update_rate_metrics(metrics)
+        update_derived_metrics(metrics)
+    return merged
+
+
+def _stop_check(stop_event, interval: float = STOP_POLL_INTERVAL):
+    """should_stop callable for a worker's engine; asks the parent's event (an IPC call) at most every `interval` seconds."""
+    state = {'checked': 0.0, 'stopped': False}
+
+    def stopped():
+        now = time.monotonic()
+        if not state['stopped'] and now - state['checked'] >= interval:
+            state['checked'] = now
+            state['stopped'] = stop_event.is_set()
+        return state['stopped']
+    return stopped
+
+
+def _progress_reporter(progress, shard: int, interval: float = STOP_POLL_INTERVAL):
+    """on_progress callable for a worker's engine; stores (done, total) in the parent's dict at most every `interval` seconds."""
+    state = {'reported': 0.0}
+
+    def report(done, total, final: bool = False):
+        now = time.monotonic()
+        if final or now - state['reported'] >= interval:
+            state['reported'] = now
+            progress[shard] = (done, total)
+    return report
+
+
+def _run_shard(shard, questions, api_configs, rate_limit_rate, rate_limit_period, rate_limit_burst, rate_share,
+               max_concurrency, timeout, retries, fan_out, state_db, cache_settings, coalesce, weighted, metrics_store_settings,
+               log_options, stop_event, progress):
+    """Worker process entry point: runs one engine (with its own HTTP clients) over a shard."""
+    report = _progress_reporter(progress, shard)
+    api_metrics = {}
+    if log_options:
+        configure_log_sinks(**log_options)
+    # Each worker opens its own connection; SQLite WAL allows concurrent writers across processes
+    state_store = StateStore(state_db, migrate_json=None) if state_db else None
+    response_cache = ResponseCache.from_settings(cache_settings)
+    # Rollups are additive, so all workers write the same run of the shared metrics database
+    metrics_store = MetricsStore(**metrics_store_settings) if metrics_store_settings else None
+    engine = ProcessingEngine(
+        api_configs,
+        api_metrics,
+        rate_limit_rate=rate_limit_rate,
+        rate_limit_period=rate_limit_period,
+        rate_limit_burst=rate_limit_burst,
+        rate_share=rate_share,
+        max_concurrency=max_concurrency,
+        timeout=timeout,
+        retries=retries,
+        should_stop=_stop_check(stop_event),
+        on_progress=report,
+        persist_metrics=False, # the parent writes the merged metrics
+        fan_out=fan_out,
+        state_store=state_store,
+        response_cache=response_cache,
+        coalesce=coalesce,
+        weighted=weighted,
+        metrics_store=metrics_store
+    )
+    try:
+        asyncio.run(engine.run(questions))
+    finally:
+        if state_store:
+            state_store.close()
+        if response_cache:
+            response_cache.close()
+        if metrics_store:
+            metrics_store.close()
+    total = len(questions) if isinstance(questions, list) else questions.total
+    report(engine.completed_questions, total, final=True)
+    return api_metrics
+
+
+def _split(questions, workers: int):
+    """Per-worker inputs: list slices, or a QuestionShard of a re-opened stream per worker."""
+    if isinstance(questions, (list, tuple)):
+        return shard_questions(list(questions), max(1, min(int(workers), len(questions) or 1)))
+    workers = max(1, int(workers))
+    streams = [questions.reopen() for _ in range(workers)] if hasattr(questions, 'reopen') else [None]
+    if None in streams:
+        # A file object that cannot be shared between processes: fall back to sending slices
+        logging.warning("Input cannot be re-opened by worker processes; loading it into memory for sharding.")
+        return _split(list(questions), workers)
+    return [QuestionShard(stream, shard, workers) for shard, stream in enumerate(streams)]
+
+
+def run_sharded(questions, api_configs, workers: int, rate_limit_rate: int = 15, rate_limit_period: int = 60,
+                max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: int = DEFAULT_TIMEOUT, retries: int = 3,
+                fan_out: bool = False, on_progress=None, state_db: str = None, rate_limit_burst: int = None,
+                cache_settings: dict = None, coalesce: bool = False, weighted: bool = False,
+                metrics_store_settings: dict = None, log_options: dict = None, should_stop=None):
+    """
+    Processes questions across several worker processes.
+
+    Each worker gets a round-robin shard of the questions, its own ApiClients
+    and an equal share of the global and per-API rate limits. Per-worker metrics are merged
+    and written to output/metrics/<api>_metrics.json once all workers finish.
+
+    Args:
+        questions: List of questions, or an input_handler.QuestionStream that every worker
+            re-opens and reads lazily, keeping its own round-robin share (see QuestionShard)
+        api_configs: API configurations from the Configuration page
+        workers: Number of worker processes
+        rate_limit_rate: Global rate limit (requests per period), shared by all workers
+        rate_limit_period: Global rate limit period in seconds
+        max_concurrency: Maximum number of requests in flight per worker
+        timeout: Per-request timeout in seconds
+        retries: Attempts per request
+        fan_out: Send each question to all APIs at once (see ProcessingEngine)
+        on_progress: Optional callable(completed_questions, total_questions), called every
+            STOP_POLL_INTERVAL seconds with the workers' progress (total is None until known)
+        state_db: Optional StateStore database to resume from and checkpoint to
+        rate_limit_burst: Global burst size, also shared between workers
+        cache_settings: Optional response cache settings (see ResponseCache.from_settings);
+            workers share the disk tier and each keeps its own memory tier
+        coalesce: Share identical in-flight requests (within each worker process)
+        weighted: Per-API weighted queues in every worker (see ProcessingEngine)
+        metrics_store_settings: Optional MetricsStore keyword arguments (db_path, run_id,
+            keep_samples); every worker opens its own store on the same run
+        log_options: Optional configure_log_sinks() options applied in every worker
+        should_stop: Optional callable returning True when processing should stop; polled
+            every STOP_POLL_INTERVAL seconds and passed on to the workers' engines
+
+    Returns:
+        Merged {api_name: metrics} dict
+
+    Raises:
+        ShardFailedError: If any worker process failed (after the other workers' metrics were written)
+    """
+    shards = _split(questions, workers)
+    workers = len(shards)
+    rate_share = 1 / workers
+
+    shard_metrics = []
+    failures = []
+    # spawn rather than fork: the parent may be a multi-threaded Streamlit server
+    context = multiprocessing.get_context("spawn")
+    # The stop signal and the progress reports live in a manager process so the spawned workers can reach them
+    manager = context.Manager()
+    try:
+        stop_event = manager.Event()
+        progress = manager.dict() # shard -> (completed questions, total or None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(_run_shard, shard, questions_of_shard, api_configs, rate_limit_rate, rate_limit_period,
+                                rate_limit_burst, rate_share, max_concurrency, timeout, retries, fan_out, state_db,
+                                cache_settings, coalesce, weighted, metrics_store_settings, log_options, stop_event, progress)
+                for shard, questions_of_shard in enumerate(shards)
+            ]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=STOP_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if should_stop and not stop_event.is_set() and should_stop():
+                    logging.info("Processing stopped by user; stopping worker processes.")
+                    stop_event.set()
+                    for future in pending:
+                        future.cancel() # shards that have not started yet
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    try:
+                        shard_metrics.append(future.result())
+                    except Exception as e:
+                        logging.error(f"Worker process failed: {e}")
+                        failures.append(f"{type(e).__name__}: {e}")
+                if on_progress:
+                    reports = list(progress.values())
+                    totals = [total for _, total in reports]
+                    known = len(reports) == workers and None not in totals
+                    on_progress(sum(done for done, _ in reports), sum(totals) if known else None)
+    finally:
+        manager.shutdown()
+
+    merged = merge_api_metrics(shard_metrics)
+    for api_name, metrics in merged.items():
+        write_api_metrics(api_name, metrics)
+    if failures:
+        raise ShardFailedError(f"{len(failures)} of {workers} worker processes failed; their questions were not "
+                               f"processed ({'; '.join(failures)})", merged)
+    return merged
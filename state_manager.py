@@ -1,13 +1,183 @@
 # state_manager.py
 
+import hashlib
 import json
 import os
+import sqlite3
+import threading
+import time
 import logging # Import logging module
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-STATE_FILE = "processing_state.json"
+STATE_FILE = "processing_state.json" # Legacy JSON state, migrated into STATE_DB
+STATE_DB = "processing_state.db"
+DEFAULT_COMMIT_BATCH = 500 # pending marks per transaction
+_QUERY_CHUNK = 500 # hashes per IN (...) lookup, well below SQLite's variable limit
+
+
+def question_key(question) -> str:
+    """Stable key for a question: SHA-256 of its text."""
+    return hashlib.sha256(str(question).encode('utf-8')).hexdigest()
+
+
+class StateStore:
+    """
+    Resumable processing state in an embedded SQLite database (WAL mode).
+
+    Each completed (question, API) pair is one row keyed by the hash of the
+    question plus the API name. Marks are buffered and committed in batched
+    transactions; lookups use the primary-key index, and processed_among()
+    answers "which of these N questions are done" in a few queries.
+    """
+
+    def __init__(self, db_path: str = STATE_DB, commit_batch: int = DEFAULT_COMMIT_BATCH,
+                 migrate_json: str = STATE_FILE):
+        """
+        Args:
+            db_path: SQLite database file
+            commit_batch: Number of pending marks that triggers a commit
+            migrate_json: Legacy JSON state file imported on first open (None to skip)
+        """
+        self.db_path = db_path
+        self.commit_batch = commit_batch
+        self._lock = threading.Lock()
+        self._pending = {} # (question_hash, api_name) -> processed_at
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed ("
+                " question_hash TEXT NOT NULL,"
+                " api_name TEXT NOT NULL,"
+                " processed_at REAL NOT NULL,"
+                " PRIMARY KEY (question_hash, api_name)"
+                ") WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if migrate_json and os.path.exists(migrate_json):
+            self.migrate_from_json(migrate_json)
+
+    def mark_processed(self, question, api_name: str):
+        """Marks a question as processed by an API; committed with the next batch."""
+        with self._lock:
+            self._pending[(question_key(question), api_name)] = time.time()
+            if len(self._pending) >= self.commit_batch:
+                self._commit_locked()
+
+    def commit(self):
+        """Writes all pending marks in one transaction."""
+        with self._lock:
+            self._commit_locked()
+
+    def _commit_locked(self):
+        if not self._pending:
+            return
+        rows = [(h, api, at) for (h, api), at in self._pending.items()]
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed (question_hash, api_name, processed_at) VALUES (?, ?, ?)",
+                    rows
+                )
+            self._pending.clear()
+        except sqlite3.Error as e:
+            logging.error(f"Error saving state to {self.db_path}: {e}")
+
+    def is_processed(self, question, api_name: str) -> bool:
+        """Checks if a question has been processed by a specific API."""
+        key = (question_key(question), api_name)
+        with self._lock:
+            if key in self._pending:
+                return True
+            row = self._conn.execute(
+                "SELECT 1 FROM processed WHERE question_hash = ? AND api_name = ?", key
+            ).fetchone()
+        return row is not None
+
+    def processed_among(self, questions, api_name: str):
+        """
+        Bulk lookup for a batch of questions.
+
+        Returns:
+            List of booleans, True where questions[i] was processed by api_name
+        """
+        hashes = [question_key(q) for q in questions]
+        done = set()
+        with self._lock:
+            for h in hashes:
+                if (h, api_name) in self._pending:
+                    done.add(h)
+            unique = list(set(hashes) - done)
+            for start in range(0, len(unique), _QUERY_CHUNK):
+                chunk = unique[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT question_hash FROM processed WHERE api_name = ? AND question_hash IN ({placeholders})",
+                    [api_name, *chunk]
+                )
+                done.update(row[0] for row in rows)
+        return [h in done for h in hashes]
+
+    def count(self, api_name: str = None) -> int:
+        """Number of processed pairs, optionally for one API."""
+        self.commit()
+        with self._lock:
+            if api_name is None:
+                return self._conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM processed WHERE api_name = ?", (api_name,)).fetchone()[0]
+
+    def clear(self):
+        """Forgets all processed pairs."""
+        with self._lock:
+            self._pending.clear()
+            with self._conn:
+                self._conn.execute("DELETE FROM processed")
+
+    def migrate_from_json(self, state_file: str = STATE_FILE) -> int:
+        """
+        Imports a legacy {question: {api_name: bool}} JSON state file once.
+
+        Returns:
+            Number of (question, API) pairs imported (0 if already migrated)
+        """
+        source = os.path.abspath(state_file)
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (f"migrated:{source}",)).fetchone()
+        if row:
+            return 0
+
+        state = load_state(state_file)
+        now = time.time()
+        rows = [(question_key(question), api_name, now)
+                for question, apis in state.items()
+                for api_name, done in apis.items() if done]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed (question_hash, api_name, processed_at) VALUES (?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                   (f"migrated:{source}", str(now)))
+        logging.info(f"Migrated {len(rows)} processed entries from {state_file} to {self.db_path}")
+        return len(rows)
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# --- Legacy JSON state (kept for migration and existing callers) ---
 
 def load_state(state_file=STATE_FILE):
     """Loads the processing state from a JSON file."""
@@ -48,15 +218,18 @@ def save_state(state, state_file=STATE_FILE):
 
 def is_processed(state, question, api_name):
     """Checks if a question has been processed by a specific API."""
+    if isinstance(state, StateStore):
+        return state.is_processed(question, api_name)
     # Ensure question is hashable if used as a dictionary key.
     # For simplicity, assuming question is a string or other hashable type.
     return state.get(question, {}).get(api_name, False)
 
 def mark_as_processed(state, question, api_name):
     """Marks a question as processed by a specific API."""
+    if isinstance(state, StateStore):
+        state.mark_processed(question, api_name)
+        return
     # Ensure question is hashable
     if question not in state:
         state[question] = {}
     state[question][api_name] = True
-
-# TODO: Consider more robust state management for very large datasets (e.g., using a database)
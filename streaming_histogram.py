@@ -0,0 +1,137 @@
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01 # percentiles are accurate to within 1%
+DEFAULT_MIN_VALUE = 1e-6 # values at or below this are counted in the zero bucket
+DEFAULT_MAX_BUCKETS = 2048
+
+# Percentiles reported in metrics files and on the dashboards: (label, percentile)
+REPORTED_PERCENTILES = (("p50", 50), ("p90", 90), ("p99", 99), ("p99.9", 99.9))
+
+
+class StreamingHistogram:
+    """
+    Mergeable, fixed-memory histogram with relative-error percentiles.
+
+    Values are counted in logarithmic buckets (as in DDSketch): bucket i holds
+    values in (gamma**(i-1), gamma**i] with gamma = (1+a)/(1-a), so any
+    reported percentile is within relative accuracy `a` of the true value.
+    Memory is bounded by `max_buckets`; beyond it the lowest buckets are
+    collapsed, which only affects the smallest values. Two histograms with
+    the same accuracy merge by adding their bucket counts.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+                 min_value: float = DEFAULT_MIN_VALUE, max_buckets: int = DEFAULT_MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {} # bucket index -> count
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float, count: int = 1):
+        """Records `value` (`count` times)."""
+        if value <= self.min_value:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def _collapse(self):
+        # Fold the lowest buckets into the smallest one that is kept
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def merge(self, other: "StreamingHistogram"):
+        """Adds all values recorded in `other` (which must use the same accuracy)."""
+        if not math.isclose(other.relative_accuracy, self.relative_accuracy):
+            raise ValueError("Cannot merge histograms with different relative accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def percentile(self, percentile: float):
+        """Returns the value at `percentile` (0-100), or 0 if nothing was recorded."""
+        if not self.count:
+            return 0
+        rank = percentile / 100 * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return self.min
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket in relative terms, clamped to the observed range
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def percentiles(self):
+        """Returns {label: value} for REPORTED_PERCENTILES."""
+        return {label: self.percentile(p) for label, p in REPORTED_PERCENTILES}
+
+    def to_dict(self):
+        """Compact JSON-serializable form: dense counts from the lowest bucket index."""
+        offset = min(self.buckets) if self.buckets else 0
+        counts = [0] * ((max(self.buckets) - offset + 1) if self.buckets else 0)
+        for index, count in self.buckets.items():
+            counts[index - offset] = count
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "min_value": self.min_value,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "zero_count": self.zero_count,
+            "offset": offset,
+            "counts": counts
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StreamingHistogram":
+        histogram = cls(data.get("relative_accuracy", DEFAULT_RELATIVE_ACCURACY),
+                        data.get("min_value", DEFAULT_MIN_VALUE))
+        offset = data.get("offset", 0)
+        histogram.buckets = {offset + i: count for i, count in enumerate(data.get("counts", [])) if count}
+        histogram.zero_count = data.get("zero_count", 0)
+        histogram.count = data.get("count", 0)
+        histogram.sum = data.get("sum", 0.0)
+        histogram.min = data.get("min")
+        histogram.max = data.get("max")
+        return histogram
+
+
+def histogram_from(value) -> StreamingHistogram:
+    """Accepts a StreamingHistogram or its to_dict() form (e.g. read from a metrics file)."""
+    if isinstance(value, StreamingHistogram):
+        return value
+    if isinstance(value, dict):
+        return StreamingHistogram.from_dict(value)
+    return StreamingHistogram()
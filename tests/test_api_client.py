@@ -0,0 +1,65 @@
+import asyncio
+
+import httpx
+
+import api_client
+from api_client import ApiClient, RateLimiter
+
+
+class CountingRateLimiter(RateLimiter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reservations = []
+
+    def reserve_api(self, api_name=None):
+        self.reservations.append(api_name)
+        return super().reserve_api(api_name)
+
+
+def test_every_retry_takes_a_rate_limit_slot():
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(503, json={"error": "unavailable"})
+
+    async def scenario():
+        limiter = CountingRateLimiter(1000, 1, api_limits={"API 1": {"rate": 1000, "period": 1}})
+        client = ApiClient({"name": "API 1", "url": "http://api.test/ask", "method": "POST"}, limiter)
+        await client.client.aclose()
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            result = await client.call_api_detailed("question", retries=3, backoff_factor=0)
+        return limiter, result
+
+    limiter, result = asyncio.run(scenario())
+    assert result["status_code"] == 503 and result["retries"] == 2
+    assert len(sent) == 3
+    assert limiter.reservations == ["API 1"] * 3
+
+
+def test_token_refresh_resend_keeps_get_headers(monkeypatch):
+    sent = []
+    tokens = iter(["old", "new"])
+
+    def handler(request):
+        if request.url.path == "/token":
+            return httpx.Response(200, json={"token": next(tokens)})
+        sent.append(request)
+        if request.headers["Authorization"] == "Bearer old":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"answer": 42})
+
+    monkeypatch.setattr(api_client, "build_http_client",
+                        lambda api_config, timeout: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def scenario():
+        api_config = {"name": "API 1", "url": "http://api.test/ask", "method": "GET",
+                      "payload": '{"q": "{question}"}', "auth_config": {"auth_url": "http://api.test/token"}}
+        async with ApiClient(api_config, RateLimiter(1000, 1)) as client:
+            return await client.call_api_detailed("question")
+
+    result = asyncio.run(scenario())
+    assert result["success"] and result["retries"] == 1
+    assert [request.headers["Authorization"] for request in sent] == ["Bearer old", "Bearer new"]
+    assert [request.headers.get("Content-Type") for request in sent] == [None, None]
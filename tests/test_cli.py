@@ -0,0 +1,50 @@
+import json
+from datetime import datetime
+
+from cli import error_rate, main
+from log_sink import LogSink, log_segments, COMPRESSION_GZIP
+
+
+def test_error_rate_counts_failures_without_response():
+    # A dead API: no responses at all, timeouts and calls shed by the open breaker
+    assert error_rate({'processed': 0, 'errors': 16, 'shed': 184}) == 100.0
+
+
+def test_error_rate_matches_error_percentage():
+    assert error_rate({'processed': 90, 'errors': 10}) == 10.0
+    assert error_rate({'processed': 0, 'errors': 0}) == 0.0
+
+
+def write_calls_log(log_dir, api_name, records, **sink_options):
+    sink = LogSink(log_dir / f"{api_name}_calls.jsonl", **sink_options)
+    for record in records:
+        sink.write(record)
+    sink.close()
+
+
+def call_record(timestamp, status_code):
+    return {"timestamp": datetime.fromtimestamp(timestamp).isoformat(), "api_name": "API 1",
+            "request": {"question": f"q{timestamp}"}, "response": {"status_code": status_code}}
+
+
+def test_extract_reads_rotated_gzip_segments(tmp_path, capsys):
+    base = 1_700_000_000
+    write_calls_log(tmp_path, "API 1", [call_record(base + i, 500 if i % 10 == 0 else 200) for i in range(100)],
+                    compression=COMPRESSION_GZIP, rotate_bytes=2000, batch_size=7)
+    assert len(log_segments(tmp_path / "API 1_calls.jsonl")) > 1
+
+    assert main(["extract", "--api", "API 1", "--log-dir", str(tmp_path), "--errors-only",
+                 "--since", str(base + 20), "--until", str(base + 60)]) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [record["request"]["question"] for record in records] == [f"q{base + i}" for i in (20, 30, 40, 50)]
+
+    output = tmp_path / "out" / "ok.jsonl"
+    assert main(["extract", "--api", "API 1", "--log-dir", str(tmp_path), "--status", "200", "-o", str(output)]) == 0
+    assert len(output.read_text().splitlines()) == 90
+
+
+def test_extract_reads_plain_log_and_rejects_unknown_api(tmp_path, capsys):
+    write_calls_log(tmp_path, "API 1", [call_record(1_700_000_000, None), call_record(1_700_000_001, 200)])
+    assert main(["extract", "--api", "API 1", "--log-dir", str(tmp_path), "--errors-only"]) == 0
+    assert len(capsys.readouterr().out.splitlines()) == 1
+    assert main(["extract", "--api", "API 2", "--log-dir", str(tmp_path)]) == 2
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import processing_engine
+from processing_engine import ProcessingEngine
+
+
+class FakeClient:
+    """Stands in for ApiClient: takes rate limit slots like the real one and answers at once."""
+
+    def __init__(self, api_config, rate_limiter, **kwargs):
+        self.api_config = api_config
+        self.rate_limiter = rate_limiter
+        self.waiting_for_rate_limit = 0
+        self.finished_at = None
+
+    async def call_api_detailed(self, question, retries=3):
+        name = self.api_config["name"]
+        self.waiting_for_rate_limit += 1
+        try:
+            await self.rate_limiter.wait_for_permission(name)
+        finally:
+            self.waiting_for_rate_limit -= 1
+        await asyncio.sleep(0.001)
+        FINISHED[name] = time.monotonic()
+        return {"request": {"headers": {}, "payload": question, "url": "", "method": "POST"}, "response": {},
+                "response_headers": {}, "latency": 0.001, "payload_size": 2, "status_code": 200, "success": True,
+                "completion_time": time.monotonic(), "retries": 0}
+
+    async def aclose(self):
+        pass
+
+
+FINISHED = {}
+
+
+def test_weighted_mode_does_not_hold_fast_api_to_slow_api_pace(monkeypatch):
+    monkeypatch.setattr(processing_engine, "ApiClient", FakeClient)
+    monkeypatch.setattr(processing_engine, "write_api_log", lambda *args: None)
+    FINISHED.clear()
+    api_configs = [{"name": "slow", "url": "http://slow.test", "rate_limit": {"rate": 50, "period": 1, "burst": 1}},
+                   {"name": "fast", "url": "http://fast.test"}]
+    api_metrics = {}
+    progress = []
+    engine = ProcessingEngine(api_configs, api_metrics, rate_limit_rate=10000, rate_limit_period=1,
+                              max_concurrency=4, persist_metrics=False, weighted=True, scheduler_queue_size=2,
+                              on_progress=lambda done, total: progress.append(done))
+    started = time.monotonic()
+    asyncio.run(engine.run([f"q{i}" for i in range(30)]))
+
+    assert api_metrics["slow"]["processed"] == api_metrics["fast"]["processed"] == 30
+    slow_time, fast_time = FINISHED["slow"] - started, FINISHED["fast"] - started
+    assert slow_time > 0.5 # 30 requests at 50/s
+    assert fast_time < slow_time / 3 # not paced by the slow API's full queue
+    assert progress[-1] == 30 and progress == sorted(progress)
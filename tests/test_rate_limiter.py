@@ -0,0 +1,52 @@
+import asyncio
+
+from api_client import RateLimiter
+
+
+class VirtualClock:
+    """Clock for RateLimiter: time only moves when the test advances it; sleeps are recorded and block."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = [] # (delay, asyncio.Event released by the test)
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        event = asyncio.Event()
+        self.sleeps.append((delay, event))
+        await event.wait()
+
+
+def test_slow_api_does_not_delay_fast_api():
+    async def scenario():
+        clock = VirtualClock()
+        limiter = RateLimiter(100, 1, api_limits={"slow": {"rate": 1, "period": 1}}, clock=clock, sleep=clock.sleep)
+        slow = [asyncio.create_task(limiter.wait_for_permission("slow")) for _ in range(20)]
+        await asyncio.sleep(0)
+        # The first slow request goes at once, the other 19 wait 1..19s for their per-API slots
+        assert [delay for delay, _ in clock.sleeps] == [float(i) for i in range(1, 20)]
+
+        clock.sleeps.clear()
+        await asyncio.wait_for(limiter.wait_for_permission("fast"), timeout=1)
+        assert clock.sleeps == [] # the fast API is not throttled by the slow API's queue
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_api_slot_takes_global_slot_when_due():
+    clock = VirtualClock()
+    limiter = RateLimiter(2, 1, burst=1, api_limits={"slow": {"rate": 1, "period": 1}}, clock=clock, sleep=clock.sleep)
+    assert limiter.reserve_api("slow") == 0
+    assert limiter.reserve_global() == 0
+    assert limiter.reserve_api("slow") == 1 # per-API budget: one per second
+    assert limiter.reserve_global() == 0.5 # the global budget is still enforced for everyone
+    assert limiter.reserve_api("fast") == 0
+    assert limiter.reserve_global() == 1.0
+    clock.now = 1.0
+    assert limiter.time_until_available("slow") == 1.0
+    assert limiter.time_until_available("fast") == 0.5
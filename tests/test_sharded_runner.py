@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from input_handler import QuestionStream
+from sharded_runner import run_sharded, QuestionShard, ShardFailedError
+
+
+def test_failed_workers_fail_the_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api_configs = [{"name": "API 1", "url": "http://127.0.0.1:9/"}]
+    # A zero global rate is rejected by the rate limiter inside each worker process
+    with pytest.raises(ShardFailedError, match="2 of 2 worker processes failed"):
+        run_sharded(["q1", "q2", "q3"], api_configs, 2, rate_limit_rate=0)
+
+
+def test_stop_reaches_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api_configs = [{"name": "API 1", "url": "http://127.0.0.1:9/"}]
+    stop_at = time.monotonic() + 3
+    started = time.monotonic()
+    # 200 questions at 5 requests/s would take 40s without the stop
+    merged = run_sharded([f"q{i}" for i in range(200)], api_configs, 2, rate_limit_rate=5, rate_limit_period=1,
+                         should_stop=lambda: time.monotonic() >= stop_at)
+    assert time.monotonic() - started < 20
+    attempted = merged["API 1"]["processed"] + merged["API 1"]["errors"] + merged["API 1"]["shed"]
+    assert attempted < 100
+
+
+def test_workers_read_their_share_of_a_question_stream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    input_path = tmp_path / "questions.txt"
+    input_path.write_text("".join(f"q{i}\n" for i in range(7)))
+    questions = QuestionStream(str(input_path), "txt")
+    shards = [QuestionShard(questions.reopen(), shard, 3) for shard in range(3)]
+    assert [list(shard) for shard in shards] == [["q0", "q3", "q6"], ["q1", "q4"], ["q2", "q5"]]
+    assert [shard.total for shard in shards] == [3, 2, 2]
+
+    progress = []
+    api_configs = [{"name": "API 1", "url": "http://127.0.0.1:9/", "circuit_breaker": {"enabled": False}}]
+    merged = run_sharded(questions, api_configs, 3, rate_limit_rate=1000, rate_limit_period=1, retries=1,
+                         on_progress=lambda done, total: progress.append((done, total)))
+    assert merged["API 1"]["errors"] == 7
+    assert progress[-1] == (7, 7)
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import json
+import time
+import logging # Import logging module
+
+try:
+    from jsonpath_ng import parse as jsonpath_parse # For JSON path extraction
+except ImportError:
+    jsonpath_parse = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_TOKEN_PATH = "token"
+DEFAULT_EXPIRES_IN_PATH = "expires_in"
+DEFAULT_REFRESH_MARGIN = 60 # seconds before expiry to refresh in the background
+REFRESH_RETRY_INTERVAL = 5 # seconds between attempts after a failed refresh
+
+
+def extract_path(data, path: str):
+    """
+    Returns the first value at a JSON path in `data`, or None.
+
+    Uses jsonpath-ng when installed; otherwise supports plain dotted paths
+    such as "data.access_token" (with an optional leading "$.").
+    """
+    if not path:
+        return None
+    if jsonpath_parse is not None:
+        matches = [match.value for match in jsonpath_parse(path).find(data)]
+        return matches[0] if matches else None
+    value = data
+    for part in path.removeprefix("$.").split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def jwt_expiry(token: str):
+    """Returns the 'exp' claim of a JWT as an epoch timestamp, or None if the token is not a JWT."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+def parse_token_response(auth_config, data):
+    """
+    Extracts the token and its expiry from an auth endpoint's JSON response.
+
+    The expiry comes from auth_config['expires_in_path'] (seconds, default
+    "expires_in"), else the token's JWT 'exp' claim, else
+    auth_config['token_ttl'] seconds; without any of these it is None
+    (the token is used until the API answers 401).
+
+    Returns:
+        (token, expires_at): expires_at is an epoch timestamp or None
+
+    Raises:
+        ValueError: If the token path is not found in the response
+    """
+    token_path = auth_config.get("token_path") or DEFAULT_TOKEN_PATH
+    token = extract_path(data, token_path)
+    if not token:
+        raise ValueError(f"Token path '{token_path}' not found in response")
+    token = str(token)
+
+    expires_in = extract_path(data, auth_config.get("expires_in_path") or DEFAULT_EXPIRES_IN_PATH)
+    if isinstance(expires_in, (int, float)) or (isinstance(expires_in, str) and expires_in.isdigit()):
+        return token, time.time() + float(expires_in)
+    expires_at = jwt_expiry(token)
+    if expires_at is None and auth_config.get("token_ttl"):
+        expires_at = time.time() + float(auth_config["token_ttl"])
+    return token, expires_at
+
+
+class TokenManager:
+    """
+    Fetches and refreshes the bearer token of one API during a run.
+
+    The token is cached with its expiry. Within `refresh_margin` seconds of
+    expiry a refresh starts in the background while requests keep using the
+    current token; an expired or missing token is refreshed before use.
+    Concurrent refreshes share one call to the auth endpoint.
+    """
+
+    def __init__(self, auth_config, client, refresh_margin: float = DEFAULT_REFRESH_MARGIN, clock=time.time):
+        """
+        Args:
+            auth_config: The API config's auth_config (auth_url, auth_method, auth_headers,
+                auth_payload, token_path, ...); current_token is updated after each refresh
+            client: httpx.AsyncClient used to call the auth endpoint
+            refresh_margin: Seconds before expiry at which a background refresh starts
+        """
+        self.auth_config = auth_config
+        self.client = client
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self.token = auth_config.get("current_token") or None
+        self.expires_at = auth_config.get("token_expires_at") if self.token else None
+        self.refreshes = 0
+        self._refresh_task = None
+        self._failed_at = None
+
+    @classmethod
+    def from_config(cls, api_config, client):
+        """Returns a TokenManager if the API has an auth endpoint configured, else None."""
+        auth_config = api_config.get("auth_config") or {}
+        if not auth_config.get("auth_url"):
+            return None
+        return cls(auth_config, client, auth_config.get("refresh_margin", DEFAULT_REFRESH_MARGIN))
+
+    def _remaining(self):
+        return float("inf") if self.expires_at is None else self.expires_at - self._clock()
+
+    async def get_token(self):
+        """Returns a usable token, refreshing first if there is none or it has expired."""
+        if self._failed_at is not None and self._clock() - self._failed_at < REFRESH_RETRY_INTERVAL:
+            return self.token # auth endpoint just failed; don't call it for every request
+        if not self.token or self._remaining() <= 0:
+            return await self.refresh()
+        if self._remaining() <= self.refresh_margin and (self._refresh_task is None or self._refresh_task.done()):
+            self._start_refresh()
+        return self.token
+
+    async def refresh(self, stale_token: str = None):
+        """
+        Fetches a new token, joining a refresh that is already running.
+
+        Args:
+            stale_token: The token that was rejected; if a newer one already exists it is returned as is
+        """
+        if stale_token is not None and self.token and self.token != stale_token:
+            return self.token
+        if self._refresh_task is None or self._refresh_task.done():
+            self._start_refresh()
+        # shield: one cancelled request must not cancel the refresh the others wait on
+        await asyncio.shield(self._refresh_task)
+        return self.token
+
+    def _start_refresh(self):
+        self._refresh_task = asyncio.get_running_loop().create_task(self._fetch())
+
+    async def _fetch(self):
+        auth_config = self.auth_config
+        try:
+            response = await self.client.request(
+                (auth_config.get("auth_method") or "POST").upper(),
+                auth_config["auth_url"],
+                headers=json.loads(auth_config.get("auth_headers") or "{}"),
+                json=json.loads(auth_config.get("auth_payload") or "{}")
+            )
+            response.raise_for_status()
+            token, expires_at = parse_token_response(auth_config, response.json())
+        except Exception as e:
+            # Keep the old token; requests will fail (and retry the refresh) if it is really invalid
+            logging.error(f"Failed to refresh token from {auth_config.get('auth_url')}: {e}")
+            self._failed_at = self._clock()
+            return
+        self._failed_at = None
+        if expires_at is not None:
+            # Don't refresh a short-lived token on every call: the margin is at most half its lifetime
+            lifetime = expires_at - self._clock()
+            self.refresh_margin = min(self.refresh_margin, max(0, lifetime / 2))
+        self.token = token
+        self.expires_at = expires_at
+        self.refreshes += 1
+        # Only this run's copy of the config (the job deep-copies it); the Configuration page keeps its own token
+        auth_config["current_token"] = token
+        auth_config["token_expires_at"] = expires_at
+        logging.info(f"Refreshed token from {auth_config.get('auth_url')}")